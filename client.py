@@ -4,162 +4,3733 @@ Client04.py - 2507302045 - Quản lý MT5 và Firebase từ xa
 Chạy trên Android (Termux) để quản lý thông tin tài khoản và Firebase
 """
 
-import requests
+import time
+
+STARTUP_STARTED = time.perf_counter()  # Mốc đo thời gian khởi động nguội (--startup-profile)
+
+import importlib
+import importlib.util
 import json
 import os
+import shutil
+import sqlite3
 import sys
 
-import time
+import argparse
+import base64
+import csv
+import fnmatch
+import functools
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import math
+import random
+import re
+import shlex
 import threading
-from datetime import datetime
+import unicodedata
+import uuid
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import (ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed,
+                                wait)
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+
+class LazyModule:
+    """Module chỉ được import khi truy cập thuộc tính lần đầu
+
+    requests (~150ms) và asyncio (~60ms) chiếm phần lớn thời gian import trên Termux. Chúng được
+    import trên thread nền (event loop, health check) nên menu hiển thị ngay.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+            startup_profile.mark(f"import {self._name}")
+        return getattr(self._module, attr)
+
+
+class StartupProfile:
+    """Mốc thời gian khởi động, tính từ lúc bắt đầu import client.py"""
+
+    def __init__(self, started):
+        self.started = started
+        self.marks = {}
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+
+    def mark(self, name):
+        """Ghi mốc (chỉ lần đầu mỗi tên)"""
+        with self._lock:
+            self.marks.setdefault(name, time.perf_counter() - self.started)
+
+    def report(self):
+        lines = ["⏱️ STARTUP PROFILE (ms kể từ lúc import client.py):"]
+        for name, elapsed in sorted(self.marks.items(), key=lambda item: item[1]):
+            lines.append(f"  {elapsed * 1000:>8.1f}  {name}")
+        return lines
+
+
+startup_profile = StartupProfile(STARTUP_STARTED)
+requests = LazyModule('requests')
+asyncio = LazyModule('asyncio')
+urllib3_exceptions = LazyModule('urllib3.exceptions')
 
 # Cấu hình
 SERVER_URL = "https://2506260734c7.ngrok-free.app"  # Ngrok URL
 TIMEOUT = 10
+CLIENT_DATA_DIR = os.path.expanduser(os.environ.get('MT5_CLIENT_HOME', '~/.mt5_client'))  # Dữ liệu lưu trên máy
+POOL_SIZE = 8  # Số kết nối keep-alive tối đa dùng chung qua tunnel
+SERVERS_FILE = os.path.join(CLIENT_DATA_DIR, 'servers.json')  # Danh sách nhiều server MT5 bot
+FANOUT_TIMEOUT = 20  # Thời gian chờ tối đa khi gọi song song tất cả server (giây)
+
+# Timeout (connect, read) theo từng loại endpoint, tính bằng giây
+ENDPOINT_TIMEOUTS = {
+    'health': (3, 5),
+    'read': (5, TIMEOUT),
+    'write': (5, 30),
+    'bulk': (5, 120),  # clear collection / clear-old có thể chạy lâu trên server
+    'stream': (5, 45),  # Server gửi heartbeat mỗi ~15 giây, quá 45 giây im lặng coi như đứt
+}
+
+# Retry với exponential backoff có jitter
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8
+RETRY_BUDGET_RATIO = 0.2  # Mỗi request "nạp" 0.2 lượt retry -> retry tối đa ~20% lưu lượng
+RETRY_BUDGET_MIN = 5  # Số lượt retry luôn có sẵn khi mới khởi động
+RETRY_STATUS_CODES = {429, 502, 503, 504}  # Lỗi tạm thời từ ngrok / server
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# Cache response cho các endpoint chỉ đọc: (pattern path, TTL giây).
+# TTL = 0 nghĩa là luôn hỏi lại server nhưng dùng ETag/Last-Modified để nhận 304 thay vì cả payload.
+CACHE_TTLS = [
+    ('/api/firebase/collections', 300),
+    ('/api/firebase/collection/*/stats', 60),
+    ('/api/firebase/collection/*/documents', 30),
+    ('/api/mt5-account-info', 0),
+]
+CACHE_MAX_BYTES = 4 * 1024 * 1024  # Tổng dung lượng body tối đa giữ trong cache
+COALESCE_WINDOW = 0.25  # GET giống hệt trong khoảng này (giây) sau khi request trước xong dùng lại kết quả
+
+# Định dạng response: nén gzip / br / zstd và định dạng nhị phân (nếu đã cài thư viện), mặc định JSON
+WIRE_ALLOW_BINARY = True
+WIRE_BINARY_FORMATS = [  # (Content-Type, thư viện) theo thứ tự ưu tiên
+    ('application/msgpack', 'msgpack'),
+    ('application/cbor', 'cbor2'),
+]
+
+# Offline: các response GET được lưu xuống máy để hiển thị khi mất kết nối
+OFFLINE_PATHS = [
+    '/api/mt5-account-info',
+    '/api/firebase/collections',
+    '/api/firebase/collection/*/stats',
+    '/api/firebase/collection/*/count',
+    '/api/firebase/collection/*/documents',
+]
+OFFLINE_MAX_ENTRIES = 300  # Số response tối đa giữ trên máy (bỏ entry lâu không dùng nhất)
+OFFLINE_SNAPSHOT_INTERVAL = 30  # Chu kỳ lưu trạng thái tài khoản MT5 đang xem realtime (giây)
+OFFLINE_STATUS_CODES = {502, 503, 504}  # Tunnel không tới được server
+HEALTH_PROBE_INTERVAL = 15  # Chu kỳ thread nền gọi /api/health khi đang online (giây)
+HEALTH_OFFLINE_INTERVAL = 5  # Thử lại nhanh hơn khi đang mất kết nối
+HEALTH_ERROR_WINDOW = 50  # Số lần probe gần nhất dùng để tính tỷ lệ lỗi
+LATENCY_SUB_BUCKETS = 16  # Độ chính xác histogram: mỗi khoảng [2^k, 2^(k+1)) ms chia 16 bucket (~6%)
+OUTBOX_COMPACT_AFTER = 200  # Ghi lại file journal khi số dòng đã xử lý vượt ngưỡng
+OUTBOX_RETRY_STATUS = {408, 429}  # Lỗi tạm thời: giữ thao tác trong hàng đợi để gửi lại
+
+# Realtime MT5: stream delta qua SSE, tự chuyển về polling nếu server chưa có endpoint
+MT5_STREAM_PATH = "/api/mt5-account-info/stream"
+MT5_POLL_INTERVAL = 30
+
+# Polling thích ứng: nhanh khi equity/profit biến động mạnh, chậm khi đứng yên hoặc đóng cửa thị trường
+POLL_MIN_INTERVAL = 5
+POLL_MAX_INTERVAL = 120
+POLL_CLOSED_INTERVAL = 300  # Cuối tuần / thị trường đóng cửa
+POLL_FAST_MOVE = 0.002  # Equity hoặc profit thay đổi >= 0.2% balance giữa hai lần poll -> poll nhanh hơn
+POLL_IDLE_GROWTH = 1.5  # Hệ số giãn chu kỳ mỗi lần poll không có gì thay đổi
+POLL_FAILURE_BASE = 3
+POLL_FAILURE_MAX = 180
+ACCOUNT_SECTIONS = ('account', 'summary', 'today_summary')
+ANALYTICS_WINDOW = 3600  # Cửa sổ tính drawdown và xu hướng margin level (giây)
+ANALYTICS_TOP_SYMBOLS = 5
+ANALYTICS_TOP_LOSERS = 3
+HISTORY_METRICS = ('balance', 'equity', 'margin', 'margin_level', 'profit', 'positions')
+HISTORY_RESOLUTIONS = (60, 300, 3600)  # Các mức gộp 1 phút / 5 phút / 1 giờ
+# Thời gian giữ dữ liệu theo mức gộp (0 = mẫu gốc, None = giữ mãi)
+HISTORY_RETENTION = {0: 7 * 86400, 60: 30 * 86400, 300: 365 * 86400, 3600: None}
+HISTORY_MIN_INTERVAL = 5  # Không ghi hai mẫu cách nhau dưới 5 giây
+HISTORY_HEARTBEAT = 60  # Giá trị không đổi vẫn ghi lại sau mỗi 60 giây
+HISTORY_MAX_POINTS = 500  # Số điểm tối đa một truy vấn khoảng thời gian trả về
+HISTORY_PERIODS = {'1': ('1 giờ', 3600), '2': ('24 giờ', 86400), '3': ('7 ngày', 7 * 86400),
+                   '4': ('30 ngày', 30 * 86400)}
+
+# Phân trang documents
+DOCUMENT_PAGE_SIZE = 100
+DOCUMENT_PREFETCH = 1  # Số trang tải trước trong nền khi đang xử lý trang hiện tại
+
+# Xuất (backup) collection ra file trên máy
+EXPORT_PREFETCH = 4  # Số trang tải song song trong khi trang hiện tại đang được ghi
+EXPORT_CHECKPOINT_DOCUMENTS = 5000  # Ghi xuống đĩa và lưu vị trí sau mỗi chừng này documents
+EXPORT_GZIP_LEVEL = 6
+
+# Nhập (restore) documents từ file NDJSON / CSV
+IMPORT_RATE_LIMIT = 500  # Số documents ghi tối đa mỗi giây, bảo vệ quota ghi của Firestore (0 = không giới hạn)
+IMPORT_MAX_DOCUMENT_BYTES = 1024 * 1024  # Giới hạn kích thước một document của Firestore
+
+# Xóa / cập nhật hàng loạt qua endpoint batch của server
+BULK_BATCH_SIZE = 200  # Số thao tác trong một request batch
+BULK_CONCURRENCY = 4  # Số request batch chạy song song
+
+# Các field dùng để hiển thị tiêu đề / ngày của document, theo thứ tự ưu tiên
+DOCUMENT_TITLE_FIELDS = ['title', 'name', 'subject', 'heading']
+DOCUMENT_DATE_FIELDS = ['created_at', 'updated_at', 'timestamp', 'date', 'crawled_at', 'published_date']
+
+# Thống kê collection: đếm bằng aggregate query + ước lượng từ mẫu documents
+STATS_SAMPLE_SIZE = 200  # Kích thước reservoir sample
+STATS_SAMPLE_PAGES = 4  # Số trang ngẫu nhiên đọc khi server chưa hỗ trợ lấy mẫu
+STATS_TTL = 300
+STATS_Z = 1.96  # Độ tin cậy 95%
+OVERVIEW_CONCURRENCY = 6  # Số request thống kê chạy song song trên màn hình tổng quan
+AGE_BUCKETS = [(1, '< 1 ngày'), (7, '1-7 ngày'), (30, '7-30 ngày'), (90, '30-90 ngày'), (None, '> 90 ngày')]
+
+# Tác vụ xóa chạy nền (job): server xóa theo batch, client theo dõi tiến độ
+JOB_BATCH_SIZE = 500
+JOB_POLL_INTERVAL = 2
+JOB_ACTIVE_STATES = ('queued', 'running')
+
+class RetryBudget:
+    """Giới hạn tổng số lần retry theo tỉ lệ số request, tránh bão retry khi tunnel chết"""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_tokens=RETRY_BUDGET_MIN):
+        self.ratio = ratio
+        self.max_tokens = max(min_tokens, 1)
+        self.tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Mỗi request gốc nạp thêm một phần lượt retry"""
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self):
+        """Lấy một lượt retry, trả về False nếu đã hết ngân sách"""
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
 
-class ConfigManager:
-    def __init__(self, server_url):
-        self.server_url = server_url
-        self.session = requests.Session()
-        self.session.timeout = TIMEOUT
 
-    def test_connection(self):
-        """Test kết nối đến server"""
+def endpoint_class(method, path):
+    """Phân loại endpoint để chọn timeout phù hợp"""
+    if path.startswith('/api/health'):
+        return 'health'
+    if path.endswith('/stream'):
+        return 'stream'
+    if '/clear' in path:
+        return 'bulk'
+    if method in IDEMPOTENT_METHODS:
+        return 'read'
+    return 'write'
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Exponential backoff với full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _never_sent(exc):
+    """True nếu request chắc chắn chưa tới server (an toàn để gửi lại cả PUT/DELETE)"""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        reason = getattr(exc.args[0], 'reason', exc.args[0])
+        return isinstance(reason, urllib3_exceptions.NewConnectionError)
+    return False
+
+
+class SSEParser:
+    """Parser tối giản cho Server-Sent Events, nhận từng dòng và trả về event khi đủ"""
+
+    def __init__(self):
+        self.last_id = None
+        self._event = 'message'
+        self._data = []
+
+    def feed(self, line):
+        """Nhận một dòng, trả về (event, data) khi gặp dòng trống kết thúc event"""
+        if not line:
+            if not self._data:
+                return None
+            event = (self._event, '\n'.join(self._data))
+            self._event = 'message'
+            self._data = []
+            return event
+        if line.startswith(':'):
+            return None  # Comment / heartbeat
+        field, _, value = line.partition(':')
+        value = value[1:] if value.startswith(' ') else value
+        if field == 'event':
+            self._event = value
+        elif field == 'data':
+            self._data.append(value)
+        elif field == 'id':
+            self.last_id = value
+        return None
+
+
+def snapshot_to_delta(snapshot):
+    """Chuyển một payload đầy đủ thành delta 'reset' (thay toàn bộ bảng lệnh)"""
+    delta = {'type': 'snapshot', 'reset': True,
+             'upsert': list(snapshot.get('positions', [])), 'closed': [],
+             'timestamp': snapshot.get('timestamp')}
+    for section in ACCOUNT_SECTIONS:
+        if section in snapshot:
+            delta[section] = dict(snapshot[section])
+    return delta
+
+
+def diff_account_snapshot(previous, current):
+    """Tính delta giữa hai payload /api/mt5-account-info (dùng khi server chưa hỗ trợ stream)"""
+    if previous is None:
+        return snapshot_to_delta(current)
+    delta = {'type': 'delta', 'reset': False, 'upsert': [], 'closed': [],
+             'timestamp': current.get('timestamp')}
+    for section in ACCOUNT_SECTIONS:
+        old, new = previous.get(section) or {}, current.get(section) or {}
+        changed = {k: v for k, v in new.items() if old.get(k) != v}
+        if changed:
+            delta[section] = changed
+    old_positions = {p.get('ticket'): p for p in previous.get('positions', [])}
+    for pos in current.get('positions', []):
+        if old_positions.pop(pos.get('ticket'), None) != pos:
+            delta['upsert'].append(pos)
+    delta['closed'] = list(old_positions)
+    return delta
+
+
+class ReservoirSampler:
+    """Lấy mẫu ngẫu nhiên đều k phần tử từ một luồng dữ liệu (Algorithm R)"""
+
+    def __init__(self, size, rng=None):
+        self.size = size
+        self.seen = 0
+        self.items = []
+        self._rng = rng or random.Random()
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            index = self._rng.randrange(self.seen)
+            if index < self.size:
+                self.items[index] = item
+
+
+def parse_timestamp(value):
+    """Chuyển timestamp (epoch s/ms, ISO string, Firestore {'_seconds'}) thành datetime UTC"""
+    try:
+        if isinstance(value, dict):
+            value = value.get('_seconds', value.get('seconds'))
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            seconds = value / 1000 if value > 1e12 else value
+            return datetime.fromtimestamp(seconds, timezone.utc)
+        if isinstance(value, str):
+            parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    except (ValueError, TypeError, OverflowError, OSError):
+        return None
+    return None
+
+
+def wilson_interval(successes, n, z=STATS_Z):
+    """Khoảng tin cậy Wilson cho một tỉ lệ"""
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+class CollectionStatsEngine:
+    """Thống kê collection mà không cần đọc toàn bộ dữ liệu
+
+    Số documents lấy từ aggregate count (/count), dung lượng, độ đa dạng field và phân bố tuổi
+    được ước lượng từ reservoir sample (/sample?size=N, hoặc vài trang ngẫu nhiên nếu server
+    chưa hỗ trợ) kèm khoảng tin cậy 95%. Kết quả được cache STATS_TTL giây.
+    """
+
+    def __init__(self, manager, sample_size=STATS_SAMPLE_SIZE, ttl=STATS_TTL):
+        self.manager = manager
+        self.sample_size = sample_size
+        self.ttl = ttl
+        self._cache = {}
+        self._count_supported = True
+        self._sample_supported = True
+
+    def invalidate(self, collection_name=None):
+        if collection_name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(collection_name, None)
+
+    async def _optional_get(self, path, flag):
+        """GET một endpoint mới, trả về None và ghi nhớ nếu server chưa hỗ trợ"""
+        if not getattr(self, flag):
+            return None
         try:
-            response = self.session.get(f"{self.server_url}/api/health")
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('status') == 'healthy'
+            response = await self.manager._request('GET', path)
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code in (404, 405, 501):
+            setattr(self, flag, False)
+            return None
+        if response.status_code != 200:
+            return None
+        try:
+            data = self.manager._decode(response)
+        except Exception:
+            return None
+        # Server cũ có thể trả mảng JSON hoặc body rỗng
+        return data if isinstance(data, dict) and data.get('success', True) else None
+
+    async def _count(self, collection_name):
+        data = await self._optional_get(f"/api/firebase/collection/{collection_name}/count", '_count_supported')
+        if data is not None and 'count' in data:
+            return data['count'], 'aggregate'
+        result = await self.manager.get_collection_stats(collection_name)
+        if result and result.get('success') and not result.get('offline'):
+            return result.get('document_count', 0), 'stats'
+        return None, None
+
+    async def _sample(self, collection_name, count):
+        """Reservoir sample các documents của collection"""
+        reservoir = ReservoirSampler(self.sample_size)
+        data = await self._optional_get(
+            f"/api/firebase/collection/{collection_name}/sample?size={self.sample_size}", '_sample_supported')
+        if data is not None:
+            for doc in data.get('documents', []):
+                reservoir.add(doc)
+            return reservoir
+
+        # Fallback: đọc song song vài trang ở vị trí ngẫu nhiên
+        page_size = DOCUMENT_PAGE_SIZE
+        page_count = max(1, math.ceil(count / page_size))
+        pages = random.sample(range(page_count), min(STATS_SAMPLE_PAGES, page_count))
+        results = await asyncio.gather(*(
+            self.manager.get_collection_documents(collection_name, page_size, page * page_size, use_cache=False)
+            for page in pages))
+        for result in results:
+            for doc in (result or {}).get('documents', []):
+                reservoir.add(doc)
+        return reservoir
+
+    async def collect(self, collection_name, timestamp_field=None, refresh=False):
+        """Tính (hoặc lấy từ cache) thống kê chi tiết của collection"""
+        cached = self._cache.get(collection_name)
+        if cached and not refresh and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+
+        count, count_method = await self._count(collection_name)
+        if count is None:
+            return self.manager.offline.load(f"stats:{collection_name}")
+        reservoir = await self._sample(collection_name, count) if count else ReservoirSampler(0)
+        stats = summarize_sample(collection_name, count, reservoir.items, timestamp_field)
+        stats['count_method'] = count_method
+        self._cache[collection_name] = (time.monotonic(), stats)
+        self.manager.offline.put(f"stats:{collection_name}", json.dumps(stats, ensure_ascii=False, default=str))
+        return stats
+
+
+def summarize_sample(collection_name, count, sample, timestamp_field=None):
+    """Ước lượng dung lượng, cardinality field và phân bố tuổi từ mẫu documents"""
+    n = len(sample)
+    stats = {'success': True, 'collection': collection_name, 'document_count': count, 'sample_size': n,
+             'computed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    if not n:
+        stats.update(estimated_bytes=0, estimated_bytes_low=0, estimated_bytes_high=0, fields={}, age=None)
+        return stats
+
+    # Dung lượng: trung bình kích thước JSON của mẫu * số documents, có hiệu chỉnh quần thể hữu hạn
+    sizes = [len(json.dumps(doc, ensure_ascii=False, default=str).encode('utf-8')) for doc in sample]
+    mean = sum(sizes) / n
+    variance = sum((s - mean) ** 2 for s in sizes) / (n - 1) if n > 1 else 0.0
+    fpc = math.sqrt((count - n) / (count - 1)) if count > 1 and count >= n else 0.0
+    margin = STATS_Z * math.sqrt(variance / n) * fpc
+    stats.update(avg_document_bytes=mean,
+                 estimated_bytes=mean * count,
+                 estimated_bytes_low=max(0.0, mean - margin) * count,
+                 estimated_bytes_high=(mean + margin) * count)
+
+    # Cardinality: số giá trị khác nhau trong mẫu và tỉ lệ document có field
+    fields = {}
+    for doc in sample:
+        for field, value in doc.items():
+            info = fields.setdefault(field, {'present': 0, 'values': set()})
+            info['present'] += 1
+            info['values'].add(json.dumps(value, sort_keys=True, default=str)[:200])
+    stats['fields'] = {
+        field: {'presence': info['present'] / n, 'distinct_in_sample': len(info['values']),
+                'likely_unique': len(info['values']) >= 0.95 * info['present']}
+        for field, info in sorted(fields.items())
+    }
+
+    # Phân bố tuổi theo field thời gian đầu tiên tìm thấy
+    if timestamp_field is None:
+        timestamp_field = next((f for f in DOCUMENT_DATE_FIELDS if f in fields), None)
+    stats['age'] = None
+    if timestamp_field:
+        now = datetime.now(timezone.utc)
+        ages = [(now - ts).total_seconds() / 86400
+                for ts in (parse_timestamp(doc.get(timestamp_field)) for doc in sample) if ts is not None]
+        if ages:
+            buckets = []
+            lower = 0
+            for upper, label in AGE_BUCKETS:
+                hits = sum(1 for age in ages if age >= lower and (upper is None or age < upper))
+                low, high = wilson_interval(hits, len(ages))
+                buckets.append({'label': label, 'fraction': hits / len(ages),
+                                'estimated_count': round(hits / len(ages) * count),
+                                'count_low': round(low * count), 'count_high': round(high * count)})
+                lower = upper
+            stats['age'] = {'field': timestamp_field, 'parsed': len(ages), 'buckets': buckets,
+                            'oldest_days': max(ages), 'newest_days': min(ages), 'sample_ages': sorted(ages)}
+    return stats
+
+
+def estimate_older_than(stats, days):
+    """Ước lượng số documents cũ hơn `days` ngày từ mẫu, trả về (ước lượng, thấp, cao) hoặc None"""
+    age = (stats or {}).get('age')
+    if not age:
+        return None
+    ages = age['sample_ages']
+    hits = sum(1 for a in ages if a > days)
+    low, high = wilson_interval(hits, len(ages))
+    count = stats['document_count']
+    return round(hits / len(ages) * count), round(low * count), round(high * count)
+
+
+def format_bytes(size):
+    """Định dạng số byte dễ đọc"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            return f"{size:,.0f} {unit}" if unit == 'B' else f"{size:,.1f} {unit}"
+        size /= 1024
+
+
+def server_data_dir(server_url):
+    """Thư mục dữ liệu riêng của một server (lịch sử, outbox, jobs) trong CLIENT_DATA_DIR"""
+    slug = re.sub(r'[^A-Za-z0-9.-]+', '_', urlsplit(server_url).netloc or server_url).strip('_')
+    return os.path.join(CLIENT_DATA_DIR, 'servers', slug or 'default')
+
+
+class JobStore:
+    """Lưu các job đã tạo từ máy này vào file JSON để có thể theo dõi lại sau khi mở lại app"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CLIENT_DATA_DIR, 'jobs.json')
+        self.jobs = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.jobs = json.load(f)
+        except (OSError, ValueError):
+            self.jobs = {}
+
+    def save(self, job):
+        job['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        self.jobs[job['id']] = job
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.jobs, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+
+class TimeSeriesStore:
+    """Lịch sử tài khoản MT5 lưu trong SQLite trên máy (append-only, có bảng gộp 1m/5m/1h)
+
+    Mỗi mẫu ghi vào bảng samples và cập nhật luôn các bucket gộp (count/sum/min/max/last) trong
+    cùng transaction, nên truy vấn khoảng dài chỉ đọc bảng gộp. Dữ liệu cũ bị xóa theo
+    HISTORY_RETENTION của từng mức.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CLIENT_DATA_DIR, 'history.sqlite3')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{metric} REAL" for metric in HISTORY_METRICS)
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS samples (ts REAL PRIMARY KEY, {columns})")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS rollups (
+            resolution INTEGER, metric TEXT, bucket INTEGER,
+            count INTEGER, sum REAL, min REAL, max REAL, last REAL,
+            PRIMARY KEY (resolution, metric, bucket)) WITHOUT ROWID""")
+        self._db.commit()
+        self._last = None  # (ts, giá trị) của mẫu ghi gần nhất
+        self._pruned_at = 0
+        self.prune()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def record(self, account, positions=None, ts=None):
+        """Ghi một mẫu từ phần 'account' của payload MT5, trả về True nếu đã ghi"""
+        if not account:
             return False
-        except Exception as e:
-            print(f"❌ Lỗi kết nối: {e}")
+        ts = time.time() if ts is None else ts
+        values = {metric: account.get(metric) for metric in HISTORY_METRICS if metric != 'positions'}
+        values['positions'] = positions
+        values = {metric: float(value) for metric, value in values.items()
+                  if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        if not values:
             return False
+        if self._last:
+            last_ts, last_values = self._last
+            elapsed = ts - last_ts
+            if elapsed < HISTORY_MIN_INTERVAL or (values == last_values and elapsed < HISTORY_HEARTBEAT):
+                return False
+        rollup_rows = [(resolution, metric, int(ts // resolution), value, value, value, value)
+                       for resolution in HISTORY_RESOLUTIONS for metric, value in values.items()]
+        with self._lock, self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO samples (ts, {', '.join(values)}) "
+                f"VALUES (?, {', '.join('?' * len(values))})", (ts, *values.values()))
+            self._db.executemany(
+                """INSERT INTO rollups VALUES (?, ?, ?, 1, ?, ?, ?, ?)
+                   ON CONFLICT (resolution, metric, bucket) DO UPDATE SET
+                   count = count + 1, sum = sum + excluded.sum, min = min(min, excluded.min),
+                   max = max(max, excluded.max), last = excluded.last""", rollup_rows)
+        self._last = (ts, values)
+        if ts - self._pruned_at > 3600:
+            self.prune(ts)
+        return True
+
+    def prune(self, now=None):
+        """Xóa dữ liệu quá thời gian giữ của từng mức"""
+        now = time.time() if now is None else now
+        with self._lock, self._db:
+            if HISTORY_RETENTION.get(0):
+                self._db.execute("DELETE FROM samples WHERE ts < ?", (now - HISTORY_RETENTION[0],))
+            for resolution in HISTORY_RESOLUTIONS:
+                if HISTORY_RETENTION.get(resolution):
+                    self._db.execute("DELETE FROM rollups WHERE resolution = ? AND bucket < ?",
+                                     (resolution, int((now - HISTORY_RETENTION[resolution]) // resolution)))
+        self._pruned_at = now
+
+    @staticmethod
+    def _check_metric(metric):
+        if metric not in HISTORY_METRICS:
+            raise ValueError(f"Không có metric '{metric}'")
+
+    def pick_resolution(self, start, end, max_points=HISTORY_MAX_POINTS, now=None):
+        """Mức chi tiết nhất (0 = mẫu gốc) vừa đủ số điểm và còn dữ liệu cho khoảng thời gian"""
+        now = time.time() if now is None else now
+        for resolution in (0,) + HISTORY_RESOLUTIONS:
+            retention = HISTORY_RETENTION.get(resolution)
+            if retention and start < now - retention:
+                continue
+            if resolution == 0:
+                if (end - start) / HISTORY_MIN_INTERVAL <= max_points:
+                    return 0
+            elif (end - start) / resolution <= max_points:
+                return resolution
+        return HISTORY_RESOLUTIONS[-1]
+
+    def query(self, metric, start, end=None, resolution=None, max_points=HISTORY_MAX_POINTS):
+        """Các điểm (ts, giá trị) của metric trong [start, end], tự chọn mức gộp nếu không chỉ định
+
+        Với dữ liệu gộp, giá trị là trung bình của bucket và ts là đầu bucket.
+        """
+        self._check_metric(metric)
+        end = time.time() if end is None else end
+        if resolution is None:
+            resolution = self.pick_resolution(start, end, max_points)
+        with self._lock:
+            if resolution == 0:
+                rows = self._db.execute(
+                    f"SELECT ts, {metric} FROM samples WHERE ts BETWEEN ? AND ? AND {metric} IS NOT NULL "
+                    "ORDER BY ts", (start, end)).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT bucket * ?, sum / count FROM rollups WHERE resolution = ? AND metric = ? "
+                    "AND bucket BETWEEN ? AND ? ORDER BY bucket",
+                    (resolution, resolution, metric, int(start // resolution), int(end // resolution))).fetchall()
+        return rows
+
+    def summary(self, metric, start, end=None):
+        """min / max / giá trị đầu và cuối của metric trong khoảng thời gian, None nếu không có dữ liệu"""
+        self._check_metric(metric)
+        end = time.time() if end is None else end
+        resolution = self.pick_resolution(start, end, max_points=float('inf'))
+        with self._lock:
+            if resolution == 0:
+                row = self._db.execute(
+                    f"SELECT min({metric}), max({metric}), count({metric}) FROM samples "
+                    f"WHERE ts BETWEEN ? AND ?", (start, end)).fetchone()
+            else:
+                row = self._db.execute(
+                    "SELECT min(min), max(max), sum(count) FROM rollups WHERE resolution = ? AND metric = ? "
+                    "AND bucket BETWEEN ? AND ?",
+                    (resolution, metric, int(start // resolution), int(end // resolution))).fetchone()
+        if not row or not row[2]:
+            return None
+        first = self.value_at(metric, start, after=True)
+        last = self.value_at(metric, end)
+        return {'min': row[0], 'max': row[1], 'first': first, 'last': last,
+                'change': last - first if first is not None and last is not None else None}
+
+    def value_at(self, metric, ts, after=False):
+        """Giá trị gần nhất trước (hoặc sau, nếu after=True) thời điểm ts"""
+        self._check_metric(metric)
+        compare, order = ('>=', 'ASC') if after else ('<=', 'DESC')
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {metric} FROM samples WHERE ts {compare} ? AND {metric} IS NOT NULL "
+                f"ORDER BY ts {order} LIMIT 1", (ts,)).fetchone()
+            if row is None:
+                # Mẫu gốc đã bị xóa theo retention, dùng giá trị cuối của bucket gộp
+                for resolution in HISTORY_RESOLUTIONS:
+                    row = self._db.execute(
+                        f"SELECT last FROM rollups WHERE resolution = ? AND metric = ? AND bucket {compare} ? "
+                        f"ORDER BY bucket {order} LIMIT 1", (resolution, metric, int(ts // resolution))).fetchone()
+                    if row is not None:
+                        break
+        return row[0] if row else None
+
+    def compare(self, metric, seconds, now=None):
+        """So sánh giá trị hiện tại với `seconds` giây trước: (hiện tại, trước đó, thay đổi %)"""
+        now = time.time() if now is None else now
+        current, previous = self.value_at(metric, now), self.value_at(metric, now - seconds)
+        if current is None or previous is None:
+            return current, previous, None
+        return current, previous, (current - previous) / abs(previous) * 100 if previous else None
+
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values, width=40):
+    """Vẽ dãy giá trị thành một dòng ký tự khối, gộp trung bình nếu nhiều hơn `width` điểm"""
+    values = [v for v in values if v is not None]
+    if not values:
+        return ""
+    if len(values) > width:
+        step = len(values) / width
+        values = [sum(chunk) / len(chunk) for chunk in
+                  (values[int(i * step):max(int((i + 1) * step), int(i * step) + 1)] for i in range(width))]
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[3] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return ''.join(SPARK_CHARS[int((v - low) * scale)] for v in values)
+
+
+def job_progress(job, rate=None):
+    """Tỉ lệ hoàn thành và ETA (giây) của job, None nếu chưa biết"""
+    total = job.get('total')
+    deleted = job.get('deleted', 0)
+    fraction = min(1.0, deleted / total) if total else None
+    eta = (total - deleted) / rate if total and rate and total > deleted else None
+    return fraction, eta
+
+
+class OfflineStore:
+    """Lưu response cuối cùng của các endpoint đọc xuống SQLite để dùng khi mất kết nối"""
+
+    def __init__(self, namespace='', path=None, max_entries=OFFLINE_MAX_ENTRIES):
+        self.namespace = namespace  # Tách dữ liệu của từng server
+        self.path = path or os.path.join(CLIENT_DATA_DIR, 'offline.sqlite3')
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, body BLOB, saved_at REAL, used_at REAL, content_type TEXT)""")
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(entries)")]
+        if 'content_type' not in columns:
+            # File tạo bởi phiên bản trước: body luôn là JSON
+            self._db.execute("ALTER TABLE entries ADD COLUMN content_type TEXT")
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def accepts(path):
+        base = path.split('?', 1)[0]
+        return any(fnmatch.fnmatchcase(base, pattern) for pattern in OFFLINE_PATHS)
+
+    def put(self, key, body, saved_at=None, content_type=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                             (self.namespace + key, body, saved_at or now, now, content_type))
+            self._db.execute("""DELETE FROM entries WHERE key NOT IN (
+                SELECT key FROM entries ORDER BY used_at DESC LIMIT ?)""", (self.max_entries,))
+
+    def get(self, key):
+        """(body, thời điểm lưu, Content-Type) hoặc None"""
+        key = self.namespace + key
+        with self._lock, self._db:
+            row = self._db.execute("SELECT body, saved_at, content_type FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE entries SET used_at = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def load(self, key):
+        """JSON đã lưu, đánh dấu 'offline' và 'cached_at' để màn hình hiển thị độ cũ"""
+        row = self.get(key)
+        if row is None:
+            return None
+        try:
+            data = decode_body(row[0], row[2])
+        except ValueError:
+            return None
+        if isinstance(data, dict):
+            data['offline'] = True
+            data['cached_at'] = row[1]
+        return data
+
+
+class MutationOutbox:
+    """Hàng đợi bền vững (journal + fsync) cho các thao tác xóa/cập nhật document khi mất kết nối
+
+    Mỗi thao tác có idempotency key và được ghi vào journal JSON Lines trước khi trả về cho
+    người dùng. Khi có kết nối lại, các thao tác được gửi lại theo đúng thứ tự. Nhiều lần cập
+    nhật cùng một document đang chờ được gộp thành một, xóa document thì bỏ các cập nhật chờ trước đó.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CLIENT_DATA_DIR, 'outbox.jsonl')
+        self.pending = OrderedDict()  # key -> thao tác, theo thứ tự đưa vào
+        self.failed = []  # Thao tác bị server từ chối khi gửi lại (không gửi lại nữa)
+        self.replaying = False
+        self.replayed = 0
+        self.replay_total = 0
+        self.replay_rate = None
+        self._in_flight = None
+        self._journal_lines = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Dựng lại hàng đợi từ journal (bỏ qua dòng ghi dở ở cuối file)"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._journal_lines += 1
+                    kind, key = record.get('t'), record.get('key')
+                    if kind == 'add':
+                        self.pending.setdefault(key, record['op'])
+                    elif kind == 'merge' and key in self.pending:
+                        self.pending[key]['data'] = record['data']
+                    elif kind == 'done':
+                        self.pending.pop(key, None)
+        except OSError:
+            pass
+
+    def _append(self, *records):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_lines += len(records)
+
+    def _compact(self):
+        """Ghi lại journal chỉ với các thao tác còn chờ"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for key, op in self.pending.items():
+                f.write(json.dumps({'t': 'add', 'key': key, 'op': op}, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._journal_lines = len(self.pending)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def enqueue(self, op, key=None):
+        """Ghi thao tác {'op': 'delete'|'update', 'collection', 'id', 'data'} vào hàng đợi, trả về key"""
+        key = key or uuid.uuid4().hex
+        with self._lock:
+            if key in self.pending:
+                return key  # Đã có (ví dụ gửi lại cùng idempotency key)
+            records = []
+            same_doc = [k for k, pending in self.pending.items() if k != self._in_flight
+                        and pending['collection'] == op['collection'] and pending['id'] == op['id']]
+            last = self.pending[same_doc[-1]] if same_doc else None
+            if op['op'] == 'update' and last is not None and last['op'] == 'update':
+                # Gộp vào lần cập nhật đang chờ, giữ vị trí cũ trong hàng đợi
+                last['data'] = {**last['data'], **op['data']}
+                self._append({'t': 'merge', 'key': same_doc[-1], 'data': last['data']})
+                return same_doc[-1]
+            if op['op'] == 'delete':
+                # Xóa document thì các cập nhật chờ trước đó không còn ý nghĩa
+                for old_key in same_doc:
+                    if self.pending[old_key]['op'] == 'update':
+                        del self.pending[old_key]
+                        records.append({'t': 'done', 'key': old_key, 'superseded': True})
+            op = {**op, 'queued_at': time.time()}
+            self.pending[key] = op
+            records.append({'t': 'add', 'key': key, 'op': op})
+            self._append(*records)
+        return key
+
+    def next(self):
+        """(key, thao tác) đầu hàng đợi và đánh dấu đang gửi, None nếu rỗng"""
+        with self._lock:
+            if not self.pending:
+                return None
+            key, op = next(iter(self.pending.items()))
+            self._in_flight = key
+            return key, op
+
+    def complete(self, key, error=None):
+        """Đánh dấu thao tác đã gửi xong (error = server từ chối, không gửi lại)"""
+        with self._lock:
+            op = self.pending.pop(key, None)
+            self._in_flight = None
+            if op is None:
+                return
+            self._append({'t': 'done', 'key': key, 'error': error})
+            if error:
+                self.failed.append({**op, 'key': key, 'error': error})
+            if not self.pending and self._journal_lines > OUTBOX_COMPACT_AFTER:
+                self._compact()
 
-    def get_mt5_account_info(self):
-        """Lấy thông tin tài khoản MT5"""
+    def release(self, key):
+        """Thao tác chưa gửi được (mất kết nối), để lại trong hàng đợi"""
+        with self._lock:
+            if self._in_flight == key:
+                self._in_flight = None
+
+    def status(self):
+        return {'pending': len(self.pending), 'replaying': self.replaying, 'replayed': self.replayed,
+                'total': self.replay_total, 'rate': self.replay_rate, 'failed': len(self.failed)}
+
+
+def format_outbox_status(status):
+    """Dòng trạng thái hàng đợi thao tác offline, None nếu hàng đợi rỗng"""
+    if status['replaying']:
+        rate = f" - {status['rate']:.1f} thao tác/s" if status['rate'] else ""
+        return f"🔁 Đang gửi lại thao tác offline: {status['replayed']}/{status['total']}{rate}"
+    if status['pending']:
+        return f"📥 Hàng đợi: {status['pending']} thao tác chờ gửi khi có kết nối"
+    if status['failed']:
+        return f"⚠️ {status['failed']} thao tác offline bị server từ chối khi gửi lại"
+    return None
+
+
+def format_staleness(cached_at):
+    """Dòng cảnh báo dữ liệu offline kèm thời điểm lưu"""
+    saved = datetime.fromtimestamp(cached_at).strftime('%d/%m %H:%M')
+    return f"⚠️ Dữ liệu offline lưu lúc {saved} ({format_duration(max(0, time.time() - cached_at))} trước)"
+
+
+@functools.lru_cache(maxsize=None)
+def module_available(name):
+    """Thư viện tùy chọn đã được cài chưa (không import)"""
+    return importlib.util.find_spec(name) is not None
+
+
+def negotiation_headers():
+    """Header Accept-Encoding / Accept theo các thư viện nén và định dạng nhị phân đã cài"""
+    # urllib3 tự thêm br / zstd khi có brotli / zstandard và tự giải nén response
+    encodings = importlib.import_module('urllib3.util.request').ACCEPT_ENCODING
+    formats = [mime for mime, module in WIRE_BINARY_FORMATS if WIRE_ALLOW_BINARY and module_available(module)]
+    accept = [mime if i == 0 else f"{mime};q={1 - i / 10:.1f}" for i, mime in enumerate(formats)]
+    accept.append(f"application/json;q={1 - len(formats) / 10:.1f}" if formats else "application/json")
+    return {'Accept-Encoding': encodings, 'Accept': ", ".join(accept)}
+
+
+_json_loads = None
+
+
+def json_loads(body):
+    """json.loads, dùng orjson (nhanh hơn vài lần) nếu đã cài"""
+    global _json_loads
+    if _json_loads is None:
+        _json_loads = importlib.import_module('orjson').loads if module_available('orjson') else json.loads
+    try:
+        return _json_loads(body)
+    except ValueError:
+        if _json_loads is json.loads:
+            raise
+        return json.loads(body)  # orjson không nhận NaN / Infinity mà json của Python chấp nhận
+
+
+def expand_keys(value, keys):
+    """Thay key dạng số bằng tên field trong payload dùng từ điển key"""
+    if isinstance(value, dict):
+        return {keys[key] if isinstance(key, int) else key: expand_keys(item, keys) for key, item in value.items()}
+    if isinstance(value, list):
+        return [expand_keys(item, keys) for item in value]
+    return value
+
+
+def decode_body(body, content_type=None):
+    """Giải mã body theo Content-Type: MessagePack / CBOR hoặc JSON
+
+    Payload dạng {"$keys": ["ticket", "symbol", ...], "$data": ...} có các object dùng chỉ số
+    trong $keys làm key (tránh lặp tên field ở mỗi lệnh / document) và được khôi phục tên field.
+    """
+    mime = (content_type or '').split(';', 1)[0].strip().lower()
+    if mime in ('application/msgpack', 'application/x-msgpack'):
+        data = importlib.import_module('msgpack').unpackb(body, raw=False, strict_map_key=False)
+    elif mime == 'application/cbor':
+        data = importlib.import_module('cbor2').loads(body)
+    else:
+        data = json_loads(body)
+    if isinstance(data, dict) and '$keys' in data and '$data' in data:
+        data = expand_keys(data['$data'], data['$keys'])
+    return data
+
+
+class WireStats:
+    """Dung lượng nhận qua mạng, dung lượng sau giải nén và thời gian giải mã theo endpoint"""
+
+    def __init__(self):
+        self.endpoints = {}  # endpoint -> [số response, byte qua mạng, byte sau giải nén, giây giải mã, {định dạng}]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(url):
+        return re.sub(r'/(collection|document)/[^/]+', r'/\1/*', urlsplit(url).path)
+
+    def record(self, response, decode_seconds):
+        body = len(response.content)
         try:
-            response = self.session.get(f"{self.server_url}/api/mt5-account-info")
-            if response.status_code == 200:
-                return response.json()
+            wire = response.raw.tell() or body  # Số byte urllib3 đã đọc từ socket (trước khi giải nén)
+        except (AttributeError, ValueError):
+            wire = body
+        encoding = response.headers.get('Content-Encoding', 'identity')
+        mime = response.headers.get('Content-Type', '').split(';', 1)[0].split('/')[-1] or 'json'
+        with self._lock:
+            stats = self.endpoints.setdefault(self.endpoint(response.url), [0, 0, 0, 0.0, set()])
+            stats[0] += 1
+            stats[1] += wire
+            stats[2] += body
+            stats[3] += decode_seconds
+            stats[4].add(f"{encoding}+{mime}")
+
+    def summary(self):
+        """[{endpoint, responses, wire_bytes, body_bytes, decode_ms, formats}] trung bình mỗi response"""
+        with self._lock:
+            items = sorted(self.endpoints.items(), key=lambda item: -item[1][1])
+            return [{'endpoint': endpoint, 'responses': count, 'wire_bytes': wire / count, 'body_bytes': body / count,
+                     'decode_ms': seconds * 1000 / count, 'formats': sorted(formats)}
+                    for endpoint, (count, wire, body, seconds, formats) in items]
+
+
+class CacheEntry:
+    """Một response đã cache cùng validators (ETag / Last-Modified)"""
+    __slots__ = ('body', 'content_type', 'etag', 'last_modified', 'expires_at')
+
+    def __init__(self, body, etag, last_modified, expires_at, content_type=None):
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    def is_fresh(self):
+        return time.monotonic() < self.expires_at
+
+    def validators(self):
+        """Header cho conditional GET"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def json(self):
+        # Decode lại mỗi lần để caller không sửa được dữ liệu trong cache
+        return decode_body(self.body, self.content_type)
+
+
+class ResponseCache:
+    """Cache response GET với TTL theo endpoint, conditional GET và LRU theo dung lượng"""
+
+    def __init__(self, ttls=None, max_bytes=CACHE_MAX_BYTES):
+        self.ttls = list(CACHE_TTLS if ttls is None else ttls)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, path):
+        """TTL của endpoint, None nếu endpoint không được cache"""
+        base = path.split('?', 1)[0]
+        for pattern, ttl in self.ttls:
+            if fnmatch.fnmatchcase(base, pattern):
+                return ttl
+        return None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, headers, ttl):
+        """Lưu response, loại bỏ entry ít dùng nhất khi vượt dung lượng"""
+        if 'no-store' in headers.get('Cache-Control', '') or len(body) > self.max_bytes:
+            return
+        entry = CacheEntry(body, headers.get('ETag'), headers.get('Last-Modified'), time.monotonic() + ttl,
+                           headers.get('Content-Type'))
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = entry
+            self.total_bytes += len(body)
+            while self.total_bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def touch(self, key, ttl):
+        """Gia hạn entry sau khi server trả 304 Not Modified"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.expires_at = time.monotonic() + ttl
+
+    def invalidate(self, prefix=None):
+        """Xóa các entry có key bắt đầu bằng prefix (None = xóa hết)"""
+        with self._lock:
+            for key in [k for k in self._entries if prefix is None or k.startswith(prefix)]:
+                self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= len(entry.body)
+
+
+class SingleFlight:
+    """Gộp các GET giống hệt nhau: request đang chạy được dùng chung, kết quả vừa nhận được dùng lại
+
+    Chỉ dùng trên event loop. Response được chia sẻ giữa các caller, mỗi caller tự giải mã
+    body nên không ai sửa được dữ liệu của caller khác.
+    """
+
+    def __init__(self, window=COALESCE_WINDOW):
+        self.window = window
+        self.started = 0
+        self.shared = 0  # Caller chờ chung một request đang chạy
+        self.coalesced = 0  # Caller nhận kết quả vừa xong trong cửa sổ gộp
+        self._flights = {}
+        self._recent = {}
+        self._waiters = {}  # task -> số caller đang chờ
+
+    async def run(self, key, factory):
+        """Trả về kết quả của factory() cho key, chỉ gọi factory khi chưa có request nào dùng chung được"""
+        now = time.monotonic()
+        recent = self._recent.get(key)
+        if recent is not None and now - recent[1] < self.window:
+            self.coalesced += 1
+            return recent[0]
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._flights[key] = task
+            task.add_done_callback(functools.partial(self._finish, key))
+            self.started += 1
+        else:
+            self.shared += 1
+        # shield: caller bị hủy (vd. prefetch bị bỏ) không hủy request mà caller khác đang chờ;
+        # request chỉ bị hủy khi không còn caller nào chờ
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _finish(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        else:
+            return  # Đã bị forget() trong lúc chạy: kết quả có thể cũ, không giữ lại
+        if not task.cancelled() and task.exception() is None and self._reusable(task.result()):
+            now = time.monotonic()
+            self._recent = {k: v for k, v in self._recent.items() if now - v[1] < self.window}
+            self._recent[key] = (task.result(), now)
+
+    @staticmethod
+    def _reusable(result):
+        """Chỉ dùng lại kết quả thành công: sau lỗi, lần gọi kế tiếp phải hỏi lại server"""
+        return result is not None and getattr(result, 'status_code', 200) < 400
+
+    def forget(self):
+        """Bỏ các request đang chạy và kết quả vừa nhận khỏi danh sách dùng chung (sau khi ghi dữ liệu)"""
+        self._flights = {}
+        self._recent = {}
+
+    def stats(self):
+        callers = self.started + self.shared + self.coalesced
+        return {'requests': self.started, 'shared': self.shared, 'coalesced': self.coalesced,
+                'saved_ratio': (self.shared + self.coalesced) / callers if callers else None}
+
+
+class FixedPollScheduler:
+    """Scheduler polling chu kỳ cố định (hành vi cũ)"""
+
+    def __init__(self, interval=MT5_POLL_INTERVAL, failure_delay=3):
+        self.interval = interval
+        self.failure_delay = failure_delay
+        self._failed = False
+
+    def record_success(self, snapshot, latency):
+        self._failed = False
+
+    def record_failure(self, latency=None):
+        self._failed = True
+
+    def next_delay(self):
+        return self.failure_delay if self._failed else self.interval
+
+    def stats(self):
+        return {'interval': self.next_delay(), 'mode': 'fixed'}
+
+
+class AdaptivePollScheduler:
+    """Scheduler polling thích ứng theo biến động tài khoản, giờ thị trường và lỗi kết nối
+
+    Mỗi lần poll, caller báo record_success(snapshot, latency) hoặc record_failure(), rồi
+    chờ next_delay() giây. Có thể thay bằng bất kỳ object nào có cùng các method này.
+    """
+
+    def __init__(self, base_interval=MT5_POLL_INTERVAL, min_interval=POLL_MIN_INTERVAL,
+                 max_interval=POLL_MAX_INTERVAL, closed_interval=POLL_CLOSED_INTERVAL,
+                 fast_move=POLL_FAST_MOVE, latency_window=50):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.closed_interval = closed_interval
+        self.fast_move = fast_move
+        self.interval = float(base_interval)
+        self.mode = 'normal'
+        self.polls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latencies = deque(maxlen=latency_window)
+        self._last = None
+
+    @staticmethod
+    def market_closed(snapshot, now=None):
+        """Thị trường đóng cửa: server báo market_open=False hoặc khung cuối tuần FX (UTC)"""
+        if snapshot and 'market_open' in snapshot:
+            return not snapshot['market_open']
+        now = now or datetime.now(timezone.utc)
+        weekday, hour = now.weekday(), now.hour
+        return weekday == 5 or (weekday == 4 and hour >= 22) or (weekday == 6 and hour < 22)
+
+    def record_success(self, snapshot, latency):
+        """Cập nhật chu kỳ dựa trên mức thay đổi so với lần poll trước"""
+        self.polls += 1
+        self.consecutive_failures = 0
+        self.latencies.append(latency)
+
+        account = (snapshot or {}).get('account') or {}
+        current = (account.get('equity', 0), account.get('profit', 0),
+                   len((snapshot or {}).get('positions', [])))
+        previous, self._last = self._last, current
+
+        if self.market_closed(snapshot):
+            self.mode = 'closed'
+            self.interval = self.closed_interval
+            return
+        if previous is None:
+            self.mode = 'normal'
+            self.interval = self.base_interval
+            return
+
+        scale = abs(account.get('balance') or 0) or max(abs(current[0]), 1)
+        move = max(abs(current[0] - previous[0]), abs(current[1] - previous[1])) / scale
+        if move >= self.fast_move or current[2] != previous[2]:
+            self.mode = 'fast'
+            self.interval = max(self.min_interval, self.interval / 2)
+        elif move == 0:
+            self.mode = 'idle'
+            self.interval = min(self.max_interval, self.interval * POLL_IDLE_GROWTH)
+        else:
+            # Biến động nhẹ: kéo chu kỳ dần về mức cơ bản
+            self.mode = 'normal'
+            self.interval += (self.base_interval - self.interval) / 2
+
+    def record_failure(self, latency=None):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.mode = 'backoff'
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def next_delay(self):
+        """Số giây chờ trước lần poll tiếp theo"""
+        if self.consecutive_failures:
+            ceiling = min(POLL_FAILURE_MAX, POLL_FAILURE_BASE * (2 ** (self.consecutive_failures - 1)))
+            return ceiling / 2 + random.uniform(0, ceiling / 2)
+        return self.interval
+
+    def stats(self):
+        """Chu kỳ hiện tại và thống kê độ trễ (giây)"""
+        ordered = sorted(self.latencies)
+        interval = self.next_delay()
+        return {
+            'interval': interval,
+            'mode': self.mode,
+            'polls_per_minute': 60 / max(interval, 0.001),
+            'polls': self.polls,
+            'failures': self.failures,
+            'latency_avg': sum(ordered) / len(ordered) if ordered else None,
+            'latency_p50': ordered[len(ordered) // 2] if ordered else None,
+            'latency_p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None,
+        }
+
+
+async def _wait_event(event, timeout):
+    """Chờ tối đa timeout giây hoặc tới khi threading.Event được set, không chặn event loop"""
+    deadline = time.monotonic() + timeout
+    while not event.is_set() and time.monotonic() < deadline:
+        await asyncio.sleep(min(0.2, max(0, deadline - time.monotonic())))
+
+
+def _pump_stream_lines(response, loop, queue):
+    """Chạy trên thread riêng của một stream: đọc từng dòng, chuyển vào asyncio.Queue của event loop
+
+    Kết thúc bằng None (server đóng stream) hoặc exception gặp khi đọc. Thread tự đóng response
+    khi xong, nên không giữ thread nào của pool chung suốt thời gian stream.
+    """
+    try:
+        # chunk_size=None: nhận từng chunk ngay khi tới, không đợi đủ 512 byte mới trả event
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            loop.call_soon_threadsafe(queue.put_nowait, line)
+        item = None
+    except Exception as e:
+        item = e
+    finally:
+        response.close()
+    try:
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+    except RuntimeError:
+        pass  # Event loop đã đóng
+
+
+def _interrupt_stream(response):
+    """Gọi từ event loop: shutdown socket để lệnh đọc đang chặn ở thread stream trả về ngay"""
+    try:
+        response.raw.shutdown()  # urllib3 >= 2.3
+    except (AttributeError, ValueError, RuntimeError, OSError):
+        pass  # urllib3 cũ / kết nối đã trả về pool: thread stream tự kết thúc khi hết timeout đọc
+
+
+async def _interrupt_stream_on_stop(response, stop_event):
+    """Ngắt stream ngay khi stop_event được set, không đợi server gửi dòng tiếp theo"""
+    await _wait_event(stop_event, math.inf)
+    _interrupt_stream(response)
+
+
+class AsyncConfigManager:
+    """Quản lý server bằng asyncio, dùng chung một connection pool keep-alive giới hạn"""
+
+    def __init__(self, server_url, pool_size=POOL_SIZE):
+        self.server_url = server_url
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.retry_budget = RetryBudget()
+        self.cache = ResponseCache()
+        self.stats_engine = CollectionStatsEngine(self)
+        self.job_store = JobStore(os.path.join(server_data_dir(server_url), 'jobs.json'))
+        self.offline = OfflineStore(server_url)
+        self.outbox = MutationOutbox(os.path.join(server_data_dir(server_url), 'outbox.jsonl'))
+        self._online = None
+        self._replay_task = None
+        self.last_connection_error = None
+        self._refreshing = set()
+        self.latency = LatencyHistogram()  # Độ trễ mọi request (trừ stream)
+        self.wire_stats = WireStats()
+        self.single_flight = SingleFlight()
+        self._job_tasks = {}
+        self._jobs_supported = True
+        self._query_supported = True
+        self._batch_supported = True
+        # requests là blocking nên mỗi request chạy trên một worker, số worker = số kết nối
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='mt5-http')
+
+    @property
+    def session(self):
+        """requests.Session dùng chung, tạo (và import requests) khi gửi request đầu tiên"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    # Pool giới hạn: tối đa pool_size kết nối keep-alive, request thừa sẽ chờ thay vì mở thêm
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                                            pool_block=True)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    session.headers.update(negotiation_headers())
+                    self._session = session
+        return self._session
+
+    @property
+    def online(self):
+        """None = chưa biết, cập nhật sau mỗi request / health check"""
+        return self._online
+
+    @online.setter
+    def online(self, value):
+        self._online = value
+        if value:
+            self._schedule_replay()
+
+    def _schedule_replay(self):
+        """Bắt đầu gửi lại outbox ở nền nếu còn thao tác chờ và chưa có lượt gửi nào đang chạy"""
+        if len(self.outbox) and not self.outbox.replaying and (self._replay_task is None or self._replay_task.done()):
+            try:
+                self._replay_task = asyncio.get_running_loop().create_task(self.replay_outbox())
+            except RuntimeError:
+                pass  # Không ở trong event loop, lần request sau sẽ kích hoạt
+
+    async def _send(self, method, path, **kwargs):
+        """Gửi một request qua pool chung mà không chặn event loop"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self.session.request, method, f"{self.server_url}{path}", **kwargs)
+        started = time.perf_counter()
+        response = await loop.run_in_executor(self._executor, call)
+        if not kwargs.get('stream'):
+            self.latency.record((time.perf_counter() - started) * 1000)
+        return response
+
+    def _decode(self, response):
+        """Giải mã body response (JSON / MessagePack / CBOR) và ghi lại dung lượng, thời gian giải mã"""
+        started = time.perf_counter()
+        data = decode_body(response.content, response.headers.get('Content-Type'))
+        if not getattr(response, 'wire_recorded', False):  # Response dùng chung qua single-flight chỉ tính một lần
+            response.wire_recorded = True
+            self.wire_stats.record(response, time.perf_counter() - started)
+        return data
+
+    async def _request(self, method, path, idempotent=None, coalesce=True, **kwargs):
+        """Gửi request với timeout theo loại endpoint và retry có backoff
+
+        GET được retry khi lỗi mạng hoặc lỗi tạm thời từ tunnel. PUT/DELETE/POST chỉ được
+        gửi lại khi chắc chắn request chưa tới server, trừ khi caller đánh dấu idempotent=True.
+        GET giống hệt nhau (cùng path và header) được gộp qua single-flight, trừ khi coalesce=False
+        (caller đã tự gộp, vd. _json_request); request khác GET bỏ các kết quả đang dùng chung để
+        lần đọc sau thấy dữ liệu mới.
+        """
+        if method != 'GET' or kwargs.get('stream') or 'data' in kwargs or 'json' in kwargs:
+            self.single_flight.forget()
+            try:
+                return await self._request_once(method, path, idempotent, **kwargs)
+            finally:
+                self.single_flight.forget()
+        if not coalesce:
+            return await self._request_once(method, path, idempotent, **kwargs)
+        key = (path, tuple(sorted((kwargs.get('headers') or {}).items())))
+        return await self.single_flight.run(
+            key, functools.partial(self._request_once, method, path, idempotent, **kwargs))
+
+    async def _request_once(self, method, path, idempotent=None, **kwargs):
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', ENDPOINT_TIMEOUTS[endpoint_class(method, path)])
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                response = await self._send(method, path, **kwargs)
+            except requests.exceptions.RequestException as e:
+                retryable = idempotent or _never_sent(e)
+                if (not retryable or attempt + 1 >= RETRY_MAX_ATTEMPTS
+                        or not self.retry_budget.try_withdraw()):
+                    raise
             else:
+                if (not idempotent or response.status_code not in RETRY_STATUS_CODES
+                        or attempt + 1 >= RETRY_MAX_ATTEMPTS or not self.retry_budget.try_withdraw()):
+                    return response
+                response.close()
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    async def _json_request(self, method, path, use_cache=True, offline_first=True, quiet=False, offline=True,
+                            **kwargs):
+        """Gửi request và trả về JSON nếu thành công, None nếu lỗi
+
+        GET tới các endpoint trong OFFLINE_PATHS được lưu xuống máy. Khi đang offline, dữ liệu
+        đã lưu được trả về ngay (có 'offline' và 'cached_at') và request được làm mới ở nền;
+        khi request lỗi mạng cũng dùng dữ liệu đã lưu thay vì trả về None. offline=False bỏ qua
+        dữ liệu trên máy (không đọc, không ghi), dùng khi cần đúng dữ liệu hiện tại của server.
+        """
+        persist = offline and method == 'GET' and self.offline.accepts(path)
+        if persist and offline_first and self.online is False:
+            cached = self.offline.load(path)
+            if cached is not None:
+                self._refresh_offline(path)
+                return cached
+
+        ttl = self.cache.ttl_for(path) if method == 'GET' and use_cache else None
+        entry = self.cache.get(path) if ttl is not None else None
+        if entry is not None:
+            if entry.is_fresh():
+                self.cache.hits += 1
+                return entry.json()
+            kwargs['headers'] = {**entry.validators(), **kwargs.get('headers', {})}
+        fetch = functools.partial(self._fetch_json, method, path, entry, ttl, persist, quiet, **kwargs)
+        if method == 'GET' and set(kwargs) <= {'headers'}:
+            # GET giống nhau đang chạy dùng chung một lần gọi server: cache / OfflineStore chỉ ghi một lần
+            key = ('json', path, ttl is not None, persist, tuple(sorted(kwargs.get('headers', {}).items())))
+            load = await self.single_flight.run(key, fetch)
+        else:
+            load = await fetch()
+        try:
+            return load() if load is not None else None
+        except Exception as e:
+            if not quiet:
+                print(f"❌ Lỗi: {e}")
+            return None
+
+    async def _fetch_json(self, method, path, entry, ttl, persist, quiet, **kwargs):
+        """Gọi server cho _json_request, trả về hàm giải mã kết quả hoặc None nếu lỗi
+
+        Mỗi caller gọi hàm này để nhận bản dữ liệu riêng, kể cả khi dùng chung response.
+        """
+        try:
+            response = await self._request(method, path, coalesce=False, **kwargs)
+            self.online = response.status_code not in OFFLINE_STATUS_CODES
+            if response.status_code == 304 and entry is not None:
+                self.cache.revalidated += 1
+                self.cache.touch(path, ttl)
+                return entry.json
+            if response.status_code == 200:
+                if ttl is not None:
+                    self.cache.misses += 1
+                    self.cache.put(path, response.content, response.headers, ttl)
+                if persist:
+                    self.offline.put(path, response.content, content_type=response.headers.get('Content-Type'))
+                return functools.partial(self._decode, response)
+            if persist and not self.online and self.offline.get(path):
+                return functools.partial(self.offline.load, path)
+            if not quiet:
                 print(f"❌ Lỗi HTTP: {response.status_code}")
-                return None
+            return None
         except Exception as e:
-            print(f"❌ Lỗi: {e}")
+            if isinstance(e, requests.exceptions.ConnectionError):
+                self.online = False
+            if persist and self.offline.get(path):
+                return functools.partial(self.offline.load, path)
+            if not quiet:
+                print(f"❌ Lỗi: {e}")
             return None
 
-    def test_discord_notification(self, message):
+    def _refresh_offline(self, path):
+        """Làm mới một endpoint đã lưu ở nền, kết quả ghi lại vào OfflineStore"""
+        if path in self._refreshing:
+            return
+        self._refreshing.add(path)
+        task = asyncio.ensure_future(self._json_request('GET', path, use_cache=False, offline_first=False, quiet=True))
+        task.add_done_callback(lambda _: self._refreshing.discard(path))
+
+    def invalidate_collection(self, collection_name, include_list=False):
+        """Xóa cache liên quan tới collection sau khi dữ liệu bị thay đổi"""
+        self.cache.invalidate(f"/api/firebase/collection/{collection_name}/")
+        self.stats_engine.invalidate(collection_name)
+        self.single_flight.forget()
+        if include_list:
+            # Collection rỗng sẽ biến mất khỏi danh sách trên Firestore
+            self.cache.invalidate("/api/firebase/collections")
+
+    def close(self):
+        """Đóng connection pool và các worker"""
+        self._executor.shutdown(wait=False)
+        if self._session is not None:
+            self._session.close()
+        self.offline.close()
+
+    async def test_connection(self):
+        """Test kết nối đến server (kết quả cũng cập nhật trạng thái online/offline)"""
+        try:
+            # Không gộp: probe phải tới server để đo đúng độ trễ và trạng thái hiện tại
+            response = await self._request('GET', "/api/health", coalesce=False)
+            healthy = response.status_code == 200 and self._decode(response).get('status') == 'healthy'
+        except Exception as e:
+            self.last_connection_error = str(e)
+            healthy = False
+        self.online = healthy
+        return healthy
+
+    async def get_mt5_account_info(self):
+        """Lấy thông tin tài khoản MT5"""
+        return await self._json_request('GET', "/api/mt5-account-info")
+
+    async def stream_mt5_account_events(self, stop_event, scheduler=None):
+        """Nhận thay đổi tài khoản MT5 dạng delta cho tới khi stop_event được set
+
+        Server gửi SSE tại MT5_STREAM_PATH: event 'snapshot' (payload đầy đủ) khi mới kết nối,
+        sau đó event 'delta' chỉ chứa field account/summary thay đổi, 'upsert' (lệnh mới hoặc
+        thay đổi) và 'closed' (ticket đã đóng). Khi kết nối lại, client gửi Last-Event-ID để
+        server tiếp tục từ version cũ. Nếu server chưa có endpoint này, tự tính delta từ polling
+        với chu kỳ do scheduler quyết định (mặc định AdaptivePollScheduler).
+        """
+        if scheduler is None:
+            scheduler = AdaptivePollScheduler()
+        parser = SSEParser()
+        attempt = 0
+        while not stop_event.is_set():
+            headers = {'Accept': 'text/event-stream'}
+            if parser.last_id:
+                headers['Last-Event-ID'] = parser.last_id
+            try:
+                response = await self._send('GET', MT5_STREAM_PATH, stream=True, headers=headers,
+                                            timeout=ENDPOINT_TIMEOUTS['stream'])
+            except requests.exceptions.RequestException as e:
+                yield {'type': 'error', 'error': str(e)}
+                await _wait_event(stop_event, backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in (404, 405, 501):
+                response.close()
+                break  # Server chưa hỗ trợ stream
+            if response.status_code != 200:
+                response.close()
+                yield {'type': 'error', 'error': f"HTTP {response.status_code}"}
+                await _wait_event(stop_event, backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            attempt = 0
+            loop = asyncio.get_running_loop()
+            lines = asyncio.Queue()
+            # Stream sống rất lâu: đọc trên thread riêng để không chiếm một thread của pool chung
+            threading.Thread(target=_pump_stream_lines, args=(response, loop, lines),
+                             name='mt5-stream', daemon=True).start()
+            watcher = loop.create_task(_interrupt_stream_on_stop(response, stop_event))
+            try:
+                while True:
+                    line = await lines.get()
+                    if line is None or (isinstance(line, Exception) and stop_event.is_set()):
+                        break  # Server đóng stream / stream bị ngắt khi dừng
+                    if isinstance(line, Exception):
+                        raise line
+                    event = parser.feed(line)
+                    if event is None:
+                        continue
+                    name, data = event
+                    payload = json.loads(data)
+                    if name == 'snapshot':
+                        yield {**snapshot_to_delta(payload), 'mode': 'stream'}
+                    elif name == 'delta':
+                        yield {'type': 'delta', 'reset': False, 'upsert': [], 'closed': [],
+                               **payload, 'mode': 'stream'}
+            except (requests.exceptions.RequestException, ValueError) as e:
+                yield {'type': 'error', 'error': str(e)}
+            finally:
+                watcher.cancel()
+                _interrupt_stream(response)
+        else:
+            return
+
+        # Fallback: polling toàn bộ payload, chỉ chuyển phần thay đổi cho UI
+        previous = None
+        while not stop_event.is_set():
+            started = time.monotonic()
+            account_info = await self.get_mt5_account_info()
+            if not account_info or account_info.get('offline'):
+                scheduler.record_failure(time.monotonic() - started)
+                yield {'type': 'error', 'error': "Không thể lấy thông tin tài khoản MT5"}
+            else:
+                scheduler.record_success(account_info, time.monotonic() - started)
+                yield {**diff_account_snapshot(previous, account_info), 'mode': 'poll'}
+                previous = account_info
+            await _wait_event(stop_event, scheduler.next_delay())
+
+    async def test_discord_notification(self, message):
         """Test gửi tin nhắn Discord"""
         try:
             data = {'message': message}
-            response = self.session.post(f"{self.server_url}/api/discord/test", json=data)
+            response = await self._request('POST', "/api/discord/test", json=data)
             if response.status_code == 200:
-                return True, response.json().get('message', 'Gửi thành công')
+                return True, self._decode(response).get('message', 'Gửi thành công')
             else:
-                error_data = response.json()
+                error_data = self._decode(response)
                 return False, error_data.get('error', 'Lỗi không xác định')
         except Exception as e:
             return False, f"Lỗi kết nối: {e}"
 
     # Firebase Management Methods
-    def get_firebase_collections(self):
+    async def get_firebase_collections(self):
         """Lấy danh sách tất cả collections trong Firebase"""
-        try:
-            response = self.session.get(f"{self.server_url}/api/firebase/collections")
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"❌ Lỗi HTTP: {response.status_code}")
-                return None
-        except Exception as e:
-            print(f"❌ Lỗi: {e}")
-            return None
+        return await self._json_request('GET', "/api/firebase/collections")
 
-    def get_collection_stats(self, collection_name):
+    async def get_collection_stats(self, collection_name):
         """Lấy thống kê của một collection"""
+        return await self._json_request('GET', f"/api/firebase/collection/{collection_name}/stats")
+
+    async def iter_collection_stats(self, collection_names, concurrency=OVERVIEW_CONCURRENCY):
+        """Lấy thống kê nhiều collections song song, yield (tên, kết quả, độ trễ giây) theo thứ tự hoàn thành"""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch(name):
+            async with semaphore:
+                started = time.monotonic()
+                result = await self.get_collection_stats(name)
+                return name, result, time.monotonic() - started
+
+        tasks = [asyncio.ensure_future(fetch(name)) for name in collection_names]
         try:
-            response = self.session.get(f"{self.server_url}/api/firebase/collection/{collection_name}/stats")
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"❌ Lỗi HTTP: {response.status_code}")
-                return None
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_collection_stats_detailed(self, collection_name, timestamp_field=None, refresh=False):
+        """Thống kê ước lượng: số documents, dung lượng, cardinality field, phân bố tuổi"""
+        try:
+            return await self.stats_engine.collect(collection_name, timestamp_field, refresh)
         except Exception as e:
             print(f"❌ Lỗi: {e}")
             return None
 
-    def clear_collection(self, collection_name):
+    async def clear_collection(self, collection_name):
         """Xóa toàn bộ documents trong một collection"""
         try:
-            response = self.session.delete(f"{self.server_url}/api/firebase/collection/{collection_name}/clear")
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"❌ Lỗi HTTP: {response.status_code}")
-                return None
-        except Exception as e:
-            print(f"❌ Lỗi: {e}")
-            return None
+            return await self._json_request('DELETE', f"/api/firebase/collection/{collection_name}/clear")
+        finally:
+            self.invalidate_collection(collection_name, include_list=True)
 
-    def clear_old_documents(self, collection_name, days):
+    async def clear_old_documents(self, collection_name, days):
         """Xóa documents cũ trong một collection dựa trên số ngày"""
         try:
-            response = self.session.delete(
-                f"{self.server_url}/api/firebase/collection/{collection_name}/clear-old?days={days}")
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"❌ Lỗi HTTP: {response.status_code}")
+            return await self._json_request(
+                'DELETE', f"/api/firebase/collection/{collection_name}/clear-old?days={days}")
+        finally:
+            self.invalidate_collection(collection_name, include_list=True)
+
+    # Tác vụ xóa chạy nền
+    async def start_clear_job(self, collection_name, days=None, batch_size=JOB_BATCH_SIZE):
+        """Bắt đầu xóa collection (hoặc documents cũ hơn `days` ngày), trả về job ngay lập tức
+
+        Server tạo job qua POST /api/firebase/jobs {"type", "collection", "days", "batch_size"},
+        xóa theo batch và báo tiến độ qua GET /api/firebase/jobs/<id> với các field state
+        (queued/running/completed/failed/cancelled), deleted, total. Nếu server chưa hỗ trợ,
+        client tự chạy job: xóa collection theo batch, hoặc gọi API clear-old cũ trong nền.
+        """
+        job_type = 'clear_collection' if days is None else 'clear_old_documents'
+        job = {'type': job_type, 'collection': collection_name, 'days': days, 'server': self.server_url,
+               'state': 'queued', 'deleted': 0, 'total': None, 'error': None,
+               'created_at': datetime.now().isoformat(timespec='seconds')}
+        if self._jobs_supported:
+            body = {'type': job_type, 'collection': collection_name, 'days': days, 'batch_size': batch_size}
+            try:
+                response = await self._request('POST', "/api/firebase/jobs", json=body)
+                if response.status_code in (404, 405, 501):
+                    self._jobs_supported = False
+                elif response.status_code in (200, 201, 202):
+                    data = self._decode(response)
+                    job.update(data.get('job', {}), id=data.get('job_id') or data['job']['id'], mode='server')
+                    return self.job_store.save(job)
+                else:
+                    print(f"❌ Lỗi HTTP: {response.status_code}")
+                    return None
+            except Exception as e:
+                print(f"❌ Lỗi: {e}")
                 return None
+
+        job.update(id=f"local-{uuid.uuid4().hex[:12]}", mode='local', batch_size=batch_size)
+        self.job_store.save(job)
+        self._start_local_job(job)
+        return job
+
+    def _start_local_job(self, job):
+        task = asyncio.ensure_future(self._run_local_job(job))
+        self._job_tasks[job['id']] = task
+        task.add_done_callback(lambda _: self._job_tasks.pop(job['id'], None))
+
+    async def _run_local_job(self, job):
+        """Chạy job phía client khi server chưa có API jobs"""
+        collection_name = job['collection']
+        job['state'] = 'running'
+        job['error'] = None
+        self.job_store.save(job)
+        try:
+            if job['type'] == 'clear_old_documents':
+                # Không biết server dùng field thời gian nào nên giữ nguyên API clear-old, chạy trong nền
+                result = await self.clear_old_documents(collection_name, job['days'])
+                if not result or not result.get('success'):
+                    raise RuntimeError(result.get('error', 'Không xác định') if result else 'Lỗi kết nối')
+                job['deleted'] = job['total'] = result.get('deleted_count', 0)
+                job['cutoff_date'] = result.get('cutoff_date')
+            else:
+                stats = await self.get_collection_stats(collection_name)
+                if stats and stats.get('success') and not stats.get('offline'):
+                    job['total'] = job['deleted'] + stats.get('document_count', 0)
+                while True:
+                    # Job xóa chỉ dùng dữ liệu hiện tại của server, không dùng trang đã lưu trên máy
+                    page = await self.get_collection_documents(collection_name, job.get('batch_size', JOB_BATCH_SIZE),
+                                                               0, use_cache=False, offline=False)
+                    if not page or not page.get('success'):
+                        raise RuntimeError(page.get('error', 'Không xác định') if page else 'Lỗi kết nối')
+                    ids = [doc.get('id') for doc in page.get('documents', []) if doc.get('id')]
+                    if not ids:
+                        break
+                    results = await self.bulk_delete_documents(collection_name, ids)
+                    deleted = sum(1 for r in results.values() if r['success'])
+                    if not deleted:
+                        raise RuntimeError(next(iter(results.values()))['error'])
+                    job['deleted'] += deleted
+                    self.job_store.save(job)
+            job['state'] = 'completed'
+        except asyncio.CancelledError:
+            job['state'] = 'cancelled'
+            raise
         except Exception as e:
-            print(f"❌ Lỗi: {e}")
+            job['state'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            self.job_store.save(job)
+            self.invalidate_collection(collection_name, include_list=True)
+
+    async def get_job_status(self, job_id):
+        """Trạng thái mới nhất của job"""
+        job = self.job_store.get(job_id)
+        if job is not None and job.get('mode') == 'local':
+            if job['state'] in JOB_ACTIVE_STATES and job_id not in self._job_tasks:
+                job['state'] = 'interrupted'  # App bị tắt khi job đang chạy, có thể resume
+                self.job_store.save(job)
+            return job
+        result = await self._json_request('GET', f"/api/firebase/jobs/{job_id}")
+        if not result or not result.get('success'):
+            return job
+        job = {**(job or {'id': job_id}), **result.get('job', {})}
+        self.job_store.save(job)
+        if job['state'] not in JOB_ACTIVE_STATES:
+            self.invalidate_collection(job.get('collection', ''), include_list=True)
+        return job
+
+    async def cancel_job(self, job_id):
+        """Dừng job, các documents đã xóa không được khôi phục"""
+        job = self.job_store.get(job_id)
+        if job is not None and job.get('mode') == 'local':
+            task = self._job_tasks.get(job_id)
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            elif job['state'] in JOB_ACTIVE_STATES + ('interrupted',):
+                job['state'] = 'cancelled'
+                self.job_store.save(job)
+            return job
+        await self._json_request('POST', f"/api/firebase/jobs/{job_id}/cancel")
+        return await self.get_job_status(job_id)
+
+    async def resume_job(self, job_id):
+        """Tiếp tục job bị gián đoạn / thất bại từ chỗ đã dừng"""
+        job = await self.get_job_status(job_id)
+        if job is None:
             return None
-
-    def get_collection_documents(self, collection_name, limit=50, offset=0):
-        """Lấy danh sách documents trong một collection"""
+        if job.get('mode') == 'local':
+            if job_id not in self._job_tasks:
+                self._start_local_job(job)
+            return job
+        await self._json_request('POST', f"/api/firebase/jobs/{job_id}/resume")
+        return await self.get_job_status(job_id)
+
+    async def list_jobs(self):
+        """Các job đã tạo từ máy này (mới nhất trước), trạng thái được cập nhật từ server"""
+        jobs = sorted(self.job_store.jobs.values(), key=lambda j: j.get('created_at', ''), reverse=True)
+        active = [job['id'] for job in jobs if job['state'] in JOB_ACTIVE_STATES + ('interrupted',)]
+        await asyncio.gather(*(self.get_job_status(job_id) for job_id in active))
+        return sorted(self.job_store.jobs.values(), key=lambda j: j.get('created_at', ''), reverse=True)
+
+    async def watch_job(self, job_id, stop_event, interval=JOB_POLL_INTERVAL):
+        """Theo dõi job cho tới khi kết thúc, yield (job, tốc độ documents/giây, ETA giây)"""
+        rate = None
+        previous = None
+        while not stop_event.is_set():
+            job = await self.get_job_status(job_id)
+            if job is None:
+                return
+            now = time.monotonic()
+            if previous is not None and now > previous[0]:
+                instant = (job.get('deleted', 0) - previous[1]) / (now - previous[0])
+                rate = instant if rate is None else 0.7 * rate + 0.3 * instant
+            previous = (now, job.get('deleted', 0))
+            yield job, rate, job_progress(job, rate)[1]
+            if job['state'] not in JOB_ACTIVE_STATES:
+                return
+            await _wait_event(stop_event, interval)
+
+    async def get_collection_documents(self, collection_name, limit=50, offset=0, cursor=None, use_cache=True,
+                                       offline=True):
+        """Lấy danh sách documents trong một collection
+
+        Server hỗ trợ phân trang kiểu cursor sẽ trả thêm 'next_cursor' (None ở trang cuối).
+        """
+        path = f"/api/firebase/collection/{collection_name}/documents?limit={limit}&offset={offset}"
+        if cursor:
+            path += f"&cursor={quote(cursor, safe='')}"
+        return await self._json_request('GET', path, use_cache=use_cache, offline=offline)
+
+    async def query_collection(self, collection_name, where=None, order_by=None, select=None, limit=None,
+                               offset=0, cursor=None, offline=True, scan=None):
+        """Truy vấn collection với lọc, sắp xếp và chọn field thực hiện trên server
+
+        where: [(field, op, value)], op thuộc FILTER_OPERATORS. order_by: 'field', '-field' (giảm
+        dần) hoặc list các giá trị đó. select: list field cần lấy ('id' luôn được trả về).
+        Body gửi tới /query: {"where": [[f, op, v]], "order_by": [[f, "asc"|"desc"]], "select": [...],
+        "limit": n, "offset": n, "cursor": ...}. Nếu server chưa có endpoint này, truy vấn được
+        thực hiện phía client trên dữ liệu phân trang (kết quả có 'pushdown': False); scan là
+        LocalQueryScan dùng chung giữa các trang của một lần duyệt, offline=False bỏ qua dữ liệu trên máy.
+        """
+        where = [list(clause) for clause in (where or [])]
+        order_by = normalize_order_by(order_by)
+        if self._query_supported:
+            body = {'where': where, 'order_by': order_by, 'select': select, 'limit': limit, 'offset': offset}
+            if cursor:
+                body['cursor'] = cursor
+            try:
+                # Truy vấn chỉ đọc nên được phép retry dù dùng POST
+                response = await self._request('POST', f"/api/firebase/collection/{collection_name}/query",
+                                               idempotent=True, json=body)
+                if response.status_code in (404, 405, 501):
+                    self._query_supported = False
+                elif response.status_code == 200:
+                    return {**self._decode(response), 'pushdown': True}
+                else:
+                    print(f"❌ Lỗi HTTP: {response.status_code}")
+                    return None
+            except Exception as e:
+                print(f"❌ Lỗi: {e}")
+                return None
+        return await self._query_locally(collection_name, where, order_by, select, limit, offset, offline, scan)
+
+    async def _query_locally(self, collection_name, where, order_by, select, limit, offset, offline=True,
+                             scan=None):
+        """Thực hiện query phía client bằng cách duyệt documents theo trang (xem LocalQueryScan)"""
+        wanted = None if limit is None else offset + limit
+        # Lần gọi lẻ chỉ cần `wanted` documents đầu tiên; quay lại trang đã bỏ qua thì quét lại từ đầu
+        if scan is None or offset < scan.base:
+            scan, keep = LocalQueryScan(), wanted
+        else:
+            keep = None
+        if scan.lock is None:
+            scan.lock = asyncio.Lock()
+        async with scan.lock:
+            while not scan.exhausted and (order_by or wanted is None or scan.base + len(scan.matches) < wanted):
+                result = await self.get_collection_documents(collection_name, DOCUMENT_PAGE_SIZE, scan.source_offset,
+                                                             use_cache=False, offline=offline)
+                if not result or not result.get('success'):
+                    return result
+                documents = result.get('documents', [])
+                if result.get('offline'):
+                    scan.offline = True
+                    scan.cached_at = min(filter(None, [scan.cached_at, result.get('cached_at')]), default=None)
+                scan.matches.extend(doc for doc in documents if document_matches(doc, where))
+                scan.source_offset += len(documents)
+                if len(documents) < DOCUMENT_PAGE_SIZE:
+                    scan.exhausted = True
+                elif order_by and keep is not None and len(scan.matches) > keep:
+                    # Chỉ giữ `keep` documents đứng đầu để bộ nhớ không tăng theo kích thước collection
+                    scan.matches = sort_documents(scan.matches, order_by)[:keep]
+            if order_by and not scan.sorted:
+                scan.matches = sort_documents(scan.matches, order_by)
+                scan.sorted = True
+            start = offset - scan.base
+            matches = scan.matches[start:None if wanted is None else wanted - scan.base]
+            if start > 0:
+                # Các trang trước đã trả về, không cần giữ trong bộ nhớ
+                del scan.matches[:start]
+                scan.base = offset
+            result = {'success': True, 'documents': [project_document(doc, select) for doc in matches],
+                      'pushdown': False}
+            if scan.exhausted:
+                result['count'] = scan.base + len(scan.matches)  # Tổng số documents khớp
+            if scan.offline:
+                result.update(offline=True, cached_at=scan.cached_at)
+            return result
+
+    async def _mutate(self, op, key=None):
+        """Gửi một thao tác xóa/cập nhật kèm Idempotency-Key
+
+        Trả về (kết quả JSON, True) nếu server đã xử lý, (None, False) nếu không tới được server.
+        """
+        path = f"/api/firebase/document/{op['collection']}/{op['id']}"
+        headers = {'Idempotency-Key': key} if key else {}
+        method, kwargs = ('DELETE', {}) if op['op'] == 'delete' else ('PUT', {'json': op['data']})
         try:
-            response = self.session.get(
-                f"{self.server_url}/api/firebase/collection/{collection_name}/documents?limit={limit}&offset={offset}")
-            if response.status_code == 200:
-                return response.json()
+            # Cùng idempotency key nên gửi lại an toàn kể cả khi request trước đã tới server
+            response = await self._request(method, path, idempotent=bool(key), headers=headers, **kwargs)
+        except requests.exceptions.RequestException:
+            self.online = False
+            return None, False
+        if response.status_code in OFFLINE_STATUS_CODES or response.status_code in OUTBOX_RETRY_STATUS:
+            self.online = response.status_code not in OFFLINE_STATUS_CODES
+            return None, False
+        self.online = True
+        try:
+            result = self._decode(response)
+        except ValueError:
+            result = {'success': False, 'error': f"HTTP {response.status_code}"}
+        if response.status_code != 200:
+            result.setdefault('success', False)
+            result.setdefault('error', f"HTTP {response.status_code}")
+        return result, True
+
+    async def _mutate_or_queue(self, op):
+        """Gửi thao tác ngay nếu có kết nối, nếu không thì ghi vào outbox để gửi lại sau"""
+        try:
+            if self.online is not False and not len(self.outbox):
+                key = uuid.uuid4().hex
+                result, delivered = await self._mutate(op, key)
+                if delivered:
+                    return result
             else:
-                print(f"❌ Lỗi HTTP: {response.status_code}")
+                key = None
+            self.outbox.enqueue(op, key)
+            if self.online:
+                self._schedule_replay()  # Có kết nối nhưng hàng đợi còn thao tác cũ: gửi lại theo thứ tự
+            return {'success': True, 'queued': True, 'pending': len(self.outbox),
+                    'message': "Đã lưu vào hàng đợi, sẽ gửi khi có kết nối"}
+        finally:
+            self.invalidate_collection(op['collection'])
+
+    async def delete_document(self, collection_name, document_id):
+        """Xóa một document cụ thể (đưa vào hàng đợi nếu mất kết nối)"""
+        return await self._mutate_or_queue({'op': 'delete', 'collection': collection_name, 'id': document_id})
+
+    async def update_document(self, collection_name, document_id, data):
+        """Cập nhật một document cụ thể (đưa vào hàng đợi nếu mất kết nối)"""
+        return await self._mutate_or_queue({'op': 'update', 'collection': collection_name, 'id': document_id,
+                                            'data': data})
+
+    async def replay_outbox(self):
+        """Gửi lần lượt các thao tác trong outbox theo thứ tự, dừng khi mất kết nối"""
+        outbox = self.outbox
+        if outbox.replaying:
+            # Đang có lượt gửi lại khác: chờ lượt đó thay vì gửi song song cùng thao tác đầu hàng đợi
+            if self._replay_task is not None and not self._replay_task.done():
+                return await asyncio.shield(self._replay_task)
+            return outbox.status()
+        outbox.replaying, outbox.replayed = True, 0
+        outbox.replay_total = len(outbox)
+        started = time.monotonic()
+        try:
+            while True:
+                item = outbox.next()
+                if item is None:
+                    break
+                key, op = item
+                result, delivered = await self._mutate(op, key)
+                if not delivered:
+                    outbox.release(key)
+                    break
+                outbox.complete(key, None if result.get('success') else result.get('error', 'Không xác định'))
+                self.invalidate_collection(op['collection'])
+                outbox.replayed += 1
+                outbox.replay_total = outbox.replayed + len(outbox)
+                outbox.replay_rate = outbox.replayed / max(time.monotonic() - started, 1e-6)
+        finally:
+            outbox.replaying = False
+        return outbox.status()
+
+    async def _send_batch(self, collection_name, operations):
+        """Gửi một batch thao tác, trả về {id: kết quả} hoặc None nếu server chưa có endpoint batch
+
+        Body: {"operations": [{"op": "delete"|"update", "id": ..., "data": {...}}]}
+        Response: {"success": true, "results": [{"id": ..., "success": bool, "error": ...}]}
+        """
+        # Xóa và cập nhật (merge) theo id đều idempotent nên batch được phép retry
+        response = await self._request('POST', f"/api/firebase/collection/{collection_name}/batch",
+                                       idempotent=True, json={'operations': operations})
+        if response.status_code in (404, 405, 501):
+            return None
+        if response.status_code != 200:
+            error = f"HTTP {response.status_code}"
+            return {op['id']: {'success': False, 'error': error} for op in operations}
+        data = self._decode(response)
+        results = {item.get('id'): {'success': bool(item.get('success')), 'error': item.get('error')}
+                   for item in data.get('results', [])}
+        for op in operations:
+            results.setdefault(op['id'], {'success': False, 'error': data.get('error', 'Không có kết quả')})
+        return results
+
+    async def _send_single(self, collection_name, op):
+        """Thực hiện một thao tác bằng endpoint document đơn lẻ (server chưa hỗ trợ batch)"""
+        path = f"/api/firebase/document/{collection_name}/{op['id']}"
+        try:
+            if op['op'] == 'delete':
+                response = await self._request('DELETE', path)
+            else:
+                response = await self._request('PUT', path, json=op['data'])
+        except requests.exceptions.ConnectionError as e:
+            self.online = False
+            return {'success': False, 'error': f"Lỗi kết nối: {e}"}
+        except requests.exceptions.RequestException as e:
+            return {'success': False, 'error': str(e)}
+        self.online = response.status_code not in OFFLINE_STATUS_CODES
+        try:
+            data = self._decode(response)
+        except Exception:
+            data = None  # Body lỗi không phải JSON (vd. trang lỗi HTML của tunnel)
+        if not isinstance(data, dict):
+            data = {}
+        if response.status_code == 200 and data.get('success'):
+            return {'success': True, 'error': None}
+        return {'success': False, 'error': data.get('error') or f"HTTP {response.status_code}"}
+
+    async def bulk_documents(self, collection_name, operations, batch_size=BULK_BATCH_SIZE,
+                             concurrency=BULK_CONCURRENCY, progress=None):
+        """Thực hiện nhiều thao tác delete/update, chia thành các batch chạy song song
+
+        progress(done, total) được gọi sau mỗi batch. Trả về {document_id: {'success', 'error'}}.
+        """
+        total = len(operations)
+        results = {}
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        batch_supported = True
+
+        async def run_chunk(chunk):
+            nonlocal batch_supported
+            async with semaphore:
+                chunk_results = None
+                if batch_supported:
+                    try:
+                        chunk_results = await self._send_batch(collection_name, chunk)
+                    except Exception as e:
+                        chunk_results = {op['id']: {'success': False, 'error': str(e)} for op in chunk}
+                    if chunk_results is None:
+                        batch_supported = False
+                if chunk_results is None:
+                    singles = await asyncio.gather(*(self._send_single(collection_name, op) for op in chunk))
+                    chunk_results = {op['id']: result for op, result in zip(chunk, singles)}
+                results.update(chunk_results)
+                if progress:
+                    progress(len(results), total)
+
+        try:
+            chunks = [operations[i:i + batch_size] for i in range(0, total, max(1, batch_size))]
+            await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+        finally:
+            self.invalidate_collection(collection_name, include_list=True)
+        return results
+
+    async def import_batch(self, collection_name, operations):
+        """Gửi một batch khi nhập file, trả về {document_id: {'success', 'error'}}
+
+        Khác bulk_documents: lỗi mạng hoặc lỗi tạm thời (quota, tunnel) của cả batch được raise
+        để việc nhập dừng lại và tiếp tục sau, thay vì đánh dấu các documents là thất bại.
+        """
+        if self._batch_supported:
+            results = await self._send_batch(collection_name, operations)
+            if results is not None:
+                errors = {result['error'] for result in results.values() if not result['success']}
+                transient = {f"HTTP {code}" for code in RETRY_STATUS_CODES | OUTBOX_RETRY_STATUS}
+                if len(errors) == 1 and len(results) == len(operations) and errors <= transient \
+                        and not any(result['success'] for result in results.values()):
+                    raise RuntimeError(f"Server tạm thời từ chối ({errors.pop()}), thử lại sau")
+                return results
+            self._batch_supported = False
+        singles = await asyncio.gather(*(self._send_single(collection_name, op) for op in operations))
+        if self.online is False:
+            raise RuntimeError("Mất kết nối tới server")
+        return {op['id']: result for op, result in zip(operations, singles)}
+
+    async def bulk_delete_documents(self, collection_name, document_ids, batch_size=BULK_BATCH_SIZE,
+                                    concurrency=BULK_CONCURRENCY, progress=None):
+        """Xóa nhiều documents theo id"""
+        operations = [{'op': 'delete', 'id': doc_id} for doc_id in dict.fromkeys(document_ids)]
+        return await self.bulk_documents(collection_name, operations, batch_size, concurrency, progress)
+
+    async def bulk_update_documents(self, collection_name, updates, batch_size=BULK_BATCH_SIZE,
+                                    concurrency=BULK_CONCURRENCY, progress=None):
+        """Cập nhật nhiều documents, updates là {document_id: dữ liệu cập nhật}"""
+        operations = [{'op': 'update', 'id': doc_id, 'data': data} for doc_id, data in updates.items()]
+        return await self.bulk_documents(collection_name, operations, batch_size, concurrency, progress)
+
+
+class LatencyHistogram:
+    """Histogram độ trễ kiểu HDR: bucket log-tuyến tính, bộ nhớ cố định, percentile sai số ~6%
+
+    Giá trị (ms) trong khoảng [2^k, 2^(k+1)) được chia đều thành LATENCY_SUB_BUCKETS bucket, nên
+    sai số tương đối của percentile không đổi dù độ trễ là 5ms hay 5s.
+    """
+
+    def __init__(self, sub_buckets=LATENCY_SUB_BUCKETS):
+        self.sub_buckets = sub_buckets
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        if value < 1:
+            return int(value * self.sub_buckets)  # Dưới 1ms: các bucket tuyến tính
+        exponent = int(math.log2(value))
+        return self.sub_buckets * (exponent + 1) + int((value / 2 ** exponent - 1) * self.sub_buckets)
+
+    def _upper(self, index):
+        """Giá trị lớn nhất (ms) của bucket"""
+        if index < self.sub_buckets:
+            return (index + 1) / self.sub_buckets
+        exponent, sub = divmod(index - self.sub_buckets, self.sub_buckets)
+        return 2 ** exponent * (1 + (sub + 1) / self.sub_buckets)
+
+    def record(self, value_ms):
+        with self._lock:
+            index = self._index(value_ms)
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.total += value_ms
+            self.min = value_ms if self.min is None else min(self.min, value_ms)
+            self.max = value_ms if self.max is None else max(self.max, value_ms)
+
+    def percentile(self, p):
+        """Giá trị (ms) mà p% số mẫu không vượt quá, None nếu chưa có mẫu"""
+        with self._lock:
+            if not self.count:
                 return None
-        except Exception as e:
-            print(f"❌ Lỗi: {e}")
+            target = max(1, math.ceil(self.count * p / 100))
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= target:
+                    return min(self._upper(index), self.max)
+            return self.max
+
+    def summary(self):
+        return {'count': self.count, 'min': self.min, 'max': self.max,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99)}
+
+
+class HealthMonitor:
+    """Thread nền gọi /api/health theo chu kỳ riêng, menu chỉ đọc trạng thái đã cache
+
+    Ghi độ trễ vào LatencyHistogram và tỷ lệ lỗi của HEALTH_ERROR_WINDOW lần gần nhất. listener
+    (nếu có) được gọi mỗi khi trạng thái online/offline thay đổi.
+    """
+
+    def __init__(self, config_manager, interval=HEALTH_PROBE_INTERVAL, offline_interval=HEALTH_OFFLINE_INTERVAL):
+        self.config_manager = config_manager
+        self.interval = interval
+        self.offline_interval = offline_interval
+        self.histogram = LatencyHistogram()
+        self.outcomes = deque(maxlen=HEALTH_ERROR_WINDOW)
+        self.last_latency = None
+        self.last_probe_at = None
+        self.probes = 0
+        self.listener = None
+        self.first_probe = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Chạy thread probe, kể cả sau stop() (vd. quay lại server đã dùng trước đó)"""
+        if self._thread is None or not self._thread.is_alive() or self._stop.is_set():
+            # Mỗi thread có Event riêng: thread cũ đang probe dở vẫn dừng, không tranh _wake với thread mới
+            self._stop = threading.Event()
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop, self._wake),
+                                            name='health-monitor', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def probe_now(self):
+        """Yêu cầu probe ngay (không chờ kết quả)"""
+        self._wake.set()
+
+    @property
+    def status(self):
+        online = self.config_manager.async_manager.online
+        return 'unknown' if online is None else ('online' if online else 'offline')
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else None
+
+    def _run(self, stop, wake):
+        while not stop.is_set():
+            before = self.status
+            started = time.perf_counter()
+            try:
+                healthy = self.config_manager.test_connection()
+            except Exception:
+                healthy = False
+            latency = (time.perf_counter() - started) * 1000
+            self.probes += 1
+            self.last_probe_at = time.time()
+            self.outcomes.append(healthy)
+            if healthy:
+                self.last_latency = latency
+                if self.probes > 1:  # Lần đầu gồm cả import requests và mở kết nối, không tính
+                    self.histogram.record(latency)
+            if not self.first_probe.is_set():
+                startup_profile.mark("health check done")
+                self.first_probe.set()
+            if self.listener and self.status != before:
+                try:
+                    self.listener(self)
+                except Exception:
+                    pass
+            wake.wait(self.interval if healthy else self.offline_interval)
+            wake.clear()
+
+    def stats(self):
+        return {'status': self.status, 'probes': self.probes, 'last_latency': self.last_latency,
+                'last_probe_at': self.last_probe_at, 'error_rate': self.error_rate(),
+                **self.histogram.summary()}
+
+
+class ConfigManager:
+    """Wrapper đồng bộ cho AsyncConfigManager, dùng cho menu và script"""
+
+    def __init__(self, server_url, pool_size=POOL_SIZE):
+        self.server_url = server_url
+        self.async_manager = AsyncConfigManager(server_url, pool_size)
+        # Event loop chạy nền, mọi lời gọi đồng bộ đều được gửi vào loop này. Loop (và asyncio)
+        # được tạo trên chính thread nền để không làm chậm lần vẽ menu đầu tiên
+        self._loop = None
+        self._loop_ready = threading.Event()
+        self._loop_thread = threading.Thread(target=self._run_loop, name='mt5-loop', daemon=True)
+        self._loop_thread.start()
+        self._history = None
+        self.health = HealthMonitor(self)
+        self.request_latency = self.async_manager.latency
+        self.wire_stats = self.async_manager.wire_stats
+        self.single_flight = self.async_manager.single_flight
+
+    @property
+    def history(self):
+        """TimeSeriesStore lịch sử tài khoản, mở khi dùng lần đầu"""
+        if self._history is None:
+            self._history = TimeSeriesStore(os.path.join(server_data_dir(self.server_url), 'history.sqlite3'))
+        return self._history
+
+    @property
+    def session(self):
+        return self.async_manager.session
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop_ready.set()
+        startup_profile.mark("event loop ready")
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()  # Sau close(): giải phóng selector / self-pipe của loop
+
+    def submit(self, coro):
+        """Gửi coroutine vào event loop nền, trả về concurrent.futures.Future ngay lập tức"""
+        self._loop_ready.wait()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro):
+        """Chạy một coroutine trên event loop nền và chờ kết quả"""
+        return self.submit(coro).result()
+
+    def gather(self, *coros):
+        """Chạy song song nhiều coroutine qua pool chung, trả về list kết quả theo thứ tự"""
+        async def _gather():
+            return await asyncio.gather(*coros)
+        return self.run(_gather())
+
+    def invalidate_cache(self, collection_name=None):
+        """Xóa cache của một collection, hoặc toàn bộ cache nếu không truyền tên"""
+        if collection_name is None:
+            self.async_manager.cache.invalidate()
+            self.async_manager.stats_engine.invalidate()
+        else:
+            self.async_manager.invalidate_collection(collection_name)
+
+    def close(self):
+        """Dừng event loop nền và đóng connection pool"""
+        self.health.stop()
+        self._loop_ready.wait()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self.async_manager.close()
+        if self._history is not None:
+            self._history.close()
+
+    def test_connection(self):
+        """Test kết nối đến server"""
+        return self.run(self.async_manager.test_connection())
+
+    def outbox_status(self):
+        """Số thao tác chờ gửi, tiến độ và tốc độ gửi lại của outbox"""
+        return self.async_manager.outbox.status()
+
+    def replay_outbox(self):
+        """Gửi lại ngay các thao tác trong outbox, trả về trạng thái sau khi gửi"""
+        return self.run(self.async_manager.replay_outbox())
+
+    def connection_status(self):
+        """'online', 'offline' hoặc 'unknown' (chưa kiểm tra xong lần nào), không gọi server"""
+        return self.health.status
+
+    def get_mt5_account_info(self):
+        """Lấy thông tin tài khoản MT5 (mỗi kết quả cũng được ghi vào lịch sử trên máy)"""
+        result = self.run(self.async_manager.get_mt5_account_info())
+        if result and not result.get('offline'):
+            self.history.record(result.get('account'), len(result.get('positions', [])))
+        return result
+
+    def iterate(self, async_iterator):
+        """Chuyển một async generator chạy trên event loop nền thành generator đồng bộ"""
+        try:
+            while True:
+                try:
+                    yield self.run(async_iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(async_iterator.aclose())
+
+    def iter_mt5_account_events(self, stop_event, scheduler=None):
+        """Generator đồng bộ trả về các delta tài khoản MT5 (xem stream_mt5_account_events)"""
+        return self.iterate(self.async_manager.stream_mt5_account_events(stop_event, scheduler))
+
+    def iter_mt5_analytics(self, stop_event, scheduler=None, analytics=None):
+        """Generator trả về AccountAnalytics (cùng một đối tượng) sau mỗi delta tài khoản MT5"""
+        analytics = analytics or AccountAnalytics()
+        offline = self.async_manager.offline
+        path = "/api/mt5-account-info"
+        if not analytics.updates:
+            # Hiển thị ngay trạng thái đã lưu trên máy trong lúc chờ server
+            cached = offline.load(path)
+            if cached:
+                analytics.apply({**snapshot_to_delta(cached), 'mode': 'offline', 'cached_at': cached['cached_at']})
+                yield analytics
+        saved_at, dirty = 0, False
+        try:
+            for event in self.iter_mt5_account_events(stop_event, scheduler):
+                analytics.apply(event)
+                if event['type'] != 'error':
+                    self.history.record(analytics.state.get('account'), len(analytics.book))
+                    dirty = True
+                    if time.monotonic() - saved_at > OFFLINE_SNAPSHOT_INTERVAL:
+                        offline.put(path, json.dumps(analytics.to_payload(), default=str))
+                        saved_at, dirty = time.monotonic(), False
+                yield analytics
+        finally:
+            if dirty:
+                offline.put(path, json.dumps(analytics.to_payload(), default=str))
+
+    def test_discord_notification(self, message):
+        """Test gửi tin nhắn Discord"""
+        return self.run(self.async_manager.test_discord_notification(message))
+
+    # Firebase Management Methods
+    def get_firebase_collections(self):
+        """Lấy danh sách tất cả collections trong Firebase"""
+        return self.run(self.async_manager.get_firebase_collections())
+
+    def get_collection_stats(self, collection_name):
+        """Lấy thống kê của một collection"""
+        return self.run(self.async_manager.get_collection_stats(collection_name))
+
+    def iter_collection_stats(self, collection_names, concurrency=OVERVIEW_CONCURRENCY):
+        """Generator trả về (tên, kết quả, độ trễ) của từng collection ngay khi có kết quả"""
+        return self.iterate(self.async_manager.iter_collection_stats(collection_names, concurrency))
+
+    def get_collection_stats_detailed(self, collection_name, timestamp_field=None, refresh=False):
+        """Thống kê ước lượng: số documents, dung lượng, cardinality field, phân bố tuổi"""
+        return self.run(self.async_manager.get_collection_stats_detailed(collection_name, timestamp_field, refresh))
+
+    def clear_collection(self, collection_name):
+        """Xóa toàn bộ documents trong một collection"""
+        return self.run(self.async_manager.clear_collection(collection_name))
+
+    def clear_old_documents(self, collection_name, days):
+        """Xóa documents cũ trong một collection dựa trên số ngày"""
+        return self.run(self.async_manager.clear_old_documents(collection_name, days))
+
+    def start_clear_job(self, collection_name, days=None, batch_size=JOB_BATCH_SIZE):
+        """Bắt đầu xóa collection / documents cũ dạng job chạy nền, trả về job (có 'id')"""
+        return self.run(self.async_manager.start_clear_job(collection_name, days, batch_size))
+
+    def get_job_status(self, job_id):
+        """Trạng thái mới nhất của job"""
+        return self.run(self.async_manager.get_job_status(job_id))
+
+    def cancel_job(self, job_id):
+        """Dừng job"""
+        return self.run(self.async_manager.cancel_job(job_id))
+
+    def resume_job(self, job_id):
+        """Tiếp tục job bị gián đoạn"""
+        return self.run(self.async_manager.resume_job(job_id))
+
+    def list_jobs(self):
+        """Các job đã tạo từ máy này"""
+        return self.run(self.async_manager.list_jobs())
+
+    def watch_job(self, job_id, stop_event, interval=JOB_POLL_INTERVAL):
+        """Generator trả về (job, tốc độ, ETA) cho tới khi job kết thúc"""
+        return self.iterate(self.async_manager.watch_job(job_id, stop_event, interval))
+
+    def get_collection_documents(self, collection_name, limit=50, offset=0, cursor=None):
+        """Lấy danh sách documents trong một collection"""
+        return self.run(self.async_manager.get_collection_documents(collection_name, limit, offset, cursor))
+
+    def query_collection(self, collection_name, where=None, order_by=None, select=None, limit=None,
+                         offset=0, cursor=None):
+        """Truy vấn collection, lọc và chọn field trên server (xem AsyncConfigManager.query_collection)"""
+        return self.run(self.async_manager.query_collection(
+            collection_name, where, order_by, select, limit, offset, cursor))
+
+    def iter_collection_documents(self, collection_name, page_size=DOCUMENT_PAGE_SIZE, token=None,
+                                  prefetch=DOCUMENT_PREFETCH, where=None, order_by=None, select=None):
+        """Duyệt toàn bộ documents của collection theo trang (xem DocumentIterator)"""
+        return DocumentIterator(self, collection_name, page_size, token, prefetch, where, order_by, select)
+
+    def export_collection(self, collection_name, path=None, format='ndjson', resume=True, page_size=DOCUMENT_PAGE_SIZE,
+                          prefetch=EXPORT_PREFETCH, progress=None, stop_event=None):
+        """Xuất toàn bộ documents ra file (xem CollectionExporter), tiếp tục từ checkpoint nếu có"""
+        path = os.path.expanduser(path or default_export_path(self.server_url, collection_name, format))
+        exporter = CollectionExporter(self, collection_name, path, format, page_size, prefetch)
+        try:
+            return exporter.run(resume, progress, stop_event)
+        except ImportError:
+            print("❌ Xuất Parquet cần cài pyarrow: pip install pyarrow")
             return None
+        except RuntimeError as e:
+            # Mất kết nối giữa chừng: phần đã xuất được giữ lại trong checkpoint
+            return {'success': False, 'completed': False, 'error': str(e), 'path': path, **exporter.stats()}
+        except OSError as e:
+            # Lỗi ghi file (hết dung lượng...): giữ checkpoint trước đó, lần sau tiếp tục từ đó
+            print(f"❌ Không ghi được file xuất: {e}")
+            return {'success': False, 'completed': False, 'error': str(e), 'path': path, **exporter.stats()}
+
+    def import_documents(self, collection_name, path, format=None, id_field='id', batch_size=BULK_BATCH_SIZE,
+                         concurrency=BULK_CONCURRENCY, rate=IMPORT_RATE_LIMIT, resume=True, progress=None,
+                         stop_event=None):
+        """Nhập documents từ file NDJSON / CSV (xem DocumentImporter), tiếp tục từ checkpoint nếu có"""
+        try:
+            importer = DocumentImporter(self, collection_name, path, format, id_field, batch_size, concurrency, rate)
+        except OSError as e:
+            print(f"❌ Không đọc được file: {e}")
+            return None
+        return importer.run(resume, progress, stop_event)
 
     def delete_document(self, collection_name, document_id):
         """Xóa một document cụ thể"""
+        return self.run(self.async_manager.delete_document(collection_name, document_id))
+
+    def update_document(self, collection_name, document_id, data):
+        """Cập nhật một document cụ thể"""
+        return self.run(self.async_manager.update_document(collection_name, document_id, data))
+
+    def bulk_delete_documents(self, collection_name, document_ids, batch_size=BULK_BATCH_SIZE,
+                              concurrency=BULK_CONCURRENCY, progress=None):
+        """Xóa nhiều documents theo id, trả về {document_id: {'success', 'error'}}"""
+        return self.run(self.async_manager.bulk_delete_documents(
+            collection_name, document_ids, batch_size, concurrency, progress))
+
+    def bulk_update_documents(self, collection_name, updates, batch_size=BULK_BATCH_SIZE,
+                              concurrency=BULK_CONCURRENCY, progress=None):
+        """Cập nhật nhiều documents ({document_id: dữ liệu}), trả về {document_id: {'success', 'error'}}"""
+        return self.run(self.async_manager.bulk_update_documents(
+            collection_name, updates, batch_size, concurrency, progress))
+
+
+def encode_page_token(position):
+    """Mã hóa vị trí phân trang thành token dạng chuỗi, None nghĩa là đã hết dữ liệu"""
+    if position is None:
+        return None
+    raw = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_page_token(token):
+    """Giải mã token phân trang, token rỗng = bắt đầu từ đầu collection"""
+    if not token:
+        return {'o': 0}
+    raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    return json.loads(raw)
+
+
+class ServerRegistry:
+    """Danh sách nhiều server MT5 bot đọc từ SERVERS_FILE, mỗi server một ConfigManager riêng
+
+    File JSON dạng {"servers": [{"name": "bot1", "url": "http://..."}], "active": "bot1"}. Nếu
+    chưa có file thì registry chỉ gồm SERVER_URL. Mỗi ConfigManager có event loop, connection
+    pool và dữ liệu trên máy riêng nên một tunnel chết không làm chậm các server còn lại.
+    """
+
+    def __init__(self, path=SERVERS_FILE, default_url=None):
+        self.path = path
+        self.servers = OrderedDict()  # tên -> url
+        self.active = None
+        self._managers = {}
         try:
-            response = self.session.delete(f"{self.server_url}/api/firebase/document/{collection_name}/{document_id}")
-            if response.status_code == 200:
-                return response.json()
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            for server in data.get('servers', []):
+                self.servers[server['name']] = server['url'].rstrip('/')
+            self.active = data.get('active')
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        if not self.servers:
+            self.servers['default'] = (default_url or SERVER_URL).rstrip('/')
+        if self.active not in self.servers:
+            self.active = next(iter(self.servers))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'servers': [{'name': name, 'url': url} for name, url in self.servers.items()],
+                       'active': self.active}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def add(self, name, url):
+        self.servers[name] = url.rstrip('/')
+        self._drop(name)
+        self.save()
+
+    def remove(self, name):
+        if name not in self.servers or len(self.servers) == 1:
+            return False
+        del self.servers[name]
+        self._drop(name)
+        if self.active == name:
+            self.active = next(iter(self.servers))
+        self.save()
+        return True
+
+    def _drop(self, name):
+        manager = self._managers.pop(name, None)
+        if manager is not None:
+            manager.close()
+
+    def manager(self, name=None):
+        """ConfigManager của server (mặc định server đang chọn), tạo khi dùng lần đầu"""
+        name = name or self.active
+        if name not in self._managers:
+            self._managers[name] = ConfigManager(self.servers[name])
+        return self._managers[name]
+
+    def activate(self, name):
+        self.active = name
+        self.save()
+        return self.manager(name)
+
+    def close(self):
+        for name in list(self._managers):
+            self._drop(name)
+
+    def fan_out(self, call, timeout=FANOUT_TIMEOUT):
+        """Gọi call(async_manager) trên tất cả server song song
+
+        Yield (tên, kết quả, độ trễ giây, lỗi) theo thứ tự hoàn thành. Server không trả lời
+        trong timeout giây được trả về với lỗi 'timeout' thay vì chặn các server khác.
+        """
+        futures = {}
+        for name in self.servers:
+            manager = self.manager(name)
+            futures[manager.submit(call(manager.async_manager))] = (name, time.perf_counter())
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                name, started = futures.pop(future)
+                try:
+                    result = future.result()
+                    error = None if result is not None else (
+                        self._managers[name].async_manager.last_connection_error or 'không kết nối được')
+                    yield name, result, time.perf_counter() - started, error
+                except Exception as e:
+                    yield name, None, time.perf_counter() - started, str(e)
+        except FutureTimeoutError:
+            for future, (name, started) in futures.items():
+                future.cancel()
+                yield name, None, time.perf_counter() - started, 'timeout'
+
+    def iter_account_info(self, timeout=FANOUT_TIMEOUT):
+        """Thông tin tài khoản MT5 của tất cả server, theo thứ tự trả về"""
+        return self.fan_out(lambda manager: manager.get_mt5_account_info(), timeout)
+
+    def iter_health(self, timeout=FANOUT_TIMEOUT):
+        """Health check tất cả server song song"""
+        return self.fan_out(lambda manager: manager.test_connection(), timeout)
+
+
+def consolidate_accounts(results):
+    """Gộp thông tin tài khoản của nhiều server: tổng theo tiền tệ và danh sách lệnh có tên server
+
+    results là {tên server: payload /api/mt5-account-info hoặc None}.
+    """
+    totals = {}
+    positions = []
+    for name, info in results.items():
+        if not info or not info.get('account'):
+            continue
+        account = info['account']
+        currency = account.get('currency', 'N/A')
+        total = totals.setdefault(currency, {'servers': 0, 'balance': 0.0, 'equity': 0.0, 'profit': 0.0,
+                                             'margin': 0.0, 'positions': 0})
+        total['servers'] += 1
+        for field in ('balance', 'equity', 'profit', 'margin'):
+            value = account.get(field)
+            if isinstance(value, (int, float)):
+                total[field] += value
+        total['positions'] += len(info.get('positions', []))
+        positions += [{**pos, 'server': name} for pos in info.get('positions', [])]
+    positions.sort(key=lambda pos: pos.get('profit') or 0)
+    return {'totals': totals, 'positions': positions}
+
+
+class LocalQueryScan:
+    """Trạng thái query phía client (server chưa có /query) dùng chung giữa các trang của một lần duyệt
+
+    Collection chỉ được đọc một lần từ đầu tới cuối thay vì quét lại từ offset 0 cho mỗi trang:
+    documents khớp được giữ từ trang nhỏ nhất còn cần. Có order_by thì phải đọc hết collection
+    (một lần) rồi sắp xếp.
+    """
+
+    def __init__(self):
+        self.source_offset = 0  # Số documents của collection đã đọc
+        self.exhausted = False
+        self.sorted = False
+        self.base = 0  # Vị trí của matches[0] trong kết quả query
+        self.matches = []
+        self.offline = False  # Có trang lấy từ dữ liệu lưu trên máy
+        self.cached_at = None
+        self.lock = None  # asyncio.Lock, tạo trên event loop khi dùng lần đầu
+
+
+class DocumentIterator:
+    """Duyệt documents của một collection theo trang với bộ nhớ giới hạn
+
+    Dùng cursor nếu server trả 'next_cursor', ngược lại dùng limit/offset. Trong khi trang hiện
+    tại đang được xử lý, tối đa `prefetch` trang tiếp theo được tải trước qua connection pool.
+    Thuộc tính `token` là vị trí có thể lưu lại để tiếp tục sau (None khi đã duyệt hết).
+    Khi có where/order_by/select, mỗi trang được lấy bằng query_collection.
+
+        for doc in config_manager.iter_collection_documents('signals'):
+            ...
+    """
+
+    def __init__(self, config_manager, collection_name, page_size=DOCUMENT_PAGE_SIZE, token=None,
+                 prefetch=DOCUMENT_PREFETCH, where=None, order_by=None, select=None, offline=True):
+        self.config_manager = config_manager
+        self.collection_name = collection_name
+        self.page_size = page_size
+        self.prefetch = max(0, prefetch)
+        self.where = where
+        self.order_by = order_by
+        self.select = select
+        self.offline = offline  # False: lỗi khi mất kết nối thay vì dùng trang đã lưu trên máy
+        self.position = decode_page_token(token)
+        self.total = None
+        self.cached_at = None  # Thời điểm lưu nếu trang cuối cùng lấy từ dữ liệu offline
+        self._scan = LocalQueryScan()
+
+    @property
+    def token(self):
+        return encode_page_token(self.position)
+
+    @property
+    def finished(self):
+        return self.position is None
+
+    def _submit(self, position):
+        manager = self.config_manager.async_manager
+        if self.where or self.order_by or self.select:
+            coro = manager.query_collection(self.collection_name, self.where, self.order_by, self.select,
+                                            self.page_size, position.get('o', 0), position.get('c'),
+                                            self.offline, self._scan)
+        else:
+            coro = manager.get_collection_documents(self.collection_name, self.page_size, position.get('o', 0),
+                                                    position.get('c'), use_cache=False, offline=self.offline)
+        return position, self.config_manager.submit(coro)
+
+    def _next_position(self, start, documents, result):
+        """Vị trí trang kế tiếp, None nếu đây là trang cuối"""
+        if 'next_cursor' in result:
+            return {'c': result['next_cursor']} if result['next_cursor'] else None
+        offset = start.get('o', 0) + len(documents)
+        if len(documents) < self.page_size or (self.total is not None and offset >= self.total):
+            return None
+        return {'o': offset}
+
+    def pages(self):
+        """Yield danh sách documents của từng trang, cập nhật `token` khi sang trang mới"""
+        if self.position is None:
+            return
+        pending = deque([self._submit(self.position)])
+        try:
+            while pending:
+                start, future = pending.popleft()
+                result = future.result()
+                if not result or not result.get('success'):
+                    error = result.get('error', 'Không xác định') if result else 'Lỗi kết nối'
+                    raise RuntimeError(f"Không thể lấy documents của '{self.collection_name}': {error}")
+                documents = result.get('documents', [])
+                self.cached_at = result.get('cached_at') if result.get('offline') else None
+                if self.total is None:
+                    self.total = result.get('count')
+
+                next_position = self._next_position(start, documents, result)
+                if next_position is None:
+                    for _, stale in pending:
+                        stale.cancel()
+                    pending.clear()
+                elif 'c' in next_position:
+                    # Cursor chỉ biết sau khi nhận trang trước nên chỉ tải trước được một trang
+                    if self.prefetch and not pending:
+                        pending.append(self._submit(next_position))
+                else:
+                    ahead = pending[-1][0]['o'] + self.page_size if pending else next_position['o']
+                    while len(pending) < self.prefetch:
+                        pending.append(self._submit({'o': ahead}))
+                        ahead += self.page_size
+
+                self.position = start
+                yield documents[start.get('s', 0):]
+                self.position = next_position
+                if next_position is not None and not pending:
+                    pending.append(self._submit(next_position))
+        finally:
+            for _, stale in pending:
+                stale.cancel()
+
+    def __iter__(self):
+        for documents in self.pages():
+            start = self.position
+            skip = start.get('s', 0)
+            for index, doc in enumerate(documents, 1):
+                if 'c' in start:
+                    self.position = {'c': start['c'], 's': skip + index}
+                else:
+                    self.position = {'o': start['o'] + index}
+                yield doc
+
+
+class NdjsonExportWriter:
+    """Ghi documents vào file .ndjson.gz, mỗi checkpoint đóng một gzip member
+
+    File nhiều member vẫn đọc được bằng gzip/zcat như một file liền. Khi tiếp tục, file được cắt
+    về kích thước tại checkpoint cuối nên phần ghi dở (chưa checkpoint) bị bỏ đi và ghi lại.
+    """
+
+    def __init__(self, path, checkpoint=None):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if checkpoint:
+            self._raw = open(path, 'r+b')
+            self._raw.truncate(checkpoint['bytes'])
+            self._raw.seek(checkpoint['bytes'])
+        else:
+            self._raw = open(path, 'wb')
+        self._member = None
+
+    @property
+    def bytes_written(self):
+        return self._raw.tell() if not self._raw.closed else os.path.getsize(self.path)
+
+    def write(self, documents):
+        if self._member is None:
+            self._member = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=EXPORT_GZIP_LEVEL, mtime=0)
+        data = ''.join(json.dumps(doc, ensure_ascii=False, default=str, separators=(',', ':')) + '\n'
+                       for doc in documents).encode('utf-8')
+        self._member.write(data)
+        return len(data)
+
+    def commit(self):
+        """Ghi xong phần đã nhận xuống đĩa, trả về trạng thái cần lưu vào checkpoint"""
+        if self._member is not None:
+            self._member.close()  # Không đóng file gốc
+            self._member = None
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        return {'bytes': self._raw.tell()}
+
+    def close(self):
+        self.commit()
+        self._raw.close()
+
+    def abort(self):
+        """Đóng file sau khi ghi một trang bị lỗi, không fsync; phần sau checkpoint cuối bị cắt khi tiếp tục"""
+        member, self._member = self._member, None
+        try:
+            if member is not None:
+                member.close()
+        finally:
+            self._raw.close()
+
+
+class ParquetExportWriter:
+    """Ghi documents thành thư mục part-00000.parquet, part-00001.parquet... (cần pyarrow)
+
+    Mỗi checkpoint ghi một part nên bộ nhớ chỉ giữ tối đa EXPORT_CHECKPOINT_DOCUMENTS documents.
+    Field dạng dict/list được lưu thành chuỗi JSON; field có nhiều kiểu giá trị khác nhau được
+    chuyển thành chuỗi để mỗi part có schema cố định.
+    """
+
+    def __init__(self, path, checkpoint=None):
+        self._pyarrow = importlib.import_module('pyarrow')
+        self._parquet = importlib.import_module('pyarrow.parquet')
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.parts = checkpoint['parts'] if checkpoint else 0
+        # Part ghi dở của lần chạy trước (sau checkpoint cuối) bị xóa
+        for name in os.listdir(path):
+            if name.startswith('part-') and int(name[5:10]) >= self.parts:
+                os.remove(os.path.join(path, name))
+        self._rows = []
+        self._bytes = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    @property
+    def bytes_written(self):
+        return self._bytes
+
+    def write(self, documents):
+        size = 0
+        for doc in documents:
+            size += len(json.dumps(doc, ensure_ascii=False, default=str).encode('utf-8')) + 1
+            self._rows.append({field: json.dumps(value, ensure_ascii=False, default=str)
+                               if isinstance(value, (dict, list)) else value for field, value in doc.items()})
+        return size
+
+    @staticmethod
+    def _columns(rows):
+        """Dữ liệu theo cột, cột có nhiều kiểu (ngoài int/float lẫn nhau) được chuyển thành chuỗi"""
+        fields = list(dict.fromkeys(field for row in rows for field in row))
+        columns = {}
+        for field in fields:
+            values = [row.get(field) for row in rows]
+            kinds = {type(value) for value in values if value is not None}
+            if len(kinds - {int, float}) > 1 or (kinds & {int, float} and kinds - {int, float}):
+                values = [None if value is None else str(value) for value in values]
+            elif kinds == {int, float}:
+                values = [None if value is None else float(value) for value in values]
+            columns[field] = values
+        return columns
+
+    def commit(self):
+        if self._rows:
+            table = self._pyarrow.table(self._columns(self._rows))
+            part_path = os.path.join(self.path, f"part-{self.parts:05d}.parquet")
+            self._parquet.write_table(table, f"{part_path}.tmp", compression='zstd')
+            os.replace(f"{part_path}.tmp", part_path)
+            self._bytes += os.path.getsize(part_path)
+            self.parts += 1
+            self._rows = []
+        return {'parts': self.parts}
+
+    def close(self):
+        self.commit()
+
+    def abort(self):
+        self._rows = []
+
+
+EXPORT_WRITERS = {'ndjson': NdjsonExportWriter, 'parquet': ParquetExportWriter}
+
+
+class CollectionExporter:
+    """Xuất toàn bộ documents của một collection ra file trên máy với bộ nhớ cố định
+
+    Documents được lấy theo trang qua DocumentIterator (EXPORT_PREFETCH trang tải song song qua
+    connection pool trong khi trang hiện tại đang được nén và ghi). Sau mỗi
+    EXPORT_CHECKPOINT_DOCUMENTS documents, dữ liệu được ghi xuống đĩa và vị trí phân trang lưu vào
+    `<path>.checkpoint`; chạy lại với cùng path sẽ tiếp tục từ đó. Checkpoint bị xóa khi xong.
+    """
+
+    def __init__(self, config_manager, collection_name, path, format='ndjson', page_size=DOCUMENT_PAGE_SIZE,
+                 prefetch=EXPORT_PREFETCH):
+        self.config_manager = config_manager
+        self.collection_name = collection_name
+        self.path = path
+        self.format = format
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.checkpoint_path = f"{path.rstrip(os.sep)}.checkpoint"
+        self.documents = 0
+        self.raw_bytes = 0  # Dung lượng JSON trước khi nén
+        self.total = None
+        self.resumed_from = 0
+        self.resumed_bytes = 0
+        self.started = None
+        self.writer = None
+
+    def load_checkpoint(self):
+        """Checkpoint của lần xuất dở trước đó, None nếu không có / không khớp collection"""
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if checkpoint.get('collection') != self.collection_name or checkpoint.get('format') != self.format:
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, token, writer_state):
+        checkpoint = {'collection': self.collection_name, 'format': self.format, 'token': token,
+                      'documents': self.documents, 'raw_bytes': self.raw_bytes, 'total': self.total,
+                      'updated_at': datetime.now().isoformat(timespec='seconds'), **writer_state}
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def stats(self):
+        """Tiến độ và tốc độ hiện tại"""
+        elapsed = max(time.monotonic() - self.started, 1e-6) if self.started else 0
+        exported, exported_bytes = self.documents - self.resumed_from, self.raw_bytes - self.resumed_bytes
+        return {'documents': self.documents, 'total': self.total, 'raw_bytes': self.raw_bytes,
+                'file_bytes': self.writer.bytes_written if self.writer else 0,
+                'elapsed': elapsed, 'rate': exported / elapsed if elapsed else 0,
+                'byte_rate': exported_bytes / elapsed if elapsed else 0}
+
+    def run(self, resume=True, progress=None, stop_event=None):
+        """Xuất collection, trả về kết quả gồm 'completed' (False nếu bị dừng giữa chừng)
+
+        progress(stats) được gọi sau mỗi trang. stop_event dừng xuất sau trang hiện tại, phần đã
+        xuất được giữ lại và có thể tiếp tục bằng cách chạy lại.
+        """
+        checkpoint = self.load_checkpoint() if resume else None
+        if checkpoint:
+            self.documents = self.resumed_from = checkpoint['documents']
+            self.raw_bytes = self.resumed_bytes = checkpoint.get('raw_bytes', 0)
+            self.total = checkpoint.get('total')
+        self.writer = EXPORT_WRITERS[self.format](self.path, checkpoint)
+        iterator = DocumentIterator(self.config_manager, self.collection_name, self.page_size,
+                                    checkpoint['token'] if checkpoint else None, self.prefetch, offline=False)
+        self.started = time.monotonic()
+        pending = 0
+        completed = writing = False
+        try:
+            for documents in iterator.pages():
+                if pending >= EXPORT_CHECKPOINT_DOCUMENTS:
+                    # iterator.token lúc này trỏ tới đầu trang vừa nhận: mọi trang trước đã được ghi
+                    self._save_checkpoint(iterator.token, self.writer.commit())
+                    pending = 0
+                if stop_event is not None and stop_event.is_set():
+                    break
+                self.total = iterator.total if iterator.total is not None else self.total
+                writing = True
+                self.raw_bytes += self.writer.write(documents)
+                writing = False
+                self.documents += len(documents)
+                pending += len(documents)
+                if progress:
+                    progress(self.stats())
             else:
-                print(f"❌ Lỗi HTTP: {response.status_code}")
-                return None
-        except Exception as e:
-            print(f"❌ Lỗi: {e}")
+                completed = True
+        finally:
+            if completed:
+                self.writer.close()
+                if os.path.exists(self.checkpoint_path):
+                    os.remove(self.checkpoint_path)
+            elif not writing:
+                # Bị dừng / mất kết nối: lưu phần đã ghi để lần sau tiếp tục
+                self._save_checkpoint(iterator.token, self.writer.commit())
+                self.writer.close()
+            else:
+                # Lỗi khi đang ghi một trang: giữ checkpoint cũ, lần sau cắt bỏ phần ghi dở
+                self.writer.abort()
+        return {'success': True, 'completed': completed, 'collection': self.collection_name, 'path': self.path,
+                'format': self.format, 'resumed_from': self.resumed_from, **self.stats()}
+
+
+def default_export_path(server_url, collection_name, format='ndjson'):
+    """Đường dẫn mặc định: <thư mục server>/exports/<collection>-<thời gian>.ndjson.gz (hoặc .parquet/)"""
+    suffix = '.ndjson.gz' if format == 'ndjson' else '.parquet'
+    name = f"{collection_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}{suffix}"
+    return os.path.join(server_data_dir(server_url), 'exports', name)
+
+
+def pending_exports(server_url, collection_name):
+    """Các lần xuất dở (còn checkpoint) của collection trong thư mục mặc định, mới nhất trước"""
+    directory = os.path.join(server_data_dir(server_url), 'exports')
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    paths = [os.path.join(directory, name[:-len('.checkpoint')]) for name in names
+             if name.startswith(f"{collection_name}-") and name.endswith('.checkpoint')]
+    return sorted(paths, reverse=True)
+
+
+def format_export_progress(stats):
+    """Một dòng tiến độ xuất: documents, dung lượng và tốc độ"""
+    if stats['total']:
+        done = format_progress(min(stats['documents'], stats['total']), stats['total'])
+    else:
+        done = f"{stats['documents']:,} documents"
+    return (f"{done} | {format_bytes(stats['raw_bytes'])} JSON -> {format_bytes(stats['file_bytes'])}"
+            f" | {stats['rate']:,.0f} docs/s, {format_bytes(stats['byte_rate'])}/s")
+
+
+class RateLimiter:
+    """Token bucket giới hạn số đơn vị mỗi giây (dồn tối đa một giây), rate=0 là không giới hạn"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def acquire(self, amount=1):
+        """Chờ tới khi đủ quota cho `amount` đơn vị, trả về số giây đã chờ"""
+        if not self.rate:
+            return 0
+        waited = 0
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Lượng lớn hơn rate được cho qua khi bucket đầy, phần thiếu trả dần ở các lần sau
+            if self.tokens >= min(amount, self.rate):
+                self.tokens -= amount
+                return waited
+            delay = (min(amount, self.rate) - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def read_import_records(stream, format, id_field='id'):
+    """Đọc từng bản ghi của file NDJSON / CSV, yield (số thứ tự, document_id, dữ liệu, lỗi)
+
+    Bản ghi không hợp lệ có lỗi khác None. CSV: ô rỗng bị bỏ qua, giá trị JSON (số, true/false,
+    object...) được chuyển kiểu, còn lại giữ nguyên là chuỗi.
+    """
+    if format == 'csv':
+        rows = (dict(row) for row in csv.DictReader(stream))
+    else:
+        rows = (line for line in stream if line.strip())
+    for index, row in enumerate(rows):
+        try:
+            if format == 'csv':
+                record = {}
+                for field, value in row.items():
+                    if field is None or value in (None, ''):
+                        continue
+                    try:
+                        record[field] = json.loads(value)
+                    except ValueError:
+                        record[field] = value
+            else:
+                record = json.loads(row)
+            yield (index, *validate_import_record(record, id_field))
+        except ValueError as e:
+            yield index, None, None, f"JSON không hợp lệ: {e}"
+
+
+def validate_import_record(record, id_field='id'):
+    """Kiểm tra một bản ghi trước khi gửi, trả về (document_id, dữ liệu, lỗi)"""
+    if not isinstance(record, dict):
+        return None, None, "Bản ghi không phải object JSON"
+    document_id = record.get(id_field)
+    if isinstance(document_id, (int, float)) and not isinstance(document_id, bool):
+        document_id = str(document_id)
+    if not isinstance(document_id, str) or not document_id.strip():
+        return None, None, f"Thiếu field '{id_field}'"
+    if '/' in document_id or document_id in ('.', '..') or (document_id.startswith('__') and document_id.endswith('__')):
+        return document_id, None, f"Document ID không hợp lệ: '{document_id}'"
+    data = {field: value for field, value in record.items() if field != id_field}
+    for field in data:
+        if not field or (field.startswith('__') and field.endswith('__')):
+            return document_id, None, f"Tên field không hợp lệ: '{field}'"
+    size = len(json.dumps(data, ensure_ascii=False, default=str).encode('utf-8'))
+    if size > IMPORT_MAX_DOCUMENT_BYTES:
+        return document_id, None, f"Document quá lớn ({format_bytes(size)})"
+    return document_id, data, None
+
+
+class DocumentImporter:
+    """Nhập documents từ file NDJSON / CSV (có thể nén .gz) vào collection, đọc dạng stream
+
+    Bản ghi hợp lệ được gom thành batch BULK_BATCH_SIZE thao tác update (server merge vào document
+    hoặc tạo mới nếu chưa có) và gửi qua endpoint batch, tối đa `concurrency` batch cùng lúc trong
+    khi file tiếp tục được đọc. RateLimiter giữ tốc độ ghi dưới `rate` documents/giây. Vị trí
+    (số bản ghi đầu file đã được server xác nhận) lưu vào checkpoint sau mỗi batch; chạy lại với
+    cùng file sẽ bỏ qua phần đã nhập. Bản ghi lỗi được ghi vào file .rejected.ndjson.
+    """
+
+    def __init__(self, config_manager, collection_name, path, format=None, id_field='id',
+                 batch_size=BULK_BATCH_SIZE, concurrency=BULK_CONCURRENCY, rate=IMPORT_RATE_LIMIT):
+        self.config_manager = config_manager
+        self.collection_name = collection_name
+        self.path = os.path.abspath(os.path.expanduser(path))
+        base = self.path[:-3] if self.path.endswith('.gz') else self.path
+        self.format = format or ('csv' if base.endswith('.csv') else 'ndjson')
+        self.id_field = id_field
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rate)
+        key = hashlib.sha1(f"{collection_name}\0{self.path}".encode()).hexdigest()[:12]
+        directory = os.path.join(server_data_dir(config_manager.server_url), 'imports')
+        self.checkpoint_path = os.path.join(directory, f"{collection_name}-{key}.checkpoint")
+        self.rejects_path = os.path.join(directory, f"{collection_name}-{key}.rejected.ndjson")
+        self.offset = 0  # Số bản ghi đầu file đã xử lý xong (nhập / lỗi)
+        self.resumed_from = 0
+        self.read = self.imported = self.failed = self.rejected = 0
+        self.file_size = os.path.getsize(self.path)
+        self.bytes_read = 0
+        self.started = None
+        self.errors = []  # Vài lỗi đầu tiên để hiển thị
+
+    def _source_signature(self):
+        stat = os.stat(self.path)
+        return {'source': self.path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def load_checkpoint(self):
+        """Checkpoint của lần nhập dở, None nếu không có hoặc file nguồn đã thay đổi"""
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
             return None
+        signature = self._source_signature()
+        if any(checkpoint.get(field) != value for field, value in signature.items()):
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self):
+        checkpoint = {**self._source_signature(), 'collection': self.collection_name, 'offset': self.offset,
+                      'imported': self.imported, 'failed': self.failed, 'rejected': self.rejected,
+                      'updated_at': datetime.now().isoformat(timespec='seconds')}
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6) if self.started else 0
+        done = self.offset - self.resumed_from
+        return {'read': self.read, 'offset': self.offset, 'imported': self.imported, 'failed': self.failed,
+                'rejected': self.rejected, 'bytes_read': self.bytes_read, 'file_size': self.file_size,
+                'elapsed': elapsed, 'rate': done / elapsed if elapsed else 0}
+
+    def _finish_group(self, group, results, rejects):
+        """Cộng kết quả của một nhóm bản ghi liên tiếp (một batch và các bản ghi lỗi xen giữa)"""
+        failures = list(group['rejects'])
+        self.rejected += len(group['rejects'])
+        # Đi theo các id đã gửi: id server trả về mà nhóm không có (vd. server chuẩn hóa id) bị bỏ qua,
+        # document tương ứng được tính là lỗi để ghi vào file rejects và nhập lại sau
+        for document_id, index in group['ids'].items():
+            result = results.get(document_id) or {'success': False, 'error': 'Server không trả kết quả cho document này'}
+            if result.get('success'):
+                self.imported += 1
+            else:
+                self.failed += 1
+                failures.append((index, document_id, result.get('error') or 'Không xác định'))
+        for index, document_id, error in sorted(failures, key=lambda failure: failure[0]):
+            if len(self.errors) < 10:
+                self.errors.append({'record': index + 1, 'id': document_id, 'error': error})
+            rejects.write(json.dumps({'record': index + 1, 'id': document_id, 'error': error},
+                                     ensure_ascii=False) + '\n')
+        self.offset = group['end']
+        self._save_checkpoint()
+
+    def run(self, resume=True, progress=None, stop_event=None):
+        """Nhập file, trả về kết quả gồm 'completed' (False nếu bị dừng / mất kết nối giữa chừng)
+
+        progress(stats) được gọi sau mỗi batch. stop_event dừng đọc file, các batch đang gửi
+        được chờ xong rồi lưu checkpoint.
+        """
+        checkpoint = self.load_checkpoint() if resume else None
+        if checkpoint:
+            self.offset = self.resumed_from = checkpoint['offset']
+            self.imported, self.failed, self.rejected = checkpoint['imported'], checkpoint['failed'], checkpoint['rejected']
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        raw = open(self.path, 'rb')
+        stream = io.TextIOWrapper(gzip.GzipFile(fileobj=raw) if self.path.endswith('.gz') else raw,
+                                  encoding='utf-8-sig', newline='' if self.format == 'csv' else None)
+        rejects = open(self.rejects_path, 'a' if checkpoint else 'w', encoding='utf-8')
+        manager = self.config_manager.async_manager
+        in_flight = deque()  # (nhóm, future) theo thứ tự trong file, future None = nhóm chỉ có bản ghi lỗi
+        error = None
+        completed = stopped = False
+
+        def finish_head():
+            """Xử lý các nhóm đã xong ở đầu hàng đợi, nhờ vậy vị trí checkpoint luôn liên tục"""
+            nonlocal error
+            while in_flight and error is None and (in_flight[0][1] is None or in_flight[0][1].done()):
+                group, future = in_flight[0]
+                try:
+                    results = future.result() if future is not None else {}
+                except Exception as e:
+                    error = str(e)  # Mất kết nối / hết quota: dừng, batch này được gửi lại khi tiếp tục
+                    return
+                in_flight.popleft()
+                self._finish_group(group, results, rejects)
+                if progress:
+                    progress(self.stats())
+
+        def send(group):
+            self.limiter.acquire(len(group['operations']))
+            in_flight.append((group, self.config_manager.submit(
+                manager.import_batch(self.collection_name, list(group['operations'].values())))))
+            while len(in_flight) >= self.concurrency and error is None:
+                # Chỉ chờ batch đầu hàng đợi: batch sau xong trước cũng chưa được tính vào checkpoint
+                if in_flight[0][1] is not None:
+                    wait([in_flight[0][1]])
+                finish_head()
+
+        def new_group():
+            # ids: document_id -> số thứ tự bản ghi (id trùng trong một batch: bản ghi sau thắng)
+            return {'ids': {}, 'operations': {}, 'rejects': [], 'end': self.offset}
+
+        self.started = time.monotonic()
+        group = new_group()
+        try:
+            for index, document_id, data, invalid in read_import_records(stream, self.format, self.id_field):
+                if index < self.resumed_from:
+                    continue
+                if error is not None:
+                    break
+                if stop_event is not None and stop_event.is_set():
+                    stopped = True
+                    break
+                self.read += 1
+                self.bytes_read = raw.tell()
+                group['end'] = index + 1
+                if invalid:
+                    group['rejects'].append((index, document_id, invalid))
+                    continue
+                group['ids'][document_id] = index
+                group['operations'][document_id] = {'op': 'update', 'id': document_id, 'data': data}
+                if len(group['operations']) >= self.batch_size:
+                    send(group)
+                    group = new_group()
+            else:
+                if group['operations']:
+                    send(group)
+                elif group['rejects']:
+                    in_flight.append((group, None))
+            # Chờ các batch đang gửi, kể cả khi người dùng dừng
+            while in_flight and error is None:
+                if in_flight[0][1] is not None:
+                    wait([in_flight[0][1]])
+                finish_head()
+            completed = error is None and not stopped
+        finally:
+            finish_head()
+            for _, future in in_flight:
+                if future is not None:
+                    future.cancel()
+            if completed and os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+            rejects.close()
+            stream.close()
+            raw.close()  # GzipFile không đóng file được truyền vào qua fileobj
+            manager.invalidate_collection(self.collection_name, include_list=True)
+        result = {'success': completed and not self.failed and not self.rejected, 'completed': completed,
+                  'collection': self.collection_name, 'source': self.path, 'format': self.format,
+                  'resumed_from': self.resumed_from, 'errors': self.errors, **self.stats()}
+        if error:
+            result['error'] = error
+        if self.failed or self.rejected:
+            result['rejects_path'] = self.rejects_path
+        return result
+
+
+def format_import_progress(stats):
+    """Một dòng tiến độ nhập: phần file đã đọc, số documents và tốc độ"""
+    return (f"{format_progress(stats['bytes_read'], stats['file_size'], 20).split(' (')[0]}"
+            f" | ✅ {stats['imported']:,} | ❌ {stats['failed'] + stats['rejected']:,}"
+            f" | {stats['rate']:,.0f} docs/s")
+
+
+FILTER_OPERATORS = ('==', '!=', '>=', '<=', '>', '<')
+
+
+def parse_filter_expression(text):
+    """Phân tích điều kiện dạng 'status == old and score < 5' thành [(field, op, value)]"""
+    where = []
+    for clause in text.split(' and '):
+        clause = clause.strip()
+        if not clause:
+            continue
+        for op in FILTER_OPERATORS:
+            field, found, value = clause.partition(op)
+            if found:
+                break
+        else:
+            raise ValueError(f"Điều kiện không hợp lệ: '{clause}'")
+        value = value.strip()
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass  # Giá trị không phải JSON được hiểu là chuỗi
+        where.append((field.strip(), op, value))
+    return where
 
-    def update_document(self, collection_name, document_id, data):
-        """Cập nhật một document cụ thể"""
+
+def document_matches(doc, where):
+    """Kiểm tra document có thỏa tất cả điều kiện where (lọc phía client)"""
+    for field, op, value in where:
+        if field not in doc:
+            return False
+        actual = doc[field]
         try:
-            response = self.session.put(f"{self.server_url}/api/firebase/document/{collection_name}/{document_id}",
-                                        json=data)
-            if response.status_code == 200:
-                return response.json()
+            if op == '==' and actual != value:
+                return False
+            if op == '!=' and actual == value:
+                return False
+            if op == '>' and not actual > value:
+                return False
+            if op == '>=' and not actual >= value:
+                return False
+            if op == '<' and not actual < value:
+                return False
+            if op == '<=' and not actual <= value:
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+def normalize_order_by(order_by):
+    """Chuẩn hóa order_by thành [[field, 'asc'|'desc']]"""
+    if not order_by:
+        return []
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    normalized = []
+    for item in order_by:
+        if isinstance(item, str):
+            item = [item[1:], 'desc'] if item.startswith('-') else [item, 'asc']
+        normalized.append([item[0], item[1].lower()])
+    return normalized
+
+
+def sort_documents(documents, order_by):
+    """Sắp xếp documents theo order_by đã chuẩn hóa, document thiếu field xếp cuối"""
+    for field, direction in reversed(order_by):
+        present = [doc for doc in documents if doc.get(field) is not None]
+        missing = [doc for doc in documents if doc.get(field) is None]
+        try:
+            present.sort(key=lambda doc: doc[field], reverse=direction == 'desc')
+        except TypeError:
+            present.sort(key=lambda doc: str(doc[field]), reverse=direction == 'desc')
+        documents = present + missing
+    return documents
+
+
+def project_document(doc, select):
+    """Chỉ giữ lại các field trong select (luôn giữ 'id')"""
+    if not select:
+        return doc
+    return {field: doc[field] for field in ['id', *select] if field in doc}
+
+
+def read_document_ids(path):
+    """Đọc danh sách document ID từ file: mỗi dòng một ID, JSON list, hoặc NDJSON có field 'id'"""
+    with open(os.path.expanduser(path), encoding='utf-8') as f:
+        content = f.read()
+    stripped = content.strip()
+    if stripped.startswith('['):
+        return [str(item.get('id') if isinstance(item, dict) else item) for item in json.loads(stripped)]
+    ids = []
+    for line in stripped.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            ids.append(str(json.loads(line)['id']))
+        else:
+            ids.append(line)
+    return ids
+
+
+def format_progress(done, total, width=30):
+    """Thanh tiến trình dạng [#####.....] 50% (done/total)"""
+    ratio = done / total if total else 1
+    filled = int(width * ratio)
+    return f"[{'#' * filled}{'.' * (width - filled)}] {ratio * 100:5.1f}% ({done:,}/{total:,})"
+
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+ZERO_WIDTH = {'\u200b', '\u200c', '\u200d', '\ufe0e', '\ufe0f'}
+RENDER_FLUSH_DELAY = 0.03  # Gom các lệnh print liên tiếp thành một lần ghi
+
+
+@functools.lru_cache(maxsize=4096)
+def char_width(ch):
+    """Số cột terminal mà một ký tự chiếm (emoji / CJK = 2, ký tự kết hợp = 0)"""
+    if ch in ZERO_WIDTH or unicodedata.combining(ch):
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+
+
+def display_width(text):
+    return sum(char_width(ch) for ch in text)
+
+
+@functools.lru_cache(maxsize=4096)
+def wrap_rows(line, cols):
+    """Chia một dòng thành các hàng vật lý rộng tối đa `cols` cột"""
+    rows, current, width = [], [], 0
+    for ch in line:
+        w = char_width(ch)
+        if width + w > cols and current:
+            rows.append(''.join(current))
+            current, width = [], 0
+        current.append(ch)
+        width += w
+    rows.append(''.join(current))
+    return tuple(rows)
+
+
+class TerminalRenderer:
+    """Lớp vẽ terminal dùng frame buffer, chỉ ghi lại các hàng thay đổi
+
+    Khi được install() làm sys.stdout, mọi print() được ghi vào frame trong bộ nhớ thay vì
+    terminal. Frame được vẽ bằng một lần write duy nhất khi flush (hoặc sau RENDER_FLUSH_DELAY
+    giây), so với nội dung đang hiển thị và chỉ các hàng khác nhau được ghi lại bằng ANSI cursor
+    movement. clear() bắt đầu frame mới mà không cần gọi lệnh 'clear' của hệ thống.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lines = ['']  # Frame đang dựng (dòng logic, dòng cuối là dòng con trỏ đang đứng)
+        self.screen = ['']  # Các hàng vật lý đang hiển thị trên terminal
+        self.frames = 0
+        self.bytes_written = 0
+        self._lock = threading.RLock()
+        self._pending = threading.Event()
+        self._installed = False
+        self._cols = None
+
+    # Giao diện file để thay thế sys.stdout
+    @property
+    def encoding(self):
+        return getattr(self.stream, 'encoding', 'utf-8')
+
+    def isatty(self):
+        return self.stream.isatty()
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def write(self, text):
+        with self._lock:
+            self._append(self.lines, text)
+        self._pending.set()
+        return len(text)
+
+    @staticmethod
+    def _append(lines, text):
+        text = ANSI_ESCAPE.sub('', text).expandtabs()
+        for i, part in enumerate(text.split('\n')):
+            if i:
+                lines.append('')
+            if '\r' in part:
+                lines[-1] = part.rsplit('\r', 1)[1]  # '\r' đưa con trỏ về đầu dòng, vẽ lại cả dòng
             else:
-                print(f"❌ Lỗi HTTP: {response.status_code}")
-                return None
-        except Exception as e:
-            print(f"❌ Lỗi: {e}")
-            return None
+                lines[-1] += part
+
+    def install(self):
+        """Thay sys.stdout bằng renderer, các print() sau đó đi qua frame buffer"""
+        if not self._installed:
+            self._installed = True
+            sys.stdout = self
+            threading.Thread(target=self._flush_loop, name='renderer', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self._pending.wait()
+            time.sleep(RENDER_FLUSH_DELAY)
+            self.flush()
+
+    def clear(self):
+        """Bắt đầu frame mới thay cho lệnh clear màn hình"""
+        with self._lock:
+            self.lines = ['']
+
+    def draw(self, lines):
+        """Vẽ cả frame (danh sách dòng) trong một lần ghi"""
+        with self._lock:
+            self.lines = ['']
+            self._append(self.lines, '\n'.join(lines) + '\n')
+            self.flush()
+
+    def replace_line(self, old, new):
+        """Thay một dòng đã vẽ (ví dụ trạng thái kết nối) mà không đụng tới dòng đang nhập
+
+        Dùng save/restore cursor nên gọi được từ thread khác trong lúc đang chờ input().
+        Trả về False nếu không tìm thấy dòng hoặc không vẽ lại tại chỗ được.
+        """
+        with self._lock:
+            if old not in self.lines[:-1]:
+                return False
+            index = len(self.lines) - 2 - self.lines[:-1][::-1].index(old)
+            self.lines[index] = new
+            if self.screen is None or self._cols is None:
+                return True
+            if len(wrap_rows(old, self._cols)) != 1 or len(wrap_rows(new, self._cols)) != 1:
+                self.screen = None  # Số hàng thay đổi, lần vẽ sau vẽ lại toàn bộ
+                return True
+            row = sum(len(wrap_rows(line, self._cols)) for line in self.lines[:index])
+            up = len(self.screen) - 1 - row
+            if row >= len(self.screen) or up >= shutil.get_terminal_size().lines:
+                return True
+            output = f"\x1b7\x1b[{up}A\r{new}\x1b[K\x1b8" if up else f"\x1b7\r{new}\x1b[K\x1b8"
+            self.stream.write(output)
+            self.stream.flush()
+            self.screen[row] = new
+            return True
+
+    def invalidate(self):
+        """Nội dung terminal không còn khớp với bộ nhớ: lần vẽ sau sẽ vẽ lại toàn bộ"""
+        with self._lock:
+            self.screen = None
+
+    def _layout(self):
+        """Các hàng vật lý của frame hiện tại theo kích thước terminal"""
+        size = shutil.get_terminal_size()
+        cols, height = max(10, size.columns - 1), max(2, size.lines)
+        if cols != self._cols:
+            self.screen, self._cols = None, cols  # Đổi độ rộng: cách xuống dòng thay đổi, vẽ lại toàn bộ
+        return [row for line in self.lines for row in wrap_rows(line, cols)], height
+
+    def _commit(self, rows, height):
+        """Ghi nhận nội dung đang hiển thị, bỏ phần đầu đã cuộn khỏi màn hình từ lâu"""
+        self.screen = rows
+        if len(self.lines) > 4 * height:
+            drop = len(self.lines) - 2 * height
+            self.screen = rows[sum(len(wrap_rows(line, self._cols)) for line in self.lines[:drop]):]
+            self.lines = self.lines[drop:]
+
+    def flush(self):
+        if not self._installed:
+            return  # Chế độ dòng lệnh: không vẽ gì lên terminal
+        with self._lock:
+            self._pending.clear()
+            rows, height = self._layout()
+            output = self._render(self.screen, rows, height)
+            if output:
+                self.stream.write(output)
+                self.stream.flush()
+                self.frames += 1
+                self.bytes_written += len(output.encode('utf-8', 'replace'))
+            self._commit(rows, height)
+
+    @staticmethod
+    def _render(old, new, height):
+        """Chuỗi escape biến nội dung `old` trên terminal thành `new`"""
+        if old is None:
+            return "\x1b[H\x1b[2J" + "\r\n".join(new)
+        first = 0
+        while first < len(old) and first < len(new) and old[first] == new[first]:
+            first += 1
+        if first == len(old) == len(new):
+            return ''
+
+        cursor = len(old) - 1  # Con trỏ luôn ở cuối hàng cuối cùng
+        if cursor - first >= height:
+            return "\x1b[H\x1b[2J" + "\r\n".join(new)  # Hàng cần sửa đã cuộn khỏi màn hình
+
+        out = []
+        bottom = cursor  # Hàng thấp nhất đang tồn tại trên terminal
+
+        def move_to(row):
+            nonlocal cursor, bottom
+            if row < cursor:
+                out.append(f"\x1b[{cursor - row}A")
+            elif row > cursor:
+                existing = min(row, bottom) - cursor
+                if existing > 0:
+                    out.append(f"\x1b[{existing}B")
+                if row > bottom:
+                    out.append("\n" * (row - bottom))
+                    bottom = row
+            out.append("\r")
+            cursor = row
+
+        for row in range(first, len(new)):
+            if row < len(old) and old[row] == new[row]:
+                continue
+            move_to(row)
+            out.append(f"{new[row]}\x1b[K")
+        if not out or cursor != len(new) - 1:
+            move_to(len(new) - 1)  # Đưa con trỏ về cuối hàng cuối cùng
+            out.append(f"{new[-1]}\x1b[K")
+        if len(old) > len(new):
+            out.append("\x1b[J")  # Xóa các hàng thừa của frame cũ
+        return ''.join(out)
+
+    def input(self, prompt=''):
+        """Thay cho input(): vẽ frame kèm prompt, đọc một dòng và ghi nhận phần terminal đã echo"""
+        with self._lock:
+            self._append(self.lines, prompt)
+            self.flush()
+        return self.read_line()
+
+    def read_line(self):
+        """Đọc một dòng từ stdin (có thể gọi từ thread khác), cập nhật phần echo vào bộ nhớ"""
+        line = sys.stdin.readline()
+        if not line:
+            raise EOFError
+        with self._lock:
+            in_sync = self.screen is not None
+            self._append(self.lines, line)
+            if in_sync:
+                # Terminal đã tự hiển thị phần người dùng gõ, không cần vẽ lại
+                self._commit(*self._layout())
+        return line.rstrip('\n')
+
+
+screen = TerminalRenderer()
 
 
 def clear_screen():
     """Xóa màn hình"""
-    os.system('clear' if os.name == 'posix' else 'cls')
+    screen.clear()
 
 
 def show_header():
@@ -172,139 +3743,603 @@ def show_header():
     print("-" * 60)
 
 
+class PositionBook:
+    """Sổ lệnh đang mở lưu theo cột (array) thay vì list dict, cập nhật tại chỗ theo ticket
+
+    Mỗi lệnh là một hàng trong các cột; xóa lệnh dùng swap-remove nên không phải dời mảng.
+    Các tổng (profit, exposure long/short, lệnh lãi/lỗ, theo symbol) được cộng trừ dần khi hàng
+    thay đổi nên đọc tổng là O(1); dòng hiển thị của từng lệnh được cache tới khi lệnh đó đổi.
+    """
+
+    __slots__ = ('tickets', 'symbol_ids', 'sides', 'volumes', 'prices', 'profits', 'comments',
+                 '_index', '_symbols', '_symbol_ids', '_rows', '_order',
+                 'total_profit', 'long_volume', 'short_volume', 'winners', 'losers',
+                 'symbol_counts', 'symbol_net_volume', 'symbol_profit', 'symbol_exposure')
+
+    def __init__(self):
+        self._symbols = []  # Symbol được intern thành số để cột symbol gọn
+        self._symbol_ids = {}
+        self.clear()
+
+    def clear(self):
+        self.tickets = []
+        self.symbol_ids = array('I')
+        self.sides = array('b')  # 0 = BUY, 1 = SELL (theo field 'type' của MT5)
+        self.volumes = array('d')
+        self.prices = array('d')
+        self.profits = array('d')
+        self.comments = []
+        self._index = {}
+        self._rows = []
+        self._order = None
+        self.total_profit = 0.0
+        self.long_volume = 0.0
+        self.short_volume = 0.0
+        self.winners = 0
+        self.losers = 0
+        self.symbol_counts = {}
+        self.symbol_net_volume = {}
+        self.symbol_profit = {}
+        self.symbol_exposure = {}  # Giá trị danh nghĩa ròng (khối lượng x giá mở, SELL mang dấu âm)
+
+    def _symbol_id(self, symbol):
+        symbol_id = self._symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self._symbol_ids[symbol] = len(self._symbols)
+            self._symbols.append(symbol)
+        return symbol_id
+
+    def _account(self, row, sign):
+        """Cộng (sign=1) hoặc trừ (sign=-1) một hàng vào các tổng"""
+        volume, profit = self.volumes[row], self.profits[row]
+        symbol = self._symbols[self.symbol_ids[row]]
+        self.total_profit += sign * profit
+        if self.sides[row] == 0:
+            self.long_volume += sign * volume
+            net = volume
+        else:
+            self.short_volume += sign * volume
+            net = -volume
+        if profit > 0:
+            self.winners += sign
+        elif profit < 0:
+            self.losers += sign
+        count = self.symbol_counts.get(symbol, 0) + sign
+        if count:
+            self.symbol_counts[symbol] = count
+            self.symbol_net_volume[symbol] = self.symbol_net_volume.get(symbol, 0.0) + sign * net
+            self.symbol_profit[symbol] = self.symbol_profit.get(symbol, 0.0) + sign * profit
+            self.symbol_exposure[symbol] = (self.symbol_exposure.get(symbol, 0.0)
+                                            + sign * net * self.prices[row])
+        else:
+            self.symbol_counts.pop(symbol, None)
+            self.symbol_net_volume.pop(symbol, None)
+            self.symbol_profit.pop(symbol, None)
+            self.symbol_exposure.pop(symbol, None)
+
+    def upsert(self, pos):
+        """Thêm hoặc cập nhật một lệnh từ dict của server (chỉ các field có trong dict)"""
+        ticket = pos.get('ticket')
+        row = self._index.get(ticket)
+        if row is None:
+            row = self._index[ticket] = len(self.tickets)
+            self.tickets.append(ticket)
+            self.symbol_ids.append(self._symbol_id(pos.get('symbol', 'N/A')))
+            self.sides.append(0 if pos.get('type', 0) == 0 else 1)
+            self.volumes.append(float(pos.get('volume') or 0))
+            self.prices.append(float(pos.get('price_open') or 0))
+            self.profits.append(float(pos.get('profit') or 0))
+            self.comments.append(pos.get('comment', 'N/A'))
+            self._rows.append(None)
+            self._order = None
+            self._account(row, 1)
+            return
+        self._account(row, -1)
+        if 'symbol' in pos:
+            self.symbol_ids[row] = self._symbol_id(pos['symbol'])
+        if 'type' in pos:
+            self.sides[row] = 0 if pos['type'] == 0 else 1
+        if 'volume' in pos:
+            self.volumes[row] = float(pos['volume'] or 0)
+        if 'price_open' in pos:
+            self.prices[row] = float(pos['price_open'] or 0)
+        if 'profit' in pos:
+            self.profits[row] = float(pos['profit'] or 0)
+        if 'comment' in pos:
+            self.comments[row] = pos['comment']
+        self._rows[row] = None
+        self._account(row, 1)
+
+    def remove(self, ticket):
+        """Xóa lệnh đã đóng: chuyển hàng cuối vào chỗ trống. Trả về False nếu không có"""
+        row = self._index.pop(ticket, None)
+        if row is None:
+            return False
+        self._account(row, -1)
+        last = len(self.tickets) - 1
+        if row != last:
+            for column in (self.tickets, self.symbol_ids, self.sides, self.volumes,
+                           self.prices, self.profits, self.comments, self._rows):
+                column[row] = column[last]
+            self._index[self.tickets[row]] = row
+        for column in (self.tickets, self.symbol_ids, self.sides, self.volumes,
+                       self.prices, self.profits, self.comments, self._rows):
+            column.pop()
+        self._order = None
+        return True
+
+    def apply(self, delta):
+        """Áp dụng delta, trả về tập ticket đã thay đổi (mở mới, cập nhật hoặc đóng)"""
+        changed = set()
+        if delta.get('reset'):
+            changed.update(self.tickets)
+            self.clear()
+        for pos in delta.get('upsert', []):
+            self.upsert(pos)
+            changed.add(pos.get('ticket'))
+        for ticket in delta.get('closed', []):
+            if self.remove(ticket):
+                changed.add(ticket)
+        return changed
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def __contains__(self, ticket):
+        return ticket in self._index
+
+    def position(self, ticket):
+        """Lệnh dưới dạng dict như server trả về, None nếu không có"""
+        row = self._index.get(ticket)
+        if row is None:
+            return None
+        return {'ticket': ticket, 'symbol': self._symbols[self.symbol_ids[row]],
+                'type': self.sides[row], 'volume': self.volumes[row],
+                'price_open': self.prices[row], 'profit': self.profits[row],
+                'comment': self.comments[row]}
+
+    def sorted_rows(self):
+        """Chỉ số hàng theo thứ tự ticket, chỉ sắp xếp lại khi có lệnh mở/đóng"""
+        if self._order is None:
+            self._order = sorted(range(len(self.tickets)), key=lambda row: str(self.tickets[row]))
+        return self._order
+
+    def sorted_positions(self):
+        return [self.position(self.tickets[row]) for row in self.sorted_rows()]
+
+    def formatted_rows(self):
+        """Các dòng bảng lệnh, chỉ định dạng lại những lệnh đã thay đổi"""
+        rows = self._rows
+        for row in self.sorted_rows():
+            if rows[row] is None:
+                rows[row] = format_position_row(self.position(self.tickets[row]))
+        return [rows[row] for row in self.sorted_rows()]
+
+    def net_volume(self):
+        return self.long_volume - self.short_volume
+
+    def largest(self, count=5, losers=True):
+        """Các lệnh lỗ nhiều nhất (hoặc lãi nhiều nhất) dạng (ticket, profit)"""
+        pick = heapq.nsmallest if losers else heapq.nlargest
+        rows = pick(count, range(len(self.tickets)), key=self.profits.__getitem__)
+        return [(self.tickets[row], self.profits[row]) for row in rows
+                if (self.profits[row] < 0 if losers else self.profits[row] > 0)]
+
+    def summary(self):
+        """Các tổng của sổ lệnh, cùng dạng với phần 'summary' của server"""
+        return {
+            'total_positions': len(self.tickets),
+            'total_profit': self.total_profit,
+            'profitable_positions': self.winners,
+            'losing_positions': self.losers,
+            'long_volume': self.long_volume,
+            'short_volume': self.short_volume,
+            'symbols': dict(self.symbol_counts),
+        }
+
+
+class RollingWindow:
+    """Chuỗi (thời điểm, giá trị) trong `window` giây gần nhất với max và hệ số góc cập nhật dần
+
+    Max dùng deque đơn điệu, hệ số góc (hồi quy tuyến tính) dùng các tổng cộng/trừ khi điểm
+    vào/ra cửa sổ, nên mỗi lần thêm điểm là O(1) khấu hao.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.points = deque()
+        self._peaks = deque()
+        self._origin = None
+        self._sums = [0.0, 0.0, 0.0, 0.0]  # Σt, Σt², Σy, Σty
+
+    def _accumulate(self, t, y, sign):
+        t -= self._origin
+        sums = self._sums
+        sums[0] += sign * t
+        sums[1] += sign * t * t
+        sums[2] += sign * y
+        sums[3] += sign * t * y
+
+    def add(self, t, y):
+        if self._origin is None:
+            self._origin = t
+        self.points.append((t, y))
+        self._accumulate(t, y, 1)
+        while self._peaks and self._peaks[-1][1] <= y:
+            self._peaks.pop()
+        self._peaks.append((t, y))
+        while self.points[0][0] < t - self.window:
+            old_t, old_y = self.points.popleft()
+            self._accumulate(old_t, old_y, -1)
+            if self._peaks[0][0] <= old_t:
+                self._peaks.popleft()
+
+    def __len__(self):
+        return len(self.points)
+
+    def last(self):
+        return self.points[-1][1] if self.points else None
+
+    def max(self):
+        return self._peaks[0][1] if self._peaks else None
+
+    def slope(self):
+        """Hệ số góc theo giây, None nếu chưa đủ điểm"""
+        n = len(self.points)
+        if n < 2:
+            return None
+        sum_t, sum_tt, sum_y, sum_ty = self._sums
+        denominator = n * sum_tt - sum_t * sum_t
+        if abs(denominator) < 1e-9:
+            return None
+        return (n * sum_ty - sum_t * sum_y) / denominator
+
+
+class AccountAnalytics:
+    """Phân tích cục bộ trên các delta tài khoản MT5, cập nhật dần theo từng lần poll
+
+    Giữ trạng thái tài khoản (các phần ACCOUNT_SECTIONS) và PositionBook, cộng thêm drawdown
+    equity (trong cửa sổ ANALYTICS_WINDOW và toàn phiên) và xu hướng margin level. Dùng được
+    độc lập: apply(event) cho từng delta rồi đọc snapshot().
+    """
+
+    def __init__(self, window=ANALYTICS_WINDOW):
+        self.state = {}
+        self.book = PositionBook()
+        self.equity = RollingWindow(window)
+        self.margin_level = RollingWindow(window)
+        self.peak_equity = None
+        self.max_drawdown = 0.0
+        self.updates = 0
+
+    def apply(self, event, now=None):
+        """Áp dụng một event của iter_mt5_account_events"""
+        state = self.state
+        if event['type'] == 'error':
+            state['error'] = event['error']
+            return
+        state.pop('error', None)
+        state['mode'] = event.get('mode')
+        state['cached_at'] = event.get('cached_at')
+        if event.get('reset'):
+            for section in ACCOUNT_SECTIONS:
+                state.pop(section, None)
+        for section in ACCOUNT_SECTIONS:
+            if section in event:
+                state.setdefault(section, {}).update(event[section])
+        if event.get('timestamp'):
+            state['timestamp'] = event['timestamp']
+        self.book.apply(event)
+        self.updates += 1
+
+        account = state.get('account')
+        if not account or event.get('mode') == 'offline':
+            return
+        now = time.monotonic() if now is None else now
+        equity = account.get('equity')
+        if isinstance(equity, (int, float)):
+            self.equity.add(now, equity)
+            if self.peak_equity is None or equity > self.peak_equity:
+                self.peak_equity = equity
+            if self.peak_equity > 0:
+                self.max_drawdown = max(self.max_drawdown, (self.peak_equity - equity) / self.peak_equity)
+        margin_level = account.get('margin_level')
+        if isinstance(margin_level, (int, float)) and margin_level > 0:
+            self.margin_level.add(now, margin_level)
+
+    def to_payload(self):
+        """Trạng thái hiện tại theo dạng payload /api/mt5-account-info"""
+        payload = {section: self.state[section] for section in ACCOUNT_SECTIONS if section in self.state}
+        payload['positions'] = self.book.sorted_positions()
+        payload['timestamp'] = self.state.get('timestamp')
+        return payload
+
+    def drawdown(self):
+        """Drawdown hiện tại so với đỉnh equity trong cửa sổ (tỷ lệ 0-1)"""
+        peak, equity = self.equity.max(), self.equity.last()
+        if not peak or equity is None or peak <= 0:
+            return 0.0
+        return max(0.0, (peak - equity) / peak)
+
+    def symbols(self):
+        """Thống kê theo symbol: số lệnh, khối lượng ròng, giá trị danh nghĩa ròng, profit"""
+        book = self.book
+        return {symbol: {'positions': count,
+                         'net_volume': book.symbol_net_volume.get(symbol, 0.0),
+                         'exposure': book.symbol_exposure.get(symbol, 0.0),
+                         'profit': book.symbol_profit.get(symbol, 0.0)}
+                for symbol, count in book.symbol_counts.items()}
+
+    def snapshot(self, top=ANALYTICS_TOP_LOSERS):
+        """Toàn bộ chỉ số dưới dạng dict"""
+        slope = self.margin_level.slope()
+        return {
+            'positions': len(self.book),
+            'total_profit': self.book.total_profit,
+            'long_volume': self.book.long_volume,
+            'short_volume': self.book.short_volume,
+            'symbols': self.symbols(),
+            'equity': self.equity.last(),
+            'peak_equity': self.equity.max(),
+            'drawdown': self.drawdown(),
+            'max_drawdown': self.max_drawdown,
+            'margin_level': self.margin_level.last(),
+            'margin_level_trend': slope * 60 if slope is not None else None,  # Điểm % mỗi phút
+            'largest_losers': self.book.largest(top),
+            'window': self.equity.window,
+            'samples': len(self.equity),
+        }
+
+
+def build_analytics_panel(analytics):
+    """Các dòng panel phân tích rủi ro cho màn hình realtime"""
+    stats = analytics.snapshot()
+    if not stats['samples'] and not stats['positions']:
+        return []
+    lines = ["", f"🧮 PHÂN TÍCH RỦI RO ({format_duration(stats['window'])} gần nhất):"]
+    if stats['samples']:
+        lines.append(f"  📉 Drawdown: {stats['drawdown'] * 100:.2f}% "
+                     f"(đỉnh ${stats['peak_equity']:,.2f}) | Lớn nhất phiên: {stats['max_drawdown'] * 100:.2f}%")
+    trend = stats['margin_level_trend']
+    if stats['margin_level'] is not None:
+        arrow = "→" if trend is None or abs(trend) < 0.01 else ("↗" if trend > 0 else "↘")
+        trend_text = f" ({trend:+.2f}%/phút)" if trend is not None else ""
+        lines.append(f"  📊 Margin level: {stats['margin_level']:,.2f}% {arrow}{trend_text}")
+    symbols = sorted(stats['symbols'].items(), key=lambda item: -abs(item[1]['exposure']))
+    if symbols:
+        lines.append(f"  {'Symbol':<10} {'Lệnh':>5} {'KL ròng':>9} {'Danh nghĩa':>14} {'Profit':>12}")
+        for symbol, row in symbols[:ANALYTICS_TOP_SYMBOLS]:
+            lines.append(f"  {symbol:<10} {row['positions']:>5} {row['net_volume']:>+9.2f} "
+                         f"{row['exposure']:>+14,.2f} {row['profit']:>+12,.2f}")
+    if stats['largest_losers']:
+        lines.append("  🔻 Lỗ nhiều nhất: " + ", ".join(
+            f"#{ticket} ${profit:,.2f}" for ticket, profit in stats['largest_losers']))
+    return lines
+
+
+def format_position_row(pos):
+    """Một dòng trong bảng lệnh đang mở"""
+    ticket = pos.get('ticket', 'N/A')
+    symbol = pos.get('symbol', 'N/A')
+    pos_type = 'BUY' if pos.get('type', 0) == 0 else 'SELL'
+    volume = pos.get('volume', 0)
+    price = pos.get('price_open', 0)
+    profit = pos.get('profit', 0)
+    comment = pos.get('comment', 'N/A')
+
+    # Thêm màu sắc cho profit
+    profit_str = f"${profit:<11.2f}"
+    if profit > 0:
+        profit_str = f"📈 {profit_str}"
+    elif profit < 0:
+        profit_str = f"📉 {profit_str}"
+
+    return f"{ticket:<10} {symbol:<10} {pos_type:<6} {volume:<8.2f} {price:<10.5f} {profit_str} {comment:<15}"
+
+
+POLL_MODE_LABELS = {
+    'normal': 'bình thường',
+    'fast': 'nhanh - thị trường biến động',
+    'idle': 'chậm - không có thay đổi',
+    'closed': 'thị trường đóng cửa',
+    'backoff': 'mất kết nối - đang chờ thử lại',
+    'fixed': 'cố định',
+}
+
+
+def format_poll_stats(stats):
+    """Dòng trạng thái scheduler: chu kỳ hiện tại và độ trễ"""
+    line = f"⏱️ Chu kỳ: {stats['interval']:.0f}s ({POLL_MODE_LABELS.get(stats['mode'], stats['mode'])})"
+    if stats.get('latency_avg') is not None:
+        line += (f" | Độ trễ TB {stats['latency_avg'] * 1000:.0f}ms"
+                 f" p95 {stats['latency_p95'] * 1000:.0f}ms")
+    return line
+
+
+def build_mt5_frame(analytics, update_count, poll_stats=None):
+    """Dựng toàn bộ màn hình realtime MT5 thành danh sách dòng"""
+    state, book = analytics.state, analytics.book
+    lines = [
+        "=" * 60,
+        "🤖 QUẢN LÝ MT5 VÀ FIREBASE",
+        "=" * 60,
+        f"📡 Server: {SERVER_URL}",
+        f"⏰ Thời gian: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        "-" * 60,
+        "💰 THÔNG TIN TÀI KHOẢN MT5 (REALTIME)",
+        "=" * 60,
+    ]
+
+    # Hiển thị trạng thái cập nhật
+    loading_chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
+    loading_char = loading_chars[update_count % len(loading_chars)]
+    lines.append(f"{loading_char} Đang cập nhật... (Lần thứ {update_count})")
+    if state.get('mode') == 'offline' and state.get('cached_at'):
+        lines.append(format_staleness(state['cached_at']))
+
+    if 'account' not in state:
+        if state.get('error'):
+            lines += ["❌ Không thể lấy thông tin tài khoản MT5",
+                      "Có thể do:",
+                      "  - Bot chưa khởi động",
+                      "  - MT5 chưa kết nối",
+                      "  - Server không hỗ trợ API này",
+                      "",
+                      "🔄 Đang thử lại..."]
+        return lines
+
+    # Hiển thị thông tin tài khoản
+    account = state['account']
+    lines += [
+        "",
+        "📊 THÔNG TIN TÀI KHOẢN:",
+        f"  🆔 Login: {account.get('login', 'N/A')}",
+        f"  🏦 Server: {account.get('server', 'N/A')}",
+        f"  💰 Balance: ${account.get('balance', 0):,.2f}",
+        f"  💵 Equity: ${account.get('equity', 0):,.2f}",
+        f"  📈 Profit: ${account.get('profit', 0):,.2f}",
+        f"  💳 Margin: ${account.get('margin', 0):,.2f}",
+        f"  🔒 Free Margin: ${account.get('free_margin', 0):,.2f}",
+        f"  📊 Margin Level: {account.get('margin_level', 0):,.2f}%",
+        f"  🎯 Currency: {account.get('currency', 'N/A')}",
+    ]
+
+    # Hiển thị các lệnh đang mở
+    lines += ["", f"📋 LỆNH ĐANG MỞ ({len(book)} lệnh):"]
+    if len(book):
+        lines.append(
+            f"{'Ticket':<10} {'Symbol':<10} {'Type':<6} {'Volume':<8} {'Price':<10} {'Profit':<12} {'Comment':<15}")
+        lines.append("-" * 80)
+        lines += book.formatted_rows()
+    else:
+        lines.append("  Không có lệnh nào đang mở")
+
+    # Hiển thị thống kê tổng quan (server không gửi summary thì tính từ sổ lệnh)
+    summary = state.get('summary') or (book.summary() if len(book) else None)
+    if summary:
+        lines += [
+            "",
+            "📈 THỐNG KÊ TỔNG QUAN:",
+            f"  📊 Tổng lệnh mở: {summary.get('total_positions', 0)}",
+            f"  💰 Tổng profit: ${summary.get('total_profit', 0):,.2f}",
+            f"  📈 Lệnh có lãi: {summary.get('profitable_positions', 0)}",
+            f"  📉 Lệnh thua lỗ: {summary.get('losing_positions', 0)}",
+        ]
+    if len(book):
+        lines.append(f"  ⚖️ Khối lượng: BUY {book.long_volume:,.2f} | SELL {book.short_volume:,.2f} | "
+                     f"Ròng {book.net_volume():+,.2f}")
+    lines += build_analytics_panel(analytics)
+
+    # Hiển thị thống kê trong ngày
+    if 'today_summary' in state:
+        today_summary = state['today_summary']
+        period = today_summary.get('period', 'Hôm nay')
+        lines += [
+            "",
+            f"📅 THỐNG KÊ TRONG NGÀY ({period}):",
+            f"  📊 Lệnh mở: {today_summary.get('total_positions', 0)}",
+            f"  💰 Profit: ${today_summary.get('total_profit', 0):,.2f}",
+            f"  📈 Lệnh có lãi: {today_summary.get('profitable_positions', 0)}",
+            f"  📉 Lệnh thua lỗ: {today_summary.get('losing_positions', 0)}",
+        ]
+
+    # Hiển thị thời gian cập nhật
+    if state.get('timestamp'):
+        lines += ["", f"⏰ Cập nhật lúc: {state['timestamp']}"]
+
+    lines.append("")
+    lines.append("=" * 60)
+    if state.get('error'):
+        lines.append(f"❌ Lỗi khi cập nhật: {state['error']} - 🔄 Đang thử lại...")
+    if state.get('mode') == 'stream':
+        lines.append(f"🔄 Cập nhật lần thứ {update_count} - Streaming - Nhấn Enter để dừng")
+    else:
+        lines.append(f"🔄 Cập nhật lần thứ {update_count} - Polling thích ứng - Nhấn Enter để dừng")
+        if poll_stats:
+            lines.append(format_poll_stats(poll_stats))
+    return lines
+
+
 def show_mt5_account_info(config_manager):
     """Hiển thị thông tin tài khoản MT5 với cập nhật realtime"""
     # Biến để kiểm soát vòng lặp
-    stop_updating = False
+    stop_event = threading.Event()
     update_count = 0
 
     def check_for_enter():
         """Thread để kiểm tra phím Enter"""
-        nonlocal stop_updating
-        input("Nhấn Enter để dừng cập nhật...")
-        stop_updating = True
+        screen.read_line()
+        stop_event.set()
 
     # Bắt đầu thread kiểm tra phím Enter
     enter_thread = threading.Thread(target=check_for_enter, daemon=True)
     enter_thread.start()
 
-    print("🔄 Bắt đầu cập nhật realtime mỗi 30 giây...")
+    print("🔄 Bắt đầu cập nhật realtime...")
     time.sleep(0.5)
 
-    while not stop_updating:
-        try:
+    # Trạng thái cục bộ: các phần account/summary, sổ lệnh theo ticket và các chỉ số phân tích
+    scheduler = AdaptivePollScheduler()
+    history_lines, history_at = [], 0
+
+    try:
+        for analytics in config_manager.iter_mt5_analytics(stop_event, scheduler):
             update_count += 1
+            if time.monotonic() - history_at > 10:
+                # Lịch sử trên máy chỉ cần đọc lại vài giây một lần
+                history_lines, history_at = build_history_lines(config_manager.history), time.monotonic()
+            screen.draw(build_mt5_frame(analytics, update_count, scheduler.stats()) + history_lines)
+    except KeyboardInterrupt:
+        stop_event.set()
 
-            # Xóa màn hình và hiển thị header
-            clear_screen()
-            print("=" * 60)
-            print("🤖 QUẢN LÝ MT5 VÀ FIREBASE")
-            print("=" * 60)
-            print(f"📡 Server: {SERVER_URL}")
-            print(f"⏰ Thời gian: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            print("-" * 60)
-            print("💰 THÔNG TIN TÀI KHOẢN MT5 (REALTIME)")
-            print("=" * 60)
-
-            # Hiển thị trạng thái cập nhật
-            loading_chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
-            loading_char = loading_chars[update_count % len(loading_chars)]
-            print(f"{loading_char} Đang cập nhật... (Lần thứ {update_count})")
-
-            # Lấy thông tin tài khoản MT5
-            account_info = config_manager.get_mt5_account_info()
-            if not account_info:
-                print("❌ Không thể lấy thông tin tài khoản MT5")
-                print("Có thể do:")
-                print("  - Bot chưa khởi động")
-                print("  - MT5 chưa kết nối")
-                print("  - Server không hỗ trợ API này")
-                print("\n🔄 Đang thử lại...")
-                time.sleep(3)
-                continue
+    print("\n✅ Đã dừng cập nhật realtime")
+    screen.input("Nhấn Enter để quay lại menu chính...")
 
-            # Hiển thị thông tin tài khoản
-            if 'account' in account_info:
-                account = account_info['account']
-                print("\n📊 THÔNG TIN TÀI KHOẢN:")
-                print(f"  🆔 Login: {account.get('login', 'N/A')}")
-                print(f"  🏦 Server: {account.get('server', 'N/A')}")
-                print(f"  💰 Balance: ${account.get('balance', 0):,.2f}")
-                print(f"  💵 Equity: ${account.get('equity', 0):,.2f}")
-                print(f"  📈 Profit: ${account.get('profit', 0):,.2f}")
-                print(f"  💳 Margin: ${account.get('margin', 0):,.2f}")
-                print(f"  🔒 Free Margin: ${account.get('free_margin', 0):,.2f}")
-                print(f"  📊 Margin Level: {account.get('margin_level', 0):,.2f}%")
-                print(f"  🎯 Currency: {account.get('currency', 'N/A')}")
-
-            # Hiển thị các lệnh đang mở
-            if 'positions' in account_info:
-                positions = account_info['positions']
-                print(f"\n📋 LỆNH ĐANG MỞ ({len(positions)} lệnh):")
-                if positions:
-                    print(
-                        f"{'Ticket':<10} {'Symbol':<10} {'Type':<6} {'Volume':<8} {'Price':<10} {'Profit':<12} {'Comment':<15}")
-                    print("-" * 80)
-                    for pos in positions:
-                        ticket = pos.get('ticket', 'N/A')
-                        symbol = pos.get('symbol', 'N/A')
-                        pos_type = 'BUY' if pos.get('type', 0) == 0 else 'SELL'
-                        volume = pos.get('volume', 0)
-                        price = pos.get('price_open', 0)
-                        profit = pos.get('profit', 0)
-                        comment = pos.get('comment', 'N/A')
-
-                        # Thêm màu sắc cho profit
-                        profit_str = f"${profit:<11.2f}"
-                        if profit > 0:
-                            profit_str = f"📈 {profit_str}"
-                        elif profit < 0:
-                            profit_str = f"📉 {profit_str}"
-
-                        print(
-                            f"{ticket:<10} {symbol:<10} {pos_type:<6} {volume:<8.2f} {price:<10.5f} {profit_str} {comment:<15}")
-                else:
-                    print("  Không có lệnh nào đang mở")
-
-            # Hiển thị thống kê tổng quan
-            if 'summary' in account_info:
-                summary = account_info['summary']
-                print(f"\n📈 THỐNG KÊ TỔNG QUAN:")
-                print(f"  📊 Tổng lệnh mở: {summary.get('total_positions', 0)}")
-                print(f"  💰 Tổng profit: ${summary.get('total_profit', 0):,.2f}")
-                print(f"  📈 Lệnh có lãi: {summary.get('profitable_positions', 0)}")
-                print(f"  📉 Lệnh thua lỗ: {summary.get('losing_positions', 0)}")
-
-            # Hiển thị thống kê trong ngày
-            if 'today_summary' in account_info:
-                today_summary = account_info['today_summary']
-                period = today_summary.get('period', 'Hôm nay')
-                print(f"\n📅 THỐNG KÊ TRONG NGÀY ({period}):")
-                print(f"  📊 Lệnh mở: {today_summary.get('total_positions', 0)}")
-                print(f"  💰 Profit: ${today_summary.get('total_profit', 0):,.2f}")
-                print(f"  📈 Lệnh có lãi: {today_summary.get('profitable_positions', 0)}")
-                print(f"  📉 Lệnh thua lỗ: {today_summary.get('losing_positions', 0)}")
-
-            # Hiển thị thời gian cập nhật
-            if 'timestamp' in account_info:
-                timestamp = account_info['timestamp']
-                print(f"\n⏰ Cập nhật lúc: {timestamp}")
 
-            print("\n" + "=" * 60)
-            print(f"🔄 Cập nhật lần thứ {update_count} - Mỗi 30 giây - Nhấn Enter để dừng")
+def build_history_lines(history, period=86400, width=40):
+    """Sparkline equity và so sánh với đầu kỳ từ lịch sử trên máy"""
+    points = history.query('equity', time.time() - period)
+    if len(points) < 2:
+        return []
+    current, previous, change = history.compare('equity', period)
+    change_text = f" ({change:+.2f}% so với {format_duration(period)} trước)" if change is not None else ""
+    return ["", f"📈 Equity {format_duration(period)}: {sparkline([v for _, v in points], width)}{change_text}"]
 
-            # Chờ 30 giây trước khi cập nhật lại
-            time.sleep(30)
 
-        except KeyboardInterrupt:
-            break
-        except Exception as e:
-            print(f"❌ Lỗi khi cập nhật: {e}")
-            print("🔄 Đang thử lại...")
-            time.sleep(3)
+def show_account_history(config_manager):
+    """Xem lịch sử tài khoản MT5 đã lưu trên máy (không cần gọi server)"""
+    period_key = '2'
+    while True:
+        clear_screen()
+        show_header()
+        label, period = HISTORY_PERIODS[period_key]
+        print(f"📜 LỊCH SỬ TÀI KHOẢN - {label.upper()} GẦN NHẤT")
+        print("=" * 60)
 
-    print("\n✅ Đã dừng cập nhật realtime")
-    input("Nhấn Enter để quay lại menu chính...")
+        history = config_manager.history
+        start = time.time() - period
+        has_data = False
+        for metric in HISTORY_METRICS:
+            stats = history.summary(metric, start)
+            if not stats:
+                continue
+            has_data = True
+            points = history.query(metric, start, max_points=200)
+            digits = 0 if metric == 'positions' else 2
+            change = stats['change']
+            change_text = f"{change:+,.{digits}f}" if change is not None else "N/A"
+            print(f"\n{metric}: {stats['last']:,.{digits}f} (thay đổi {change_text})")
+            print(f"  {sparkline([v for _, v in points], 50)}")
+            print(f"  Thấp nhất {stats['min']:,.{digits}f} | Cao nhất {stats['max']:,.{digits}f}")
+        if not has_data:
+            print("ℹ️ Chưa có dữ liệu. Lịch sử được ghi khi xem thông tin tài khoản MT5.")
+
+        print("\n" + "-" * 60)
+        print("  " + " | ".join(f"{key}. {name}" for key, (name, _) in HISTORY_PERIODS.items()))
+        choice = screen.input("Chọn khoảng thời gian (Enter để quay lại): ").strip()
+        if choice not in HISTORY_PERIODS:
+            return
+        period_key = choice
 
 
 def show_discord_test(config_manager):
@@ -318,12 +4353,12 @@ def show_discord_test(config_manager):
     print("-" * 60)
 
     # Nhập tin nhắn
-    message = input("Nhập tin nhắn cần gửi (Enter để dùng tin nhắn mặc định): ").strip()
+    message = screen.input("Nhập tin nhắn cần gửi (Enter để dùng tin nhắn mặc định): ").strip()
     if not message:
         message = f"🧪 Test message từ client - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
 
     print(f"\n📝 Tin nhắn sẽ gửi: {message}")
-    confirm = input("Bạn có chắc chắn muốn gửi tin nhắn này? (y/n): ").strip().lower()
+    confirm = screen.input("Bạn có chắc chắn muốn gửi tin nhắn này? (y/n): ").strip().lower()
 
     if confirm == 'y':
         print("\n📢 Đang gửi tin nhắn Discord...")
@@ -346,7 +4381,7 @@ def show_discord_test(config_manager):
         print("❌ Đã hủy gửi tin nhắn")
 
     print("\n" + "=" * 60)
-    input("Nhấn Enter để quay lại menu chính...")
+    screen.input("Nhấn Enter để quay lại menu chính...")
 
 
 def show_firebase_management(config_manager):
@@ -365,6 +4400,11 @@ def show_firebase_management(config_manager):
         print("  - Xem documents trong collection")
         print("  - Xóa document cụ thể")
         print("  - Cập nhật document")
+        print("  - Xóa / cập nhật documents hàng loạt")
+        print("  - Tổng quan số documents của tất cả collections")
+        print("  - Theo dõi / hủy / tiếp tục tác vụ xóa chạy nền")
+        print("  - Xuất (backup) collection ra file")
+        print("  - Nhập (restore) documents từ file NDJSON / CSV")
         print("-" * 60)
 
         print("🔧 MENU FIREBASE:")
@@ -375,10 +4415,18 @@ def show_firebase_management(config_manager):
         print("  5. 📄 Xem Documents trong Collection")
         print("  6. 🗑️ Xóa Document cụ thể")
         print("  7. ✏️ Cập nhật Document")
+        print("  8. 🧹 Xóa / Cập nhật hàng loạt")
+        print("  9. 🗂️ Tổng quan tất cả Collections")
+        print(" 10. 📋 Theo dõi tác vụ xóa (jobs)")
+        print(" 11. 💾 Xuất (backup) Collection")
+        print(" 12. 📥 Nhập (restore) Documents từ file")
         print("  0. 🔙 Quay lại menu chính")
         print("-" * 60)
+        outbox_line = format_outbox_status(config_manager.outbox_status())
+        if outbox_line:
+            print(outbox_line)
 
-        choice = input("Chọn chức năng (0-7): ").strip()
+        choice = screen.input("Chọn chức năng (0-12): ").strip()
 
         if choice == '0':
             break
@@ -396,9 +4444,19 @@ def show_firebase_management(config_manager):
             show_delete_document(config_manager)
         elif choice == '7':
             show_update_document(config_manager)
+        elif choice == '8':
+            show_bulk_documents(config_manager)
+        elif choice == '9':
+            show_collections_overview(config_manager)
+        elif choice == '10':
+            show_jobs(config_manager)
+        elif choice == '11':
+            show_export_collection(config_manager)
+        elif choice == '12':
+            show_import_documents(config_manager)
         else:
             print("❌ Lựa chọn không hợp lệ!")
-            input("Nhấn Enter để tiếp tục...")
+            screen.input("Nhấn Enter để tiếp tục...")
 
 
 def show_firebase_collections(config_manager):
@@ -414,6 +4472,8 @@ def show_firebase_collections(config_manager):
         if result and result.get('success'):
             collections = result.get('collections', [])
             count = result.get('count', 0)
+            if result.get('offline'):
+                print(format_staleness(result['cached_at']))
 
             print(f"✅ Tìm thấy {count} collections:")
             print("-" * 60)
@@ -436,7 +4496,81 @@ def show_firebase_collections(config_manager):
         print(f"❌ Lỗi: {e}")
 
     print("\n" + "=" * 60)
-    input("Nhấn Enter để quay lại...")
+    screen.input("Nhấn Enter để quay lại...")
+
+
+def build_overview_frame(collections, results, elapsed):
+    """Dựng màn hình tổng quan collections, sắp xếp theo số documents giảm dần"""
+    lines = [
+        "=" * 60,
+        "🤖 QUẢN LÝ MT5 VÀ FIREBASE",
+        "=" * 60,
+        f"📡 Server: {SERVER_URL}",
+        f"⏰ Thời gian: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        "-" * 60,
+        "🗂️ TỔNG QUAN FIREBASE COLLECTIONS",
+        "=" * 60,
+        f"⏳ Đã tải {len(results)}/{len(collections)} collections - {elapsed:.2f}s",
+        "",
+        f"{'#':>3} {'Collection':<28} {'Documents':>12} {'Độ trễ':>10}",
+        "-" * 60,
+    ]
+    done = sorted(results.items(), key=lambda item: -item[1][0] if item[1][0] is not None else 1)
+    for i, (name, (count, latency)) in enumerate(done, 1):
+        count_str = f"{count:,}" if count is not None else "❌ lỗi"
+        lines.append(f"{i:>3} {name[:28]:<28} {count_str:>12} {latency * 1000:>8.0f}ms")
+    for name in collections:
+        if name not in results:
+            lines.append(f"{'':>3} {name[:28]:<28} {'⏳':>12} {'':>10}")
+    lines.append("-" * 60)
+
+    counts = [count for count, _ in results.values() if count is not None]
+    lines.append(f"📊 Tổng cộng: {sum(counts):,} documents trong {len(counts)} collections")
+    if len(results) == len(collections) and results:
+        serial = sum(latency for _, latency in results.values())
+        lines.append(f"⚡ Thời gian thực: {elapsed:.2f}s"
+                     f" (gọi tuần tự ~{serial:.2f}s, chậm nhất {max(l for _, l in results.values()):.2f}s)")
+    return lines
+
+
+def show_collections_overview(config_manager):
+    """Hiển thị tổng quan số documents của tất cả collections, tải song song"""
+    clear_screen()
+    show_header()
+
+    print("🗂️ TỔNG QUAN FIREBASE COLLECTIONS")
+    print("=" * 60)
+
+    collections_result = config_manager.get_firebase_collections()
+    if not collections_result or not collections_result.get('success'):
+        print("❌ Không thể lấy danh sách collections")
+        screen.input("Nhấn Enter để quay lại...")
+        return
+
+    collections = collections_result.get('collections', [])
+    if not collections:
+        print("❌ Không có collection nào")
+        screen.input("Nhấn Enter để quay lại...")
+        return
+
+    results = {}
+    started = time.monotonic()
+    screen.draw(build_overview_frame(collections, results, 0))
+    stale = [collections_result['cached_at']] if collections_result.get('offline') else []
+    try:
+        for name, result, latency in config_manager.iter_collection_stats(collections):
+            count = result.get('document_count', 0) if result and result.get('success') else None
+            results[name] = (count, latency)
+            if result and result.get('offline'):
+                stale.append(result['cached_at'])
+            screen.draw(build_overview_frame(collections, results, time.monotonic() - started))
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
+    if stale:
+        print(format_staleness(min(stale)))
+
+    print("\n" + "=" * 60)
+    screen.input("Nhấn Enter để quay lại...")
 
 
 def show_collection_stats(config_manager):
@@ -451,13 +4585,13 @@ def show_collection_stats(config_manager):
     collections_result = config_manager.get_firebase_collections()
     if not collections_result or not collections_result.get('success'):
         print("❌ Không thể lấy danh sách collections")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     collections = collections_result.get('collections', [])
     if not collections:
         print("❌ Không có collection nào")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     print("📋 Chọn collection để xem thống kê:")
@@ -467,7 +4601,7 @@ def show_collection_stats(config_manager):
     print("-" * 60)
 
     try:
-        choice = input("Nhập số thứ tự hoặc tên collection: ").strip()
+        choice = screen.input("Nhập số thứ tự hoặc tên collection: ").strip()
 
         # Xác định collection name
         collection_name = None
@@ -477,28 +4611,55 @@ def show_collection_stats(config_manager):
                 collection_name = collections[choice_num - 1]
             else:
                 print("❌ Số thứ tự không hợp lệ")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
         else:
             if choice in collections:
                 collection_name = choice
             else:
                 print(f"❌ Không tìm thấy collection '{choice}'")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
 
-        # Lấy thống kê
-        result = config_manager.get_collection_stats(collection_name)
+        # Lấy thống kê (đếm bằng aggregate, ước lượng từ mẫu, cache STATS_TTL giây)
+        print("\n⏳ Đang tính thống kê...")
+        result = config_manager.get_collection_stats_detailed(collection_name)
         if result and result.get('success'):
             doc_count = result.get('document_count', 0)
             collection = result.get('collection', collection_name)
+            method = 'aggregate count' if result.get('count_method') == 'aggregate' else 'stats'
+            if result.get('offline'):
+                print(format_staleness(result['cached_at']))
 
             print(f"\n📊 THỐNG KÊ COLLECTION: {collection}")
             print("-" * 60)
-            print(f"📄 Số documents: {doc_count:,}")
+            print(f"📄 Số documents: {doc_count:,} ({method})")
 
             if doc_count > 0:
-                print(f"💾 Kích thước ước tính: ~{doc_count * 2} KB")
+                print(f"💾 Kích thước ước tính: ~{format_bytes(result['estimated_bytes'])}"
+                      f" (95%: {format_bytes(result['estimated_bytes_low'])}"
+                      f" - {format_bytes(result['estimated_bytes_high'])})")
+                print(f"📐 Trung bình: {format_bytes(result['avg_document_bytes'])}/document"
+                      f" - mẫu {result['sample_size']:,} documents")
+
+                print("\n🏷️ FIELDS (theo mẫu):")
+                print(f"  {'Field':<24} {'Có mặt':>8} {'Khác nhau':>10}")
+                for field, info in list(result['fields'].items())[:15]:
+                    unique = " (gần như duy nhất)" if info['likely_unique'] else ""
+                    print(f"  {field[:24]:<24} {info['presence'] * 100:>7.0f}% {info['distinct_in_sample']:>10,}{unique}")
+                if len(result['fields']) > 15:
+                    print(f"  ... và {len(result['fields']) - 15} fields khác")
+
+                age = result.get('age')
+                if age:
+                    print(f"\n📅 PHÂN BỐ TUỔI (theo '{age['field']}', 95% CI):")
+                    for bucket in age['buckets']:
+                        bar = '█' * round(bucket['fraction'] * 20)
+                        print(f"  {bucket['label']:<12} {bar:<20} ~{bucket['estimated_count']:,}"
+                              f" [{bucket['count_low']:,} - {bucket['count_high']:,}]")
+                    print(f"  Cũ nhất ~{age['oldest_days']:.0f} ngày, mới nhất ~{age['newest_days']:.1f} ngày")
+
+            print(f"\n⏰ Tính lúc: {result['computed_at']} (cache {STATS_TTL // 60} phút)")
 
         else:
             print("❌ Không thể lấy thống kê collection")
@@ -509,7 +4670,7 @@ def show_collection_stats(config_manager):
         print(f"❌ Lỗi: {e}")
 
     print("\n" + "=" * 60)
-    input("Nhấn Enter để quay lại...")
+    screen.input("Nhấn Enter để quay lại...")
 
 
 def show_clear_collection(config_manager):
@@ -527,13 +4688,13 @@ def show_clear_collection(config_manager):
     collections_result = config_manager.get_firebase_collections()
     if not collections_result or not collections_result.get('success'):
         print("❌ Không thể lấy danh sách collections")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     collections = collections_result.get('collections', [])
     if not collections:
         print("❌ Không có collection nào")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     print("📋 Chọn collection để xóa:")
@@ -543,7 +4704,7 @@ def show_clear_collection(config_manager):
     print("-" * 60)
 
     try:
-        choice = input("Nhập số thứ tự hoặc tên collection: ").strip()
+        choice = screen.input("Nhập số thứ tự hoặc tên collection: ").strip()
 
         # Xác định collection name
         collection_name = None
@@ -553,37 +4714,48 @@ def show_clear_collection(config_manager):
                 collection_name = collections[choice_num - 1]
             else:
                 print("❌ Số thứ tự không hợp lệ")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
         else:
             if choice in collections:
                 collection_name = choice
             else:
                 print(f"❌ Không tìm thấy collection '{choice}'")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
 
         # Hiển thị thống kê trước khi xóa
-        stats_result = config_manager.get_collection_stats(collection_name)
+        stats_result = config_manager.get_collection_stats_detailed(collection_name)
         if stats_result and stats_result.get('success'):
             doc_count = stats_result.get('document_count', 0)
-            print(f"\n📊 Collection '{collection_name}' có {doc_count:,} documents")
+            print(f"\n📊 Collection '{collection_name}' có {doc_count:,} documents"
+                  f" (~{format_bytes(stats_result['estimated_bytes'])})")
+
+        # Backup trước khi xóa
+        if screen.input("\n💾 Xuất backup trước khi xóa? (Y/n): ").strip().lower() != 'n':
+            result = run_export(config_manager, collection_name)
+            if not result or not result['completed']:
+                print("❌ Chưa backup xong, đã hủy thao tác xóa")
+                screen.input("Nhấn Enter để quay lại...")
+                return
 
         # Xác nhận xóa
         print(f"\n⚠️ Bạn có chắc chắn muốn xóa TẤT CẢ documents trong collection '{collection_name}'?")
-        confirm = input("Nhập 'DELETE' để xác nhận: ").strip()
+        confirm = screen.input("Nhập 'DELETE' để xác nhận: ").strip()
 
         if confirm == "DELETE":
             print(f"\n🗑️ Đang xóa collection '{collection_name}'...")
 
-            result = config_manager.clear_collection(collection_name)
-            if result and result.get('success'):
-                deleted_count = result.get('deleted_count', 0)
-                print(f"✅ Đã xóa thành công {deleted_count:,} documents từ collection '{collection_name}'")
+            job = config_manager.start_clear_job(collection_name)
+            if job:
+                job = show_job_progress(config_manager, job)
+                if job['state'] == 'completed':
+                    print(f"✅ Đã xóa thành công {job.get('deleted', 0):,} documents từ collection '{collection_name}'")
+                elif job['state'] == 'failed':
+                    print("❌ Lỗi khi xóa collection")
+                    print(f"Lỗi: {job.get('error') or 'Không xác định'}")
             else:
                 print("❌ Lỗi khi xóa collection")
-                if result:
-                    print(f"Lỗi: {result.get('error', 'Không xác định')}")
         else:
             print("❌ Đã hủy thao tác xóa")
 
@@ -591,7 +4763,172 @@ def show_clear_collection(config_manager):
         print(f"❌ Lỗi: {e}")
 
     print("\n" + "=" * 60)
-    input("Nhấn Enter để quay lại...")
+    screen.input("Nhấn Enter để quay lại...")
+
+
+def run_export(config_manager, collection_name, path=None, format='ndjson', resume=True):
+    """Xuất collection và hiển thị tiến độ. Enter = dừng (lần sau tiếp tục được). Trả về kết quả"""
+    stop_event = threading.Event()
+
+    def wait_for_enter():
+        screen.read_line()
+        stop_event.set()
+
+    print("ℹ️ Nhấn Enter để dừng, chạy lại sẽ tiếp tục từ chỗ đã dừng")
+    enter_thread = threading.Thread(target=wait_for_enter, daemon=True)
+    enter_thread.start()
+    shown_at = [0]
+
+    def show_progress(stats):
+        if time.monotonic() - shown_at[0] >= 0.25:
+            shown_at[0] = time.monotonic()
+            print(f"\r⏳ {format_export_progress(stats)}\x1b[K", end='', flush=True)
+
+    result = config_manager.export_collection(collection_name, path, format, resume, progress=show_progress,
+                                              stop_event=stop_event)
+    if result:
+        print(f"\r⏳ {format_export_progress(result)}\x1b[K")
+    if not stop_event.is_set():
+        # Thread vẫn đang chờ input, để nó nhận lần Enter này
+        print("Nhấn Enter để tiếp tục...")
+        enter_thread.join()
+
+    if not result:
+        print("❌ Lỗi khi xuất collection")
+    elif result['completed']:
+        print(f"✅ Đã xuất {result['documents']:,} documents ({format_bytes(result['file_bytes'])})"
+              f" trong {format_duration(result['elapsed'])}")
+        print(f"💾 {result['path']}")
+    else:
+        if result.get('error'):
+            print(f"❌ {result['error']}")
+        print(f"⏸️ Đã xuất {result['documents']:,} documents, chạy lại để tiếp tục: {result['path']}")
+    return result
+
+
+def show_export_collection(config_manager):
+    """Hiển thị chức năng xuất (backup) collection ra file trên máy"""
+    clear_screen()
+    show_header()
+
+    print("💾 XUẤT (BACKUP) COLLECTION")
+    print("=" * 60)
+    print("Xuất toàn bộ documents ra file nén trên máy, bộ nhớ dùng cố định")
+    print(f"Tải {EXPORT_PREFETCH} trang song song, lưu vị trí sau mỗi {EXPORT_CHECKPOINT_DOCUMENTS:,} documents")
+    print("-" * 60)
+
+    try:
+        collection_name = choose_collection(config_manager)
+        if not collection_name:
+            screen.input("Nhấn Enter để quay lại...")
+            return
+
+        path, format = None, 'ndjson'
+        pending = pending_exports(config_manager.server_url, collection_name)
+        if pending:
+            print(f"\n⏸️ Có lần xuất dở: {pending[0]}")
+            if screen.input("Tiếp tục lần xuất này? (Y/n): ").strip().lower() != 'n':
+                path = pending[0]
+                format = 'parquet' if path.endswith('.parquet') else 'ndjson'
+        if path is None:
+            print("\n📦 Định dạng:")
+            print("  1. NDJSON nén gzip (.ndjson.gz)")
+            print("  2. Parquet (cần pyarrow)")
+            format = 'parquet' if screen.input("Chọn định dạng (1-2, Enter = 1): ").strip() == '2' else 'ndjson'
+            default_path = default_export_path(config_manager.server_url, collection_name, format)
+            path = screen.input(f"Đường dẫn (Enter = {default_path}): ").strip() or default_path
+
+        print(f"\n💾 Đang xuất collection '{collection_name}'...")
+        run_export(config_manager, collection_name, path, format)
+
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
+
+    print("\n" + "=" * 60)
+    screen.input("Nhấn Enter để quay lại...")
+
+
+def show_import_documents(config_manager):
+    """Hiển thị chức năng nhập (restore) documents từ file"""
+    clear_screen()
+    show_header()
+
+    print("📥 NHẬP (RESTORE) DOCUMENTS TỪ FILE")
+    print("=" * 60)
+    print("File NDJSON (mỗi dòng một document có field 'id') hoặc CSV có cột 'id', có thể nén .gz")
+    print(f"Gửi theo batch {BULK_BATCH_SIZE} documents, {BULK_CONCURRENCY} batch song song,"
+          f" tối đa {IMPORT_RATE_LIMIT:,} documents/giây")
+    print("Document đã có được cập nhật (merge), chưa có thì được tạo mới")
+    print("-" * 60)
+
+    try:
+        collection_name = screen.input("Tên collection (có thể là collection mới): ").strip()
+        if not collection_name:
+            print("❌ Tên collection không được để trống")
+            screen.input("Nhấn Enter để quay lại...")
+            return
+        exports = sorted(pending for pending in glob.glob(os.path.join(
+            server_data_dir(config_manager.server_url), 'exports', f"{collection_name}-*.ndjson.gz"))
+            if not os.path.exists(f"{pending}.checkpoint"))
+        default_path = exports[-1] if exports else ''
+        if default_path:
+            print(f"💾 Bản backup gần nhất: {default_path}")
+        path = screen.input(f"Đường dẫn file{' (Enter = bản backup gần nhất)' if default_path else ''}: ").strip()
+        path = os.path.expanduser(path or default_path)
+        if not path or not os.path.isfile(path):
+            print(f"❌ Không tìm thấy file '{path}'")
+            screen.input("Nhấn Enter để quay lại...")
+            return
+
+        importer = DocumentImporter(config_manager, collection_name, path)
+        checkpoint = importer.load_checkpoint()
+        resume = True
+        if checkpoint:
+            print(f"\n⏸️ Lần nhập trước dừng ở bản ghi {checkpoint['offset']:,}"
+                  f" (✅ {checkpoint['imported']:,} | ❌ {checkpoint['failed'] + checkpoint['rejected']:,})")
+            resume = screen.input("Tiếp tục từ đó? (Y/n): ").strip().lower() != 'n'
+
+        print(f"\n⚠️ Nhập {format_bytes(importer.file_size)} ({importer.format.upper()}) vào collection '{collection_name}'?")
+        if screen.input("Nhập 'IMPORT' để xác nhận: ").strip() != "IMPORT":
+            print("❌ Đã hủy thao tác nhập")
+            screen.input("Nhấn Enter để quay lại...")
+            return
+
+        stop_event = threading.Event()
+
+        def wait_for_enter():
+            screen.read_line()
+            stop_event.set()
+
+        print("ℹ️ Nhấn Enter để dừng, chạy lại sẽ tiếp tục từ chỗ đã dừng")
+        enter_thread = threading.Thread(target=wait_for_enter, daemon=True)
+        enter_thread.start()
+
+        def show_progress(stats):
+            print(f"\r⏳ {format_import_progress(stats)}\x1b[K", end='', flush=True)
+
+        result = importer.run(resume, show_progress, stop_event)
+        print(f"\r⏳ {format_import_progress(result)}\x1b[K")
+        if not stop_event.is_set():
+            print("Nhấn Enter để tiếp tục...")
+            enter_thread.join()
+
+        print(f"\n✅ Đã nhập: {result['imported']:,} | ❌ Server từ chối: {result['failed']:,}"
+              f" | ⚠️ Không hợp lệ: {result['rejected']:,} | ⏱️ {format_duration(result['elapsed'])}")
+        for error in result['errors']:
+            print(f"  - Bản ghi {error['record']:,} ({error['id'] or 'không có id'}): {error['error']}")
+        if result.get('rejects_path'):
+            print(f"📄 Danh sách bản ghi lỗi: {result['rejects_path']}")
+        if not result['completed']:
+            if result.get('error'):
+                print(f"❌ {result['error']}")
+            print(f"⏸️ Đã xử lý {result['offset']:,} bản ghi, chạy lại để tiếp tục")
+
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
+
+    print("\n" + "=" * 60)
+    screen.input("Nhấn Enter để quay lại...")
 
 
 def show_clear_old_documents(config_manager):
@@ -608,13 +4945,13 @@ def show_clear_old_documents(config_manager):
     collections_result = config_manager.get_firebase_collections()
     if not collections_result or not collections_result.get('success'):
         print("❌ Không thể lấy danh sách collections")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     collections = collections_result.get('collections', [])
     if not collections:
         print("❌ Không có collection nào")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     print("📋 Chọn collection:")
@@ -624,7 +4961,7 @@ def show_clear_old_documents(config_manager):
     print("-" * 60)
 
     try:
-        choice = input("Nhập số thứ tự hoặc tên collection: ").strip()
+        choice = screen.input("Nhập số thứ tự hoặc tên collection: ").strip()
 
         # Xác định collection name
         collection_name = None
@@ -634,20 +4971,20 @@ def show_clear_old_documents(config_manager):
                 collection_name = collections[choice_num - 1]
             else:
                 print("❌ Số thứ tự không hợp lệ")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
         else:
             if choice in collections:
                 collection_name = choice
             else:
                 print(f"❌ Không tìm thấy collection '{choice}'")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
 
         # Nhập số ngày
         while True:
             try:
-                days_input = input(f"\nNhập số ngày (documents cũ hơn X ngày sẽ bị xóa): ").strip()
+                days_input = screen.input(f"\nNhập số ngày (documents cũ hơn X ngày sẽ bị xóa): ").strip()
                 days = int(days_input)
                 if days > 0:
                     break
@@ -657,28 +4994,34 @@ def show_clear_old_documents(config_manager):
                 print("❌ Vui lòng nhập số nguyên hợp lệ")
 
         # Hiển thị thống kê trước khi xóa
-        stats_result = config_manager.get_collection_stats(collection_name)
+        stats_result = config_manager.get_collection_stats_detailed(collection_name)
         if stats_result and stats_result.get('success'):
             doc_count = stats_result.get('document_count', 0)
             print(f"\n📊 Collection '{collection_name}' có {doc_count:,} documents")
+            estimate = estimate_older_than(stats_result, days)
+            if estimate:
+                print(f"📅 Ước tính ~{estimate[0]:,} documents cũ hơn {days} ngày"
+                      f" (95%: {estimate[1]:,} - {estimate[2]:,})")
 
         # Xác nhận xóa
         print(f"\n⚠️ Bạn có chắc chắn muốn xóa documents cũ hơn {days} ngày trong collection '{collection_name}'?")
-        confirm = input("Nhập 'DELETE' để xác nhận: ").strip()
+        confirm = screen.input("Nhập 'DELETE' để xác nhận: ").strip()
 
         if confirm == "DELETE":
             print(f"\n🗑️ Đang xóa documents cũ hơn {days} ngày...")
 
-            result = config_manager.clear_old_documents(collection_name, days)
-            if result and result.get('success'):
-                deleted_count = result.get('deleted_count', 0)
-                cutoff_date = result.get('cutoff_date', 'N/A')
-                print(f"✅ Đã xóa thành công {deleted_count:,} documents cũ hơn {days} ngày")
-                print(f"📅 Cutoff date: {cutoff_date}")
+            job = config_manager.start_clear_job(collection_name, days)
+            if job:
+                job = show_job_progress(config_manager, job)
+                if job['state'] == 'completed':
+                    print(f"✅ Đã xóa thành công {job.get('deleted', 0):,} documents cũ hơn {days} ngày")
+                    if job.get('cutoff_date'):
+                        print(f"📅 Cutoff date: {job['cutoff_date']}")
+                elif job['state'] == 'failed':
+                    print("❌ Lỗi khi xóa documents cũ")
+                    print(f"Lỗi: {job.get('error') or 'Không xác định'}")
             else:
                 print("❌ Lỗi khi xóa documents cũ")
-                if result:
-                    print(f"Lỗi: {result.get('error', 'Không xác định')}")
         else:
             print("❌ Đã hủy thao tác xóa")
 
@@ -686,7 +5029,120 @@ def show_clear_old_documents(config_manager):
         print(f"❌ Lỗi: {e}")
 
     print("\n" + "=" * 60)
-    input("Nhấn Enter để quay lại...")
+    screen.input("Nhấn Enter để quay lại...")
+
+
+JOB_STATE_LABELS = {
+    'queued': '⏳ Đang chờ',
+    'running': '🔄 Đang chạy',
+    'completed': '✅ Hoàn thành',
+    'failed': '❌ Thất bại',
+    'cancelled': '🛑 Đã hủy',
+    'interrupted': '⏸️ Bị gián đoạn',
+}
+
+
+def format_duration(seconds):
+    """Định dạng số giây thành 1h02m / 3m05s / 12s"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def format_job_line(job, rate=None, eta=None):
+    """Một dòng tiến độ của job"""
+    state = JOB_STATE_LABELS.get(job['state'], job['state'])
+    if job.get('total'):
+        line = f"{state} {format_progress(job.get('deleted', 0), job['total'])}"
+    else:
+        line = f"{state} - đã xóa {job.get('deleted', 0):,} documents"
+    if rate:
+        line += f" | {rate:,.0f} docs/s"
+    if eta is not None:
+        line += f" | ETA {format_duration(eta)}"
+    return line
+
+
+def show_job_progress(config_manager, job):
+    """Theo dõi job tới khi kết thúc. Enter = để job chạy nền, 'c' + Enter = hủy job"""
+    stop_event = threading.Event()
+    commands = []
+
+    def read_command():
+        """Thread đọc lệnh của người dùng trong lúc theo dõi"""
+        commands.append(screen.read_line().strip().lower())
+        stop_event.set()
+
+    print(f"🆔 Job: {job['id']}")
+    print("ℹ️ Nhấn Enter để chạy nền, nhập 'c' + Enter để hủy job")
+    command_thread = threading.Thread(target=read_command, daemon=True)
+    command_thread.start()
+
+    for job, rate, eta in config_manager.watch_job(job['id'], stop_event):
+        print(f"\r{format_job_line(job, rate, eta)}\x1b[K", end='', flush=True)
+    print()
+
+    if not stop_event.is_set():
+        # Job đã kết thúc nhưng thread vẫn đang chờ input, để nó nhận lần Enter này
+        print("Nhấn Enter để tiếp tục...")
+        command_thread.join()
+    elif commands and commands[0] == 'c':
+        job = config_manager.cancel_job(job['id']) or job
+        print(f"🛑 Đã hủy job sau khi xóa {job.get('deleted', 0):,} documents")
+    elif job['state'] in JOB_ACTIVE_STATES:
+        print("🔄 Job tiếp tục chạy nền, xem lại tại menu Firebase > Theo dõi tác vụ xóa")
+    return job
+
+
+def show_jobs(config_manager):
+    """Hiển thị danh sách job xóa và cho phép theo dõi / hủy / tiếp tục"""
+    while True:
+        clear_screen()
+        show_header()
+
+        print("📋 TÁC VỤ XÓA (JOBS)")
+        print("=" * 60)
+
+        jobs = config_manager.list_jobs()
+        if not jobs:
+            print("  Chưa có job nào")
+            print("\n" + "=" * 60)
+            screen.input("Nhấn Enter để quay lại...")
+            return
+
+        for i, job in enumerate(jobs[:20], 1):
+            target = job['collection'] + (f" (> {job['days']} ngày)" if job.get('days') else "")
+            print(f"  {i:2d}. {job.get('created_at', '')[:16]} {target}")
+            print(f"      {format_job_line(job)}")
+        print("-" * 60)
+
+        choice = screen.input("Chọn job (Enter để quay lại): ").strip()
+        if not choice:
+            return
+        if not choice.isdigit() or not 1 <= int(choice) <= min(len(jobs), 20):
+            print("❌ Số thứ tự không hợp lệ")
+            screen.input("Nhấn Enter để tiếp tục...")
+            continue
+
+        job = jobs[int(choice) - 1]
+        action = screen.input("[w] Theo dõi | [c] Hủy | [r] Tiếp tục | Enter để quay lại: ").strip().lower()
+        try:
+            if action == 'w':
+                show_job_progress(config_manager, job)
+            elif action == 'c':
+                job = config_manager.cancel_job(job['id']) or job
+                print(format_job_line(job))
+                screen.input("Nhấn Enter để tiếp tục...")
+            elif action == 'r':
+                job = config_manager.resume_job(job['id'])
+                if job:
+                    show_job_progress(config_manager, job)
+        except Exception as e:
+            print(f"❌ Lỗi: {e}")
+            screen.input("Nhấn Enter để tiếp tục...")
 
 
 def show_collection_documents(config_manager):
@@ -701,13 +5157,13 @@ def show_collection_documents(config_manager):
     collections_result = config_manager.get_firebase_collections()
     if not collections_result or not collections_result.get('success'):
         print("❌ Không thể lấy danh sách collections")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     collections = collections_result.get('collections', [])
     if not collections:
         print("❌ Không có collection nào")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     print("📋 Chọn collection:")
@@ -717,7 +5173,7 @@ def show_collection_documents(config_manager):
     print("-" * 60)
 
     try:
-        choice = input("Nhập số thứ tự hoặc tên collection: ").strip()
+        choice = screen.input("Nhập số thứ tự hoặc tên collection: ").strip()
 
         # Xác định collection name
         collection_name = None
@@ -727,63 +5183,99 @@ def show_collection_documents(config_manager):
                 collection_name = collections[choice_num - 1]
             else:
                 print("❌ Số thứ tự không hợp lệ")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
         else:
             if choice in collections:
                 collection_name = choice
             else:
                 print(f"❌ Không tìm thấy collection '{choice}'")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
 
-        # Lấy documents
-        result = config_manager.get_collection_documents(collection_name, limit=20)
-        if result and result.get('success'):
-            documents = result.get('documents', [])
-            count = result.get('count', 0)
-
-            print(f"\n📄 DOCUMENTS TRONG COLLECTION: {collection_name}")
-            print("=" * 80)
-
-            if documents:
-                print(f"{'ID':<30} {'Title/Name':<30} {'Date':<20}")
-                print("-" * 80)
-
-                for doc in documents:
-                    doc_id = doc.get('id', 'N/A')[:28] + '..' if len(doc.get('id', '')) > 30 else doc.get('id', 'N/A')
+        # Lọc / sắp xếp trên server, chỉ lấy các field sẽ hiển thị
+        filter_text = screen.input("Điều kiện lọc, ví dụ status == \"new\" (Enter để bỏ qua): ").strip()
+        where = parse_filter_expression(filter_text) if filter_text else None
+        order_by = screen.input("Sắp xếp theo field, thêm '-' để giảm dần (Enter để bỏ qua): ").strip() or None
+        query = {'where': where, 'order_by': order_by}
+        if where or order_by:
+            # Chỉ dùng /query khi thật sự lọc / sắp xếp: server cũ phải quét lại từ đầu ở mỗi trang,
+            # không lọc thì phân trang thường rẻ hơn
+            query['select'] = DOCUMENT_TITLE_FIELDS + DOCUMENT_DATE_FIELDS
+
+        # Duyệt documents theo trang, trang kế tiếp được tải trước trong nền
+        page_size = 20
+        iterator = config_manager.iter_collection_documents(collection_name, page_size=page_size, **query)
+        pages = iterator.pages()
+        page_tokens = []  # Token đầu mỗi trang đã xem, dùng để quay lại trang trước
 
-                    # Tìm title hoặc name
-                    title = 'N/A'
-                    for field in ['title', 'name', 'subject', 'heading']:
-                        if field in doc:
-                            title = str(doc[field])[:28] + '..' if len(str(doc[field])) > 30 else str(doc[field])
-                            break
-
-                    # Tìm date
-                    date = 'N/A'
-                    for field in ['created_at', 'updated_at', 'timestamp', 'date', 'crawled_at', 'published_date']:
-                        if field in doc:
-                            date = str(doc[field])[:20]
-                            break
-
-                    print(f"{doc_id:<30} {title:<30} {date:<20}")
-
-                print("-" * 80)
-                print(f"📊 Hiển thị {len(documents)}/{count} documents (giới hạn 20)")
-            else:
-                print("  Không có documents nào")
+        while True:
+            documents = next(pages, None)
+            if not documents:
+                if not page_tokens:
+                    print("  Không có documents nào")
+                    break
+                print("📭 Đã tới trang cuối")
+                last_token = page_tokens.pop()
+                iterator = config_manager.iter_collection_documents(collection_name, page_size=page_size,
+                                                                    token=last_token, **query)
+                pages = iterator.pages()
+                screen.input("Nhấn Enter để tiếp tục...")
+                continue
+            page_tokens.append(iterator.token)
 
-        else:
-            print("❌ Không thể lấy documents")
-            if result:
-                print(f"Lỗi: {result.get('error', 'Không xác định')}")
+            clear_screen()
+            show_header()
+            print(f"📄 DOCUMENTS TRONG COLLECTION: {collection_name}")
+            print("=" * 80)
+            print(f"{'ID':<30} {'Title/Name':<30} {'Date':<20}")
+            print("-" * 80)
+
+            for doc in documents:
+                doc_id = doc.get('id', 'N/A')[:28] + '..' if len(doc.get('id', '')) > 30 else doc.get('id', 'N/A')
+
+                # Tìm title hoặc name
+                title = 'N/A'
+                for field in DOCUMENT_TITLE_FIELDS:
+                    if field in doc:
+                        title = str(doc[field])[:28] + '..' if len(str(doc[field])) > 30 else str(doc[field])
+                        break
+
+                # Tìm date
+                date = 'N/A'
+                for field in DOCUMENT_DATE_FIELDS:
+                    if field in doc:
+                        date = str(doc[field])[:20]
+                        break
+
+                print(f"{doc_id:<30} {title:<30} {date:<20}")
+
+            print("-" * 80)
+            first = (len(page_tokens) - 1) * page_size + 1
+            total = iterator.total if iterator.total is not None else '?'
+            print(f"📊 Trang {len(page_tokens)} - Hiển thị {first}-{first + len(documents) - 1}/{total} documents")
+            if iterator.cached_at:
+                print(format_staleness(iterator.cached_at))
+
+            command = screen.input("[Enter] Trang sau | [p] Trang trước | [q] Thoát: ").strip().lower()
+            if command == 'q':
+                break
+            if command == 'p':
+                # Bỏ trang hiện tại, mở lại iterator từ đầu trang trước đó
+                page_tokens.pop()
+                previous_token = page_tokens.pop() if page_tokens else None
+                pages.close()
+                iterator = config_manager.iter_collection_documents(collection_name, page_size=page_size,
+                                                                    token=previous_token, **query)
+                pages = iterator.pages()
+
+        pages.close()
 
     except Exception as e:
         print(f"❌ Lỗi: {e}")
 
     print("\n" + "=" * 60)
-    input("Nhấn Enter để quay lại...")
+    screen.input("Nhấn Enter để quay lại...")
 
 
 def show_delete_document(config_manager):
@@ -800,13 +5292,13 @@ def show_delete_document(config_manager):
     collections_result = config_manager.get_firebase_collections()
     if not collections_result or not collections_result.get('success'):
         print("❌ Không thể lấy danh sách collections")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     collections = collections_result.get('collections', [])
     if not collections:
         print("❌ Không có collection nào")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     print("📋 Chọn collection:")
@@ -816,7 +5308,7 @@ def show_delete_document(config_manager):
     print("-" * 60)
 
     try:
-        choice = input("Nhập số thứ tự hoặc tên collection: ").strip()
+        choice = screen.input("Nhập số thứ tự hoặc tên collection: ").strip()
 
         # Xác định collection name
         collection_name = None
@@ -826,32 +5318,34 @@ def show_delete_document(config_manager):
                 collection_name = collections[choice_num - 1]
             else:
                 print("❌ Số thứ tự không hợp lệ")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
         else:
             if choice in collections:
                 collection_name = choice
             else:
                 print(f"❌ Không tìm thấy collection '{choice}'")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
 
         # Nhập document ID
-        document_id = input(f"\nNhập Document ID cần xóa: ").strip()
+        document_id = screen.input(f"\nNhập Document ID cần xóa: ").strip()
         if not document_id:
             print("❌ Document ID không được để trống")
-            input("Nhấn Enter để quay lại...")
+            screen.input("Nhấn Enter để quay lại...")
             return
 
         # Xác nhận xóa
         print(f"\n⚠️ Bạn có chắc chắn muốn xóa document '{document_id}' trong collection '{collection_name}'?")
-        confirm = input("Nhập 'DELETE' để xác nhận: ").strip()
+        confirm = screen.input("Nhập 'DELETE' để xác nhận: ").strip()
 
         if confirm == "DELETE":
             print(f"\n🗑️ Đang xóa document '{document_id}'...")
 
             result = config_manager.delete_document(collection_name, document_id)
-            if result and result.get('success'):
+            if result and result.get('queued'):
+                print(f"📥 Mất kết nối - đã lưu thao tác xóa vào hàng đợi ({result['pending']} thao tác chờ gửi)")
+            elif result and result.get('success'):
                 print(f"✅ Đã xóa thành công document '{document_id}'")
             else:
                 print("❌ Lỗi khi xóa document")
@@ -864,7 +5358,7 @@ def show_delete_document(config_manager):
         print(f"❌ Lỗi: {e}")
 
     print("\n" + "=" * 60)
-    input("Nhấn Enter để quay lại...")
+    screen.input("Nhấn Enter để quay lại...")
 
 
 def show_update_document(config_manager):
@@ -881,13 +5375,13 @@ def show_update_document(config_manager):
     collections_result = config_manager.get_firebase_collections()
     if not collections_result or not collections_result.get('success'):
         print("❌ Không thể lấy danh sách collections")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     collections = collections_result.get('collections', [])
     if not collections:
         print("❌ Không có collection nào")
-        input("Nhấn Enter để quay lại...")
+        screen.input("Nhấn Enter để quay lại...")
         return
 
     print("📋 Chọn collection:")
@@ -897,7 +5391,7 @@ def show_update_document(config_manager):
     print("-" * 60)
 
     try:
-        choice = input("Nhập số thứ tự hoặc tên collection: ").strip()
+        choice = screen.input("Nhập số thứ tự hoặc tên collection: ").strip()
 
         # Xác định collection name
         collection_name = None
@@ -907,21 +5401,21 @@ def show_update_document(config_manager):
                 collection_name = collections[choice_num - 1]
             else:
                 print("❌ Số thứ tự không hợp lệ")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
         else:
             if choice in collections:
                 collection_name = choice
             else:
                 print(f"❌ Không tìm thấy collection '{choice}'")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
 
         # Nhập document ID
-        document_id = input(f"\nNhập Document ID cần cập nhật: ").strip()
+        document_id = screen.input(f"\nNhập Document ID cần cập nhật: ").strip()
         if not document_id:
             print("❌ Document ID không được để trống")
-            input("Nhấn Enter để quay lại...")
+            screen.input("Nhấn Enter để quay lại...")
             return
 
         # Nhập dữ liệu cập nhật
@@ -929,10 +5423,10 @@ def show_update_document(config_manager):
         print("Ví dụ: {\"title\": \"New Title\", \"status\": \"updated\"}")
 
         try:
-            update_data_str = input("Dữ liệu JSON: ").strip()
+            update_data_str = screen.input("Dữ liệu JSON: ").strip()
             if not update_data_str:
                 print("❌ Dữ liệu không được để trống")
-                input("Nhấn Enter để quay lại...")
+                screen.input("Nhấn Enter để quay lại...")
                 return
 
             import json
@@ -941,13 +5435,16 @@ def show_update_document(config_manager):
             # Xác nhận cập nhật
             print(f"\n⚠️ Bạn có chắc chắn muốn cập nhật document '{document_id}'?")
             print(f"Dữ liệu: {update_data}")
-            confirm = input("Nhập 'UPDATE' để xác nhận: ").strip()
+            confirm = screen.input("Nhập 'UPDATE' để xác nhận: ").strip()
 
             if confirm == "UPDATE":
                 print(f"\n✏️ Đang cập nhật document '{document_id}'...")
 
                 result = config_manager.update_document(collection_name, document_id, update_data)
-                if result and result.get('success'):
+                if result and result.get('queued'):
+                    print(f"📥 Mất kết nối - đã lưu thao tác cập nhật vào hàng đợi"
+                          f" ({result['pending']} thao tác chờ gửi)")
+                elif result and result.get('success'):
                     print(f"✅ Đã cập nhật thành công document '{document_id}'")
                 else:
                     print("❌ Lỗi khi cập nhật document")
@@ -965,91 +5462,775 @@ def show_update_document(config_manager):
         print(f"❌ Lỗi: {e}")
 
     print("\n" + "=" * 60)
-    input("Nhấn Enter để quay lại...")
+    screen.input("Nhấn Enter để quay lại...")
 
 
-def show_main_menu(config_manager):
-    """Hiển thị menu chính"""
+def choose_collection(config_manager, title="📋 Chọn collection:"):
+    """Hiển thị danh sách collections và cho người dùng chọn, trả về tên hoặc None"""
+    collections_result = config_manager.get_firebase_collections()
+    if not collections_result or not collections_result.get('success'):
+        print("❌ Không thể lấy danh sách collections")
+        return None
+
+    collections = collections_result.get('collections', [])
+    if not collections:
+        print("❌ Không có collection nào")
+        return None
+
+    print(title)
+    for i, collection in enumerate(collections, 1):
+        print(f"  {i:2d}. {collection}")
+
+    print("-" * 60)
+
+    choice = screen.input("Nhập số thứ tự hoặc tên collection: ").strip()
+    if choice.isdigit():
+        choice_num = int(choice)
+        if 1 <= choice_num <= len(collections):
+            return collections[choice_num - 1]
+        print("❌ Số thứ tự không hợp lệ")
+        return None
+    if choice in collections:
+        return choice
+    print(f"❌ Không tìm thấy collection '{choice}'")
+    return None
+
+
+def collect_ids_by_filter(config_manager, collection_name, where):
+    """Duyệt collection và lấy ID các documents thỏa điều kiện"""
+    ids = []
+    # Server lọc và chỉ trả về field 'id' cho mỗi document khớp
+    iterator = config_manager.iter_collection_documents(collection_name, where=where, select=['id'])
+    for doc in iterator:
+        ids.append(doc.get('id'))
+        if len(ids) % DOCUMENT_PAGE_SIZE == 0:
+            print(f"\r🔍 Đã tìm thấy {len(ids):,} documents khớp...", end='', flush=True)
+    print(f"\r🔍 Tìm thấy {len(ids):,} documents khớp" + " " * 20)
+    return ids
+
+
+def show_bulk_documents(config_manager):
+    """Hiển thị chức năng xóa / cập nhật documents hàng loạt"""
+    clear_screen()
+    show_header()
+
+    print("🧹 XÓA / CẬP NHẬT DOCUMENTS HÀNG LOẠT")
+    print("=" * 60)
+    print("Lấy danh sách Document ID từ file hoặc từ kết quả truy vấn,")
+    print(f"sau đó gửi theo batch {BULK_BATCH_SIZE} documents, {BULK_CONCURRENCY} batch song song")
+    print("-" * 60)
+
+    try:
+        collection_name = choose_collection(config_manager)
+        if not collection_name:
+            screen.input("Nhấn Enter để quay lại...")
+            return
+
+        print("\n📥 Nguồn Document ID:")
+        print("  1. 📄 Từ file (mỗi dòng một ID, JSON list hoặc NDJSON)")
+        print("  2. 🔍 Từ kết quả truy vấn (ví dụ: status == \"old\" and score < 5)")
+        source = screen.input("Chọn nguồn (1-2): ").strip()
+
+        if source == '1':
+            path = screen.input("Đường dẫn file: ").strip()
+            document_ids = read_document_ids(path)
+        elif source == '2':
+            where = parse_filter_expression(screen.input("Điều kiện: ").strip())
+            document_ids = collect_ids_by_filter(config_manager, collection_name, where)
+        else:
+            print("❌ Lựa chọn không hợp lệ!")
+            screen.input("Nhấn Enter để quay lại...")
+            return
+
+        document_ids = list(dict.fromkeys(i for i in document_ids if i))
+        if not document_ids:
+            print("❌ Không có Document ID nào")
+            screen.input("Nhấn Enter để quay lại...")
+            return
+
+        print(f"\n📋 {len(document_ids):,} documents, ví dụ: {', '.join(document_ids[:5])}")
+        print("\n🔧 Thao tác:")
+        print("  1. 🗑️ Xóa")
+        print("  2. ✏️ Cập nhật (cùng dữ liệu JSON cho tất cả)")
+        action = screen.input("Chọn thao tác (1-2): ").strip()
+
+        if action == '1':
+            print(f"\n⚠️ Bạn có chắc chắn muốn xóa {len(document_ids):,} documents trong '{collection_name}'?")
+            if screen.input("Nhập 'DELETE' để xác nhận: ").strip() != "DELETE":
+                print("❌ Đã hủy thao tác xóa")
+                screen.input("Nhấn Enter để quay lại...")
+                return
+            run_bulk = functools.partial(config_manager.bulk_delete_documents, collection_name, document_ids)
+        elif action == '2':
+            print("Ví dụ: {\"status\": \"archived\"}")
+            update_data = json.loads(screen.input("Dữ liệu JSON: ").strip())
+            print(f"\n⚠️ Bạn có chắc chắn muốn cập nhật {len(document_ids):,} documents trong '{collection_name}'?")
+            if screen.input("Nhập 'UPDATE' để xác nhận: ").strip() != "UPDATE":
+                print("❌ Đã hủy thao tác cập nhật")
+                screen.input("Nhấn Enter để quay lại...")
+                return
+            updates = {doc_id: update_data for doc_id in document_ids}
+            run_bulk = functools.partial(config_manager.bulk_update_documents, collection_name, updates)
+        else:
+            print("❌ Lựa chọn không hợp lệ!")
+            screen.input("Nhấn Enter để quay lại...")
+            return
+
+        started = time.monotonic()
+
+        def show_progress(done, total):
+            print(f"\r⏳ {format_progress(done, total)}", end='', flush=True)
+
+        results = run_bulk(progress=show_progress)
+        elapsed = time.monotonic() - started
+        failed = {doc_id: r for doc_id, r in results.items() if not r['success']}
+
+        print(f"\n\n✅ Thành công: {len(results) - len(failed):,} | ❌ Thất bại: {len(failed):,}"
+              f" | ⏱️ {elapsed:.1f}s")
+        for doc_id, r in list(failed.items())[:10]:
+            print(f"  - {doc_id}: {r['error']}")
+        if len(failed) > 10:
+            print(f"  ... và {len(failed) - 10:,} documents khác")
+        if failed:
+            path = screen.input("\nLưu danh sách ID thất bại vào file (Enter để bỏ qua): ").strip()
+            if path:
+                with open(os.path.expanduser(path), 'w', encoding='utf-8') as f:
+                    f.write('\n'.join(failed) + '\n')
+                print(f"💾 Đã lưu {len(failed):,} ID vào {path}")
+
+    except json.JSONDecodeError:
+        print("❌ Dữ liệu JSON không hợp lệ")
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
+
+    print("\n" + "=" * 60)
+    screen.input("Nhấn Enter để quay lại...")
+
+
+def format_latency_summary(summary):
+    """p50 / p95 / p99 của một LatencyHistogram.summary()"""
+    if not summary['count']:
+        return "chưa có dữ liệu"
+    return (f"p50 {summary['p50']:.0f}ms | p95 {summary['p95']:.0f}ms | p99 {summary['p99']:.0f}ms"
+            f" | max {summary['max']:.0f}ms ({summary['count']:,} mẫu)")
+
+
+def format_wire_stats(summary, limit=6):
+    """Dung lượng qua mạng / sau giải nén và thời gian giải mã của các endpoint nhận nhiều dữ liệu nhất"""
+    headers = negotiation_headers()
+    lines = [f"  Hỗ trợ: nén {headers['Accept-Encoding']} | định dạng {headers['Accept']}"]
+    if not summary:
+        return lines + ["  chưa có dữ liệu"]
+    for item in summary[:limit]:
+        ratio = item['wire_bytes'] / item['body_bytes'] if item['body_bytes'] else 1
+        lines.append(f"  {item['endpoint']}: {format_bytes(item['wire_bytes'])} qua mạng"
+                     f" / {format_bytes(item['body_bytes'])} ({ratio * 100:.0f}%)"
+                     f" | giải mã {item['decode_ms']:.2f}ms | {', '.join(item['formats'])} ({item['responses']:,})")
+    return lines
+
+
+def show_connection_health(config_manager):
+    """Độ trễ tunnel và tỷ lệ lỗi do HealthMonitor thu thập"""
+    clear_screen()
+    show_header()
+
+    print("📶 TÌNH TRẠNG KẾT NỐI")
+    print("=" * 60)
+    stats = config_manager.health.stats()
+    print(format_connection_status(stats['status'], config_manager.health.histogram))
+    if stats['last_probe_at']:
+        print(f"🕒 Kiểm tra gần nhất: {datetime.fromtimestamp(stats['last_probe_at']).strftime('%H:%M:%S')}"
+              f" ({stats['probes']:,} lần, mỗi {config_manager.health.interval}s)")
+    if stats['error_rate'] is not None:
+        print(f"❌ Tỷ lệ lỗi: {stats['error_rate'] * 100:.1f}% ({len(config_manager.health.outcomes)} lần gần nhất)")
+    print(f"\n💓 /api/health: {format_latency_summary(stats)}")
+    print(f"🌐 Mọi request: {format_latency_summary(config_manager.request_latency.summary())}")
+    print("\n📦 Dữ liệu nhận (trung bình mỗi response):")
+    for line in format_wire_stats(config_manager.wire_stats.summary()):
+        print(line)
+    flights = config_manager.single_flight.stats()
+    if flights['saved_ratio']:
+        print(f"🔀 GET giống nhau được gộp: {flights['shared']:,} chờ chung, {flights['coalesced']:,} dùng lại"
+              f" trong {config_manager.single_flight.window * 1000:.0f}ms"
+              f" (tiết kiệm {flights['saved_ratio'] * 100:.0f}% / {flights['requests']:,} request)")
+    outbox_line = format_outbox_status(config_manager.outbox_status())
+    if outbox_line:
+        print(outbox_line)
+
+    print("\n" + "=" * 60)
+    screen.input("Nhấn Enter để quay lại...")
+
+
+def format_connection_status(status, histogram=None):
+    """Dòng trạng thái kết nối cho menu chính"""
+    if status == 'online':
+        p50 = histogram.percentile(50) if histogram else None
+        latency = f" (độ trễ ~{p50:.0f}ms)" if p50 is not None else ""
+        return f"✅ Kết nối server thành công!{latency}"
+    if status == 'unknown':
+        return "⏳ Đang kiểm tra kết nối server..."
+    return "⚠️ Không kết nối được server - đang dùng dữ liệu lưu trên máy"
+
+
+def draw_main_menu(config_manager):
+    """Vẽ menu chính từ trạng thái kết nối đã cache của HealthMonitor (không gọi server)"""
+    clear_screen()
+    show_header()
+
+    # Menu vẫn dùng được khi offline (dữ liệu lấy từ máy)
+    monitor = config_manager.health
+    shown = [format_connection_status(monitor.status, monitor.histogram)]
+    print(shown[0])
+
+    def refresh_status(monitor):
+        # Cập nhật dòng trạng thái khi kết nối thay đổi, kể cả khi đang chờ nhập
+        line = format_connection_status(monitor.status, monitor.histogram)
+        if screen.replace_line(shown[0], line):
+            shown[0] = line
+
+    monitor.listener = refresh_status
+    if monitor.status == 'offline':
+        print("Hãy kiểm tra:")
+        print("  - Server có đang chạy không?")
+        print("  - IP address có đúng không?")
+        print("  - Port 5000 có mở không?")
+        print(f"  - URL hiện tại: {SERVER_URL}")
+        print("  - Nhập 'ip' để đổi địa chỉ server, Enter để kiểm tra lại")
+    outbox_line = format_outbox_status(config_manager.outbox_status())
+    if outbox_line:
+        print(outbox_line)
+
+    print("\n🔧 MENU CHÍNH:")
+    print("  1. 💰 Thông tin tài khoản MT5")
+    print("  2. 📢 Test gửi tin nhắn Discord")
+    print("  3. 🔥 Quản lý Firebase")
+    print("  4. 📜 Lịch sử tài khoản (lưu trên máy)")
+    print("  5. 📶 Tình trạng kết nối")
+    print("  6. 🖥️ Tất cả server (tổng hợp)")
+    print("  0. 🚪 Thoát")
+    print("-" * 60)
+
+
+def build_servers_frame(registry, results, elapsed):
+    """Màn hình tổng hợp nhiều server: từng server, tổng theo tiền tệ và các lệnh lỗ/lãi nhiều nhất"""
+    lines = [
+        "=" * 60,
+        "🤖 QUẢN LÝ MT5 VÀ FIREBASE",
+        "=" * 60,
+        f"⏰ Thời gian: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        "-" * 60,
+        "🖥️ TẤT CẢ SERVER",
+        "=" * 60,
+        f"⏳ Đã trả về {len(results)}/{len(registry.servers)} server - {elapsed:.2f}s",
+        "",
+        f"  {'Server':<14} {'Equity':>14} {'Profit':>12} {'Lệnh':>5} {'Độ trễ':>8}  Trạng thái",
+        "-" * 72,
+    ]
+    for name, url in registry.servers.items():
+        active = "*" if name == registry.active else " "
+        if name not in results:
+            lines.append(f"{active} {name[:14]:<14} {'':>14} {'':>12} {'':>5} {'':>8}  ⏳")
+            continue
+        info, latency, error = results[name]
+        account = (info or {}).get('account')
+        if not account:
+            lines.append(f"{active} {name[:14]:<14} {'':>14} {'':>12} {'':>5} {latency * 1000:>6.0f}ms  ❌ {error or 'lỗi'}")
+            continue
+        state = "⚠️ offline" if info.get('offline') else "✅"
+        lines.append(f"{active} {name[:14]:<14} {account.get('equity', 0):>14,.2f} {account.get('profit', 0):>+12,.2f}"
+                     f" {len(info.get('positions', [])):>5} {latency * 1000:>6.0f}ms  {state}")
+    lines.append("-" * 72)
+
+    consolidated = consolidate_accounts({name: info for name, (info, _, _) in results.items()})
+    for currency, total in consolidated['totals'].items():
+        lines.append(f"💰 Tổng ({currency}, {total['servers']} server): Balance ${total['balance']:,.2f}"
+                     f" | Equity ${total['equity']:,.2f} | Profit ${total['profit']:+,.2f}"
+                     f" | {total['positions']} lệnh")
+    positions = consolidated['positions']
+    if positions:
+        lines += ["", "📋 LỆNH LỖ / LÃI NHIỀU NHẤT:",
+                  f"  {'Server':<12} {'Ticket':<10} {'Symbol':<10} {'Type':<5} {'Volume':>7} {'Profit':>12}"]
+        shown = positions[:5] + [pos for pos in positions[-5:][::-1] if pos not in positions[:5]]
+        for pos in shown:
+            pos_type = 'BUY' if pos.get('type', 0) == 0 else 'SELL'
+            lines.append(f"  {pos['server'][:12]:<12} {str(pos.get('ticket', 'N/A')):<10} {pos.get('symbol', 'N/A'):<10}"
+                         f" {pos_type:<5} {pos.get('volume', 0):>7.2f} {pos.get('profit', 0):>+12,.2f}")
+    return lines
+
+
+def show_servers(registry, config_manager):
+    """Tổng hợp tài khoản của tất cả server (gọi song song), thêm / xóa / chọn server làm việc"""
     while True:
         clear_screen()
-        show_header()
+        results = {}
+        started = time.monotonic()
+        screen.draw(build_servers_frame(registry, results, 0))
+        for name, info, latency, error in registry.iter_account_info():
+            results[name] = (info, latency, error)
+            screen.draw(build_servers_frame(registry, results, time.monotonic() - started))
 
-        # Test kết nối
-        if not config_manager.test_connection():
-            print("❌ Không thể kết nối đến server!")
-            print("Hãy kiểm tra:")
-            print("  - Server có đang chạy không?")
-            print("  - IP address có đúng không?")
-            print("  - Port 5000 có mở không?")
-            print(f"  - URL hiện tại: {SERVER_URL}")
-            print("\nNhấn Enter để thử lại...")
-            input()
+        print("-" * 60)
+        print("[Enter] Quay lại | [r] Làm mới | [s] Chọn server làm việc | [a] Thêm server | [d] Xóa server")
+        action = screen.input("Chọn: ").strip().lower()
+        if action == 'r':
             continue
+        elif action == 'a':
+            name = screen.input("Tên server: ").strip()
+            url = screen.input("URL (vd: http://192.168.1.10:5000): ").strip()
+            if name and url:
+                registry.add(name, url if '://' in url else f"http://{url}")
+                if name == registry.active:
+                    config_manager = switch_server(registry, config_manager, name)
+        elif action in ('s', 'd'):
+            name = screen.input("Tên server: ").strip()
+            if name not in registry.servers:
+                print(f"❌ Không tìm thấy server '{name}'")
+                screen.input("Nhấn Enter để tiếp tục...")
+            elif action == 's':
+                config_manager = switch_server(registry, config_manager, name)
+                print(f"✅ Đang làm việc với server '{name}' ({SERVER_URL})")
+                screen.input("Nhấn Enter để tiếp tục...")
+            elif name == registry.active and len(registry.servers) > 1:
+                registry.remove(name)
+                config_manager = switch_server(registry, config_manager, registry.active)
+            elif not registry.remove(name):
+                print("❌ Không thể xóa server cuối cùng")
+                screen.input("Nhấn Enter để tiếp tục...")
+        else:
+            return config_manager
 
-        print("✅ Kết nối server thành công!")
-
-        print("\n🔧 MENU CHÍNH:")
-        print("  1. 💰 Thông tin tài khoản MT5")
-        print("  2. 📢 Test gửi tin nhắn Discord")
-        print("  3. 🔥 Quản lý Firebase")
-        print("  0. 🚪 Thoát")
-        print("-" * 60)
 
-        choice = input("Chọn chức năng (0-3): ").strip()
+def show_main_menu(config_manager, registry=None):
+    """Hiển thị menu chính"""
+    registry = registry or ServerRegistry(default_url=config_manager.server_url)
+    while True:
+        draw_main_menu(config_manager)
+        choice = screen.input("Chọn chức năng (0-6): ").strip()
 
         if choice == '0':
             print("👋 Tạm biệt!")
             break
+        elif choice == '':
+            config_manager.health.probe_now()
+        elif choice == 'ip':
+            config_manager = change_server_url(config_manager, registry)
         elif choice == '1':
             show_mt5_account_info(config_manager)
         elif choice == '2':
             show_discord_test(config_manager)
         elif choice == '3':
             show_firebase_management(config_manager)
+        elif choice == '4':
+            show_account_history(config_manager)
+        elif choice == '5':
+            show_connection_health(config_manager)
+        elif choice == '6':
+            config_manager = show_servers(registry, config_manager)
         else:
             print("❌ Lựa chọn không hợp lệ!")
-            input("Nhấn Enter để tiếp tục...")
+            screen.input("Nhấn Enter để tiếp tục...")
 
 
-def main():
-    """Hàm chính"""
+def switch_server(registry, config_manager, name):
+    """Chuyển server đang làm việc, trả về ConfigManager của server đó"""
+    global SERVER_URL
+
+    config_manager.health.stop()
+    config_manager = registry.activate(name)
+    SERVER_URL = config_manager.server_url
+    config_manager.health.start()
+    return config_manager
+
+
+def change_server_url(config_manager, registry):
+    """Nhập IP mới cho server đang làm việc, trả về ConfigManager kết nối tới địa chỉ mới"""
+    print(f"\nIP hiện tại: {SERVER_URL}")
+    new_ip = screen.input("Nhập IP mới (Enter để giữ nguyên): ").strip()
+    if not new_ip:
+        return config_manager
+    config_manager.health.stop()
+    registry.add(registry.active, f"http://{new_ip}:5000")
+    config_manager = switch_server(registry, config_manager, registry.active)
+    print(f"✅ Đã thay đổi IP thành: {SERVER_URL}")
+    screen.input("Nhấn Enter để tiếp tục...")
+    return config_manager
+
+
+def run_startup_profile(config_manager):
+    """--startup-profile: vẽ menu lần đầu, chờ health check rồi in thời gian từng bước và thoát"""
+    draw_main_menu(config_manager)
+    screen.flush()
+    startup_profile.mark("first paint")
+    config_manager.health.first_probe.wait(timeout=sum(ENDPOINT_TIMEOUTS['health']) * RETRY_MAX_ATTEMPTS + 5)
+    report = startup_profile.report()
+    print()
+    for line in report:
+        print(line)
+    # Lưu lại để so sánh giữa các lần chạy / phiên bản
+    os.makedirs(CLIENT_DATA_DIR, exist_ok=True)
+    with open(os.path.join(CLIENT_DATA_DIR, 'startup.log'), 'a', encoding='utf-8') as f:
+        marks = ", ".join(f"{name}={elapsed * 1000:.1f}ms" for name, elapsed in startup_profile.marks.items())
+        f.write(f"{datetime.now().isoformat(timespec='seconds')} {marks}\n")
+
+
+def cli_json_argument(text):
+    """Tham số JSON trên dòng lệnh, '@file' để đọc từ file"""
+    if text.startswith('@'):
+        with open(os.path.expanduser(text[1:]), encoding='utf-8') as f:
+            text = f.read()
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"JSON không hợp lệ: {e}")
+
+
+def cli_filter_argument(text):
+    """Điều kiện lọc dạng 'status == "old" and score < 5' (xem parse_filter_expression)"""
+    try:
+        return parse_filter_expression(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def cli_ids_argument(text):
+    """Danh sách document ID: '@file' (xem read_document_ids) hoặc các ID cách nhau bởi dấu phẩy"""
+    if text.startswith('@'):
+        return read_document_ids(text[1:])
+    return [item for item in text.split(',') if item]
+
+
+def cli_fields_argument(text):
+    return [field.strip() for field in text.split(',') if field.strip()]
+
+
+COLLECTION_ARG = ('collection_name', {'metavar': 'COLLECTION'})
+PAGING_ARGS = [
+    ('--limit', {'type': int}),
+    ('--offset', {'type': int}),
+    ('--cursor', {}),
+]
+QUERY_ARGS = [
+    ('--where', {'type': cli_filter_argument, 'help': "vd: 'status == \"old\" and score < 5'"}),
+    ('--order-by', {'dest': 'order_by', 'action': 'append', 'help': "field hoặc -field (giảm dần), lặp lại được"}),
+    ('--select', {'type': cli_fields_argument, 'help': "field1,field2"}),
+]
+BULK_ARGS = [
+    ('--batch-size', {'type': int, 'dest': 'batch_size'}),
+    ('--concurrency', {'type': int}),
+]
+# Lệnh CLI -> (phương thức ConfigManager, mô tả, tham số). dest của tham số trùng tên tham số
+# của phương thức; tham số không truyền (None) dùng giá trị mặc định của phương thức
+CLI_COMMANDS = {
+    'health': ('test_connection', "Kiểm tra kết nối server", []),
+    'account': ('get_mt5_account_info', "Thông tin tài khoản MT5", []),
+    'discord': ('test_discord_notification', "Gửi tin nhắn Discord test", [('message', {})]),
+    'collections': ('get_firebase_collections', "Danh sách collections", []),
+    'stats': ('get_collection_stats', "Thống kê collection", [COLLECTION_ARG]),
+    'stats-detailed': ('get_collection_stats_detailed', "Thống kê chi tiết (ước lượng) của collection", [
+        COLLECTION_ARG,
+        ('--timestamp-field', {'dest': 'timestamp_field'}),
+        ('--refresh', {'action': 'store_true', 'default': None}),
+    ]),
+    'clear': ('clear_collection', "Xóa toàn bộ documents trong collection", [COLLECTION_ARG]),
+    'clear-old': ('clear_old_documents', "Xóa documents cũ hơn DAYS ngày", [COLLECTION_ARG, ('days', {'type': int})]),
+    'job-start': ('start_clear_job', "Xóa collection / documents cũ dạng job chạy nền", [
+        COLLECTION_ARG,
+        ('--days', {'type': int}),
+        ('--batch-size', {'type': int, 'dest': 'batch_size'}),
+    ]),
+    'job-status': ('get_job_status', "Trạng thái job", [('job_id', {})]),
+    'job-cancel': ('cancel_job', "Dừng job", [('job_id', {})]),
+    'job-resume': ('resume_job', "Tiếp tục job bị gián đoạn", [('job_id', {})]),
+    'jobs': ('list_jobs', "Các job đã tạo từ máy này", []),
+    'documents': ('get_collection_documents', "Một trang documents của collection", [COLLECTION_ARG, *PAGING_ARGS]),
+    'query': ('query_collection', "Truy vấn collection", [COLLECTION_ARG, *QUERY_ARGS, *PAGING_ARGS]),
+    'delete': ('delete_document', "Xóa một document", [COLLECTION_ARG, ('document_id', {})]),
+    'update': ('update_document', "Cập nhật một document", [
+        COLLECTION_ARG, ('document_id', {}), ('data', {'type': cli_json_argument, 'help': "JSON hoặc @file"}),
+    ]),
+    'bulk-delete': ('bulk_delete_documents', "Xóa nhiều documents", [
+        COLLECTION_ARG,
+        ('document_ids', {'type': cli_ids_argument, 'metavar': 'IDS', 'help': "id1,id2,... hoặc @file"}),
+        *BULK_ARGS,
+    ]),
+    'bulk-update': ('bulk_update_documents', "Cập nhật nhiều documents", [
+        COLLECTION_ARG,
+        ('updates', {'type': cli_json_argument, 'metavar': 'UPDATES', 'help': "JSON {document_id: dữ liệu} hoặc @file"}),
+        *BULK_ARGS,
+    ]),
+    'export': ('export_collection', "Xuất toàn bộ documents ra file, tiếp tục từ checkpoint nếu có", [
+        COLLECTION_ARG,
+        ('--path', {'help': "Mặc định: <dữ liệu server>/exports/<collection>-<thời gian>.ndjson.gz"}),
+        ('--output-format', {'dest': 'format', 'choices': ('ndjson', 'parquet')}),
+        ('--no-resume', {'dest': 'resume', 'action': 'store_false', 'default': None}),
+        ('--page-size', {'type': int, 'dest': 'page_size'}),
+        ('--prefetch', {'type': int}),
+    ]),
+    'import': ('import_documents', "Nhập documents từ file NDJSON / CSV (.gz), tiếp tục từ checkpoint nếu có", [
+        COLLECTION_ARG,
+        ('path', {'metavar': 'FILE'}),
+        ('--input-format', {'dest': 'format', 'choices': ('ndjson', 'csv'), 'help': "Mặc định: theo đuôi file"}),
+        ('--id-field', {'dest': 'id_field'}),
+        *BULK_ARGS,
+        ('--rate', {'type': int, 'help': f"documents/giây (mặc định {IMPORT_RATE_LIMIT}, 0 = không giới hạn)"}),
+        ('--no-resume', {'dest': 'resume', 'action': 'store_false', 'default': None}),
+    ]),
+    'outbox-status': ('outbox_status', "Trạng thái hàng đợi thao tác offline", []),
+    'outbox-replay': ('replay_outbox', "Gửi lại ngay các thao tác trong hàng đợi", []),
+}
+CLI_EXIT_OK = 0
+CLI_EXIT_FAILED = 1   # Server trả lỗi / không có kết quả
+CLI_EXIT_USAGE = 2    # Sai cú pháp
+CLI_EXIT_OFFLINE = 3  # Kết quả lấy từ dữ liệu trên máy hoặc thao tác mới chỉ vào hàng đợi
+BATCH_CONCURRENCY = 4  # Số lệnh trong file batch chạy cùng lúc
+
+
+class CliUsageError(Exception):
+    pass
+
+
+class CliArgumentParser(argparse.ArgumentParser):
+    """ArgumentParser báo lỗi bằng exception để một dòng sai trong file batch không thoát chương trình"""
+
+    def error(self, message):
+        raise CliUsageError(f"{self.prog}: {message}")
+
+
+def build_cli_parser():
+    """Parser cho dòng lệnh và cho từng dòng của file batch"""
+    def add_global_options(parser, default):
+        # Tùy chọn chung đặt được cả trước và sau tên lệnh; parser của lệnh không ghi đè giá trị đã có
+        parser.add_argument('--server', default=default(None),
+                            help="Tên server trong servers.json (mặc định: server đang chọn)")
+        parser.add_argument('--url', default=default(None), help="URL server, không dùng servers.json")
+        parser.add_argument('--format', choices=('json', 'ndjson'), default=default('json'),
+                            help="json: dễ đọc, ndjson: mỗi kết quả một dòng")
+        parser.add_argument('--startup-profile', action='store_true', default=default(False),
+                            help="In thời gian từng bước khởi động")
+
+    parser = CliArgumentParser(prog='client.py', description="Quản lý MT5 bot và Firebase không cần menu. "
+                               "Không có lệnh thì mở menu tương tác.")
+    add_global_options(parser, lambda value: value)
+    common = CliArgumentParser(add_help=False)
+    add_global_options(common, lambda value: argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND', parser_class=CliArgumentParser)
+    add_parser = functools.partial(commands.add_parser, parents=[common])
+    for name, (_, help_text, arguments) in CLI_COMMANDS.items():
+        command = add_parser(name, help=help_text, description=help_text)
+        for flag, options in arguments:
+            command.add_argument(flag, **options)
+    dump = add_parser('dump', help="Xuất toàn bộ documents của collection, mỗi document một dòng")
+    dump.add_argument(COLLECTION_ARG[0], **COLLECTION_ARG[1])
+    for flag, options in QUERY_ARGS:
+        dump.add_argument(flag, **options)
+    dump.add_argument('--page-size', dest='page_size', type=int, default=DOCUMENT_PAGE_SIZE)
+    add_parser('servers', help="Tài khoản MT5 của tất cả server (gọi song song)")
+    batch = add_parser('batch', help="Chạy song song các lệnh trong file, mỗi dòng một lệnh")
+    batch.add_argument('file', help="File lệnh, '-' để đọc từ stdin. Dòng trống và dòng '#' được bỏ qua")
+    batch.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY)
+    return parser
+
+
+def cli_exit_code(result):
+    """Mã thoát cho kết quả của một phương thức ConfigManager"""
+    if result is None or result is False:
+        return CLI_EXIT_FAILED
+    if isinstance(result, tuple) and result and isinstance(result[0], bool):
+        # Kết quả dạng (thành công, thông báo), vd. test_discord_notification
+        return CLI_EXIT_OK if result[0] else CLI_EXIT_FAILED
+    if isinstance(result, dict):
+        if result.get('offline') or result.get('queued'):
+            return CLI_EXIT_OFFLINE
+        if result.get('success') is False:
+            return CLI_EXIT_FAILED
+        if result and all(isinstance(item, dict) and 'success' in item for item in result.values()):
+            # Kết quả bulk: {document_id: {'success', 'error'}}
+            return CLI_EXIT_OK if all(item['success'] for item in result.values()) else CLI_EXIT_FAILED
+    return CLI_EXIT_OK
+
+
+def run_cli_command(config_manager, args):
+    """Gọi phương thức ConfigManager tương ứng với lệnh, trả về (kết quả, mã thoát)"""
+    method, _, arguments = CLI_COMMANDS[args.command]
+    kwargs = {}
+    for flag, options in arguments:
+        dest = options.get('dest', flag.lstrip('-'))
+        value = getattr(args, dest)
+        if value is not None:
+            kwargs[dest] = value
+    result = getattr(config_manager, method)(**kwargs)
+    return result, cli_exit_code(result)
+
+
+class CliOutput:
+    """Ghi kết quả JSON ra stdout (an toàn giữa các thread)"""
+
+    def __init__(self, stream, format='json'):
+        self.stream = stream
+        self.format = format
+        self._lock = threading.Lock()
+
+    def write(self, value, format=None):
+        if (format or self.format) == 'ndjson':
+            text = json.dumps(value, ensure_ascii=False, default=str, separators=(',', ':'))
+        else:
+            text = json.dumps(value, ensure_ascii=False, default=str, indent=2)
+        with self._lock:
+            self.stream.write(text + '\n')
+            self.stream.flush()
+
+
+def run_cli_dump(config_manager, args, output):
+    """Ghi từng document ra một dòng NDJSON, bộ nhớ chỉ giữ vài trang"""
+    iterator = config_manager.iter_collection_documents(args.collection_name, args.page_size, where=args.where,
+                                                        order_by=args.order_by, select=args.select)
+    try:
+        for doc in iterator:
+            output.write(doc, 'ndjson')
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return CLI_EXIT_FAILED
+    return CLI_EXIT_OFFLINE if iterator.cached_at else CLI_EXIT_OK
+
+
+def run_cli_servers(registry, output):
+    """Mỗi server một dòng theo thứ tự trả về, dòng cuối là tổng hợp"""
+    results, exit_code = {}, CLI_EXIT_OK
+    for name, info, latency, error in registry.iter_account_info():
+        results[name] = info
+        output.write({'server': name, 'url': registry.servers[name], 'latency_ms': round(latency * 1000, 1),
+                      'error': error, 'result': info}, 'ndjson')
+        exit_code = max(exit_code, CLI_EXIT_FAILED if error else cli_exit_code(info))
+    output.write({'consolidated': consolidate_accounts(results)}, 'ndjson')
+    return exit_code
+
+
+def run_cli_batch(config_manager, parser, args, output):
+    """Chạy các lệnh trong file song song, dùng chung event loop và connection pool
+
+    Mỗi dòng là một lệnh như trên dòng lệnh (vd: 'clear-old signals 7'). Mỗi lệnh ghi một dòng
+    NDJSON {"line", "command", "exit_code", "elapsed_ms", "result" | "error"} theo thứ tự hoàn
+    thành. Mã thoát của batch là mã lớn nhất trong các lệnh.
+    """
+    if args.file == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(os.path.expanduser(args.file), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+
+    def run_line(number, line):
+        started = time.perf_counter()
+        record = {'line': number, 'command': line}
+        try:
+            line_args = parser.parse_args(shlex.split(line))
+            if line_args.command not in CLI_COMMANDS:
+                raise CliUsageError(f"Lệnh '{line_args.command}' không chạy được trong batch")
+            record['result'], exit_code = run_cli_command(config_manager, line_args)
+        except CliUsageError as e:
+            exit_code, record['error'] = CLI_EXIT_USAGE, str(e)
+        except Exception as e:
+            exit_code, record['error'] = CLI_EXIT_FAILED, str(e)
+        record['exit_code'] = exit_code
+        record['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        output.write(record, 'ndjson')
+        return exit_code
+
+    commands = [(number, line.strip()) for number, line in enumerate(lines, 1)
+                if line.strip() and not line.strip().startswith('#')]
+    exit_code = CLI_EXIT_OK
+    # Các lệnh đồng bộ chạy trên thread riêng, request của chúng dùng chung pool của config_manager
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix='mt5-batch') as executor:
+        futures = [executor.submit(run_line, number, line) for number, line in commands]
+        for future in as_completed(futures):
+            exit_code = max(exit_code, future.result())
+    return exit_code
+
+
+def run_cli(args, parser):
+    """Chạy một lệnh không tương tác, trả về mã thoát"""
     global SERVER_URL
 
+    # Thông báo của các hàm (print) chuyển sang stderr để stdout chỉ chứa JSON
+    output = CliOutput(sys.stdout, args.format)
+    sys.stdout = sys.stderr
+    registry = ServerRegistry()
+    config_manager = None
+    try:
+        if args.url:
+            config_manager = ConfigManager(args.url.rstrip('/'))
+        elif args.server and args.server not in registry.servers:
+            print(f"❌ Không tìm thấy server '{args.server}'")
+            return CLI_EXIT_USAGE
+        else:
+            config_manager = registry.manager(args.server)
+        SERVER_URL = config_manager.server_url
+        startup_profile.mark("config manager ready")
+
+        if args.command == 'batch':
+            exit_code = run_cli_batch(config_manager, parser, args, output)
+        elif args.command == 'dump':
+            exit_code = run_cli_dump(config_manager, args, output)
+        elif args.command == 'servers':
+            exit_code = run_cli_servers(registry, output)
+        else:
+            result, exit_code = run_cli_command(config_manager, args)
+            output.write(result)
+        startup_profile.mark("command done")
+        if args.startup_profile:
+            for line in startup_profile.report():
+                print(line)
+        return exit_code
+    finally:
+        if args.url and config_manager is not None:
+            config_manager.close()
+        registry.close()
+        sys.stdout = output.stream
+
+
+def main():
+    """Hàm chính: không có lệnh thì mở menu, có lệnh thì chạy lệnh đó và trả về mã thoát"""
+    startup_profile.mark("module loaded")
+    parser = build_cli_parser()
+    try:
+        args = parser.parse_args()
+    except CliUsageError as e:
+        print(e, file=sys.stderr)
+        return CLI_EXIT_USAGE
+    if args.command:
+        return run_cli(args, parser)
+
+    screen.install()
     print("🚀 KHỞI ĐỘNG CLIENT04.PY")
     print("=" * 60)
 
-    # Kiểm tra kết nối mạng
-    print("📡 Kiểm tra kết nối...")
-
-    config_manager = ConfigManager(SERVER_URL)
-
-    if not config_manager.test_connection():
-        print(f"❌ Không thể kết nối đến {SERVER_URL}")
-        print("\n🔧 HƯỚNG DẪN KHẮC PHỤC:")
-        print("1. Đảm bảo server đang chạy trên máy chủ")
-        print("2. Kiểm tra IP address trong file client.py")
-        print("3. Đảm bảo port 5000 được mở")
-        print("4. Kiểm tra firewall")
-        print(f"\nIP hiện tại: {SERVER_URL}")
-        change_ip = input("Bạn có muốn thay đổi IP không? (y/n): ").lower()
-        if change_ip == 'y':
-            new_ip = input("Nhập IP mới: ").strip()
-            if new_ip:
-                SERVER_URL = f"http://{new_ip}:5000"
-                config_manager = ConfigManager(SERVER_URL)
-                print(f"✅ Đã thay đổi IP thành: {SERVER_URL}")
-                input("Nhấn Enter để tiếp tục...")
+    global SERVER_URL
+
+    # Không chờ health check: menu hiển thị ngay, kết nối được kiểm tra ở nền
+    registry = ServerRegistry()
+    SERVER_URL = registry.servers[registry.active]
+    config_manager = registry.manager()
+    config_manager.health.start()
+    startup_profile.mark("config manager ready")
+
+    if args.startup_profile:
+        run_startup_profile(config_manager)
+        return
 
     # Hiển thị menu chính
-    show_main_menu(config_manager)
+    show_main_menu(config_manager, registry)
+    return CLI_EXIT_OK
 
 
 if __name__ == "__main__":
+    exit_code = CLI_EXIT_FAILED
     try:
-        main()
+        exit_code = main()
     except KeyboardInterrupt:
         print("\n\n⚠️ Chương trình bị gián đoạn")
         print("👋 Tạm biệt!")
     except Exception as e:
         print(f"\n❌ Lỗi không mong muốn: {e}")
-        print("Hãy kiểm tra lại và thử lại") 
+        print("Hãy kiểm tra lại và thử lại")
+    finally:
+        screen.flush()
+    sys.exit(exit_code)
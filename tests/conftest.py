@@ -0,0 +1,226 @@
+"""Fixture dùng chung: server HTTP giả lập API của MT5 bot và thư mục dữ liệu tạm cho client"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+# Không đụng tới ~/.mt5_client của người chạy test (SERVERS_FILE được tính lúc import)
+os.environ.setdefault('MT5_CLIENT_HOME', tempfile.mkdtemp(prefix='mt5-client-test-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client  # noqa: E402
+
+
+class StubServer:
+    """Server giả lập các endpoint client dùng, dữ liệu giữ trong bộ nhớ
+
+    Các cờ cho phép giả lập server cũ / lỗi: batch_supported=False trả 404 cho /batch,
+    down=True trả 503 (tunnel không tới được server) cho mọi request, fail_next=n chỉ trả
+    503 cho n request tiếp theo (lỗi tạm thời). stream_events bật endpoint SSE
+    MT5_STREAM_PATH: gửi các event rồi giữ kết nối mở cho tới khi stop(). etags=True gửi ETag
+    cho GET và trả 304 khi If-None-Match khớp, compress=True nén gzip khi client chấp nhận.
+    """
+
+    def __init__(self):
+        self.collections = {}  # tên -> {id: dữ liệu}
+        self.calls = []  # (method, path) theo thứ tự nhận
+        self.idempotency_keys = set()
+        self.batch_supported = True
+        self.batch_operations = 0
+        self.batch_id_map = None  # Hàm đổi id trong kết quả /batch (giả lập server chuẩn hóa id)
+        self.discord_status = 200
+        self.down = False
+        self.fail_next = 0
+        self.etags = False
+        self.not_modified = 0  # Số lần trả 304
+        self.compress = False
+        self.delay = 0
+        self.delay_for = None  # Hàm (method, path, body) -> số giây chờ riêng cho từng request
+        self.stream_events = None  # [(event, data)] gửi qua SSE, None: server chưa hỗ trợ stream
+        self.stream_closed = threading.Event()
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def add_documents(self, collection_name, count, **fields):
+        documents = self.collections.setdefault(collection_name, {})
+        for i in range(count):
+            documents[f"doc{i:05d}"] = {'title': f"Doc {i}", 'n': i, **fields}
+
+    def count(self, method, prefix=''):
+        with self.lock:
+            return sum(1 for m, path in self.calls if m == method and path.startswith(prefix))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stream_closed.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, payload, etag=False):
+                body = json.dumps(payload).encode()
+                if etag:
+                    tag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+                    if self.headers.get('If-None-Match') == tag:
+                        with stub.lock:
+                            stub.not_modified += 1
+                        self.send_response(304)
+                        self.send_header('ETag', tag)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                self.send_response(status)
+                if etag:
+                    self.send_header('ETag', tag)
+                if stub.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i, (event, data) in enumerate(stub.stream_events, 1):
+                    chunk = f"id: {i}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode()
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+                stub.stream_closed.wait(30)  # Như server thật: im lặng chờ thay đổi tiếp theo
+                self.wfile.write(b"0\r\n\r\n")
+                self.close_connection = True
+
+            def handle_method(self, method):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                with stub.lock:
+                    stub.calls.append((method, url.path))
+                if method == 'GET' and url.path == client.MT5_STREAM_PATH and stub.stream_events is not None:
+                    return self.stream()
+                delay = stub.delay_for(method, url.path, body) if stub.delay_for else stub.delay
+                if delay:
+                    threading.Event().wait(delay)
+                with stub.lock:
+                    failing = stub.fail_next > 0
+                    stub.fail_next -= failing
+                if stub.down or failing:
+                    return self.reply(503, {'success': False, 'error': 'tunnel offline'})
+                parts = url.path.strip('/').split('/')
+                with stub.lock:
+                    status, payload = stub.route(method, parts, parse_qs(url.query), body, self.headers)
+                self.reply(status, payload, etag=stub.etags and method == 'GET' and status == 200)
+
+            def do_GET(self):
+                self.handle_method('GET')
+
+            def do_POST(self):
+                self.handle_method('POST')
+
+            def do_PUT(self):
+                self.handle_method('PUT')
+
+            def do_DELETE(self):
+                self.handle_method('DELETE')
+
+        return Handler
+
+    def route(self, method, parts, query, body, headers):
+        if parts == ['api', 'health']:
+            return 200, {'status': 'healthy'}
+        if parts == ['api', 'discord', 'test']:
+            if self.discord_status != 200:
+                return self.discord_status, {'success': False, 'error': 'Webhook chưa cấu hình'}
+            return 200, {'success': True, 'message': 'Đã gửi'}
+        if parts == ['api', 'firebase', 'collections']:
+            return 200, {'success': True, 'collections': sorted(self.collections), 'count': len(self.collections)}
+        if parts[:3] == ['api', 'firebase', 'collection'] and len(parts) == 5:
+            documents = self.collections.get(parts[3], {})
+            if parts[4] == 'stats' and method == 'GET':
+                return 200, {'success': True, 'collection': parts[3], 'document_count': len(documents)}
+            if parts[4] == 'documents' and method == 'GET':
+                limit, offset = int(query.get('limit', ['50'])[0]), int(query.get('offset', ['0'])[0])
+                page = [{'id': doc_id, **data} for doc_id, data in sorted(documents.items())][offset:offset + limit]
+                return 200, {'success': True, 'documents': page, 'count': len(documents)}
+            if parts[4] == 'batch' and method == 'POST':
+                if not self.batch_supported:
+                    return 404, {'success': False, 'error': 'Not found'}
+                self.batch_operations += len(body['operations'])
+                results = [self.apply(parts[3], op, upsert=True) for op in body['operations']]
+                if self.batch_id_map:
+                    results = [{**result, 'id': self.batch_id_map(result['id'])} for result in results]
+                return 200, {'success': True, 'results': results}
+        if parts[:3] == ['api', 'firebase', 'document'] and len(parts) == 5:
+            key = headers.get('Idempotency-Key')
+            if key and key in self.idempotency_keys:
+                return 200, {'success': True, 'replayed': True}
+            op = {'op': 'delete' if method == 'DELETE' else 'update', 'id': parts[4], 'data': body}
+            result = self.apply(parts[3], op)
+            if not result['success']:
+                return 404, {'success': False, 'error': result['error']}
+            if key:
+                self.idempotency_keys.add(key)
+            return 200, {'success': True}
+        return 404, {'success': False, 'error': 'Not found'}
+
+    def apply(self, collection_name, op, upsert=False):
+        """Xóa / cập nhật (merge) một document, document chưa có thì báo lỗi (upsert: /batch tạo mới)"""
+        documents = self.collections.setdefault(collection_name, {})
+        if upsert and op['op'] == 'update':
+            documents.setdefault(op['id'], {})
+        if op['id'] not in documents:
+            return {'id': op['id'], 'success': False, 'error': 'Document not found'}
+        if op['op'] == 'delete':
+            del documents[op['id']]
+        else:
+            documents[op['id']].update(op['data'])
+        return {'id': op['id'], 'success': True}
+
+
+@pytest.fixture(autouse=True)
+def client_home(tmp_path, monkeypatch):
+    """Mỗi test dùng thư mục dữ liệu riêng (outbox, checkpoint, offline store)"""
+    monkeypatch.setattr(client, 'CLIENT_DATA_DIR', str(tmp_path / 'home'))
+    return tmp_path / 'home'
+
+
+@pytest.fixture
+def stub():
+    server = StubServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def manager(stub):
+    config_manager = client.ConfigManager(stub.url)
+    yield config_manager
+    config_manager.close()
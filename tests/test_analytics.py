@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+import client
+
+
+def least_squares_slope(points):
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    return (sum((t - mean_t) * (y - mean_y) for t, y in points)
+            / sum((t - mean_t) ** 2 for t, _ in points))
+
+
+def account_event(equity, margin_level=None, reset=False, positions=(), **extra):
+    account = {'equity': equity}
+    if margin_level is not None:
+        account['margin_level'] = margin_level
+    return {'type': 'snapshot' if reset else 'delta', 'reset': reset, 'account': account,
+            'upsert': list(positions), 'closed': [], 'mode': 'stream', **extra}
+
+
+def test_rolling_window_matches_brute_force():
+    rng = random.Random(3)
+    window = client.RollingWindow(30)
+    points, t = [], 1000.0
+    for _ in range(500):
+        t += rng.uniform(0.5, 3)
+        y = rng.uniform(-100, 100)
+        window.add(t, y)
+        points = [(pt, py) for pt, py in points + [(t, y)] if pt >= t - 30]
+        assert len(window) == len(points)
+        assert window.max() == max(py for _, py in points)
+        assert window.last() == y
+        if len(points) >= 2:
+            assert window.slope() == pytest.approx(least_squares_slope(points), rel=1e-6, abs=1e-9)
+
+
+def test_rolling_window_slope_of_a_line():
+    window = client.RollingWindow(100)
+    assert window.slope() is None and window.max() is None
+    for t in range(10):
+        window.add(t, 5 + 2 * t)
+    assert window.slope() == pytest.approx(2)
+    window.add(9, 40)  # Hai điểm cùng thời điểm vẫn tính được
+    assert window.slope() is not None
+
+
+def test_drawdown_and_margin_trend():
+    analytics = client.AccountAnalytics(window=120)
+    analytics.apply(account_event(1000, 500, reset=True), now=0)
+    analytics.apply(account_event(1100, 480), now=30)
+    analytics.apply(account_event(990, 460), now=60)
+    assert analytics.drawdown() == pytest.approx(0.1)
+    assert analytics.max_drawdown == pytest.approx(0.1)
+    snapshot = analytics.snapshot()
+    assert (snapshot['equity'], snapshot['peak_equity'], snapshot['samples']) == (990, 1100, 3)
+    assert snapshot['margin_level_trend'] == pytest.approx(-40)  # -40 điểm % mỗi phút
+
+    analytics.apply(account_event(1045), now=90)
+    assert analytics.drawdown() == pytest.approx(0.05)
+    assert analytics.max_drawdown == pytest.approx(0.1)
+
+    # Đỉnh 1100 ra khỏi cửa sổ 120 giây: drawdown tính theo đỉnh trong cửa sổ, max_drawdown giữ cả phiên
+    analytics.apply(account_event(1045), now=200)
+    assert analytics.equity.max() == 1045 and analytics.drawdown() == 0
+    assert analytics.max_drawdown == pytest.approx(0.1)
+
+
+def test_errors_and_offline_events_do_not_move_metrics():
+    analytics = client.AccountAnalytics()
+    analytics.apply(account_event(1000, reset=True), now=0)
+    analytics.apply({'type': 'error', 'error': 'timeout'})
+    assert analytics.state['error'] == 'timeout' and analytics.updates == 1
+    analytics.apply(account_event(500, mode='offline', cached_at=1.0), now=10)
+    assert analytics.state['account']['equity'] == 500 and 'error' not in analytics.state
+    assert (analytics.equity.last(), analytics.max_drawdown) == (1000, 0.0)
+
+
+def test_positions_and_payload_follow_deltas():
+    analytics = client.AccountAnalytics()
+    positions = [{'ticket': 1, 'symbol': 'EURUSD', 'type': 0, 'volume': 1.0, 'price_open': 1.1, 'profit': -4.0},
+                 {'ticket': 2, 'symbol': 'EURUSD', 'type': 1, 'volume': 0.5, 'price_open': 1.2, 'profit': 2.0}]
+    analytics.apply(account_event(1000, reset=True, positions=positions, timestamp='t1'), now=0)
+    analytics.apply({**account_event(998), 'closed': [2]}, now=1)
+
+    symbols = analytics.symbols()
+    assert symbols == {'EURUSD': {'positions': 1, 'net_volume': 1.0, 'exposure': pytest.approx(1.1),
+                                  'profit': -4.0}}
+    payload = analytics.to_payload()
+    assert payload['account'] == {'equity': 998}
+    assert [pos['ticket'] for pos in payload['positions']] == [1]
+    assert payload['timestamp'] == 't1'
+    assert analytics.snapshot()['largest_losers'] == [(1, -4.0)]
@@ -0,0 +1,38 @@
+import client
+
+
+def test_bulk_uses_batch_endpoint(stub, manager):
+    stub.add_documents('signals', 30)
+    results = manager.bulk_delete_documents('signals', [f"doc{i:05d}" for i in range(25)], batch_size=10)
+
+    assert all(result['success'] for result in results.values()) and len(results) == 25
+    assert stub.count('POST', '/api/firebase/collection/signals/batch') == 3
+    assert stub.count('DELETE') == 0
+    assert len(stub.collections['signals']) == 5
+
+
+def test_bulk_falls_back_to_single_document_requests(stub, manager, capsys):
+    stub.batch_supported = False
+    stub.add_documents('signals', 3)
+    results = manager.bulk_update_documents('signals', {
+        'doc00000': {'status': 'read'},
+        'doc00001': {'status': 'read'},
+        'missing': {'status': 'read'},
+    }, batch_size=10)
+
+    assert results['doc00000'] == {'success': True, 'error': None}
+    assert results['doc00001'] == {'success': True, 'error': None}
+    # Lỗi 4xx lấy từ body server trả về, không bị báo nhầm thành lỗi kết nối
+    assert results['missing'] == {'success': False, 'error': 'Document not found'}
+    assert stub.collections['signals']['doc00001']['status'] == 'read'
+    assert stub.count('POST', '/api/firebase/collection/signals/batch') == 1
+    assert 'Lỗi HTTP' not in capsys.readouterr().out
+
+
+def test_single_document_fallback_reports_connection_errors(stub, manager, monkeypatch):
+    monkeypatch.setattr(client, 'RETRY_MAX_ATTEMPTS', 1)
+    stub.stop()
+
+    result = manager.run(manager.async_manager._send_single('signals', {'op': 'delete', 'id': 'a'}))
+    assert result['success'] is False
+    assert result['error'].startswith('Lỗi kết nối')
@@ -0,0 +1,86 @@
+import client
+
+STATS_PATH = '/api/firebase/collection/signals/stats'
+
+
+def stats(manager):
+    return manager.get_collection_stats('signals')
+
+
+def test_fresh_entry_is_served_without_request(stub, manager):
+    stub.add_documents('signals', 3)
+    first = stats(manager)
+    first['document_count'] = 99
+    assert stats(manager)['document_count'] == 3  # Mỗi lần đọc cache là một bản riêng
+    assert stub.count('GET', STATS_PATH) == 1
+    cache = manager.async_manager.cache
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_expired_entry_is_revalidated_with_etag(stub, manager):
+    stub.etags = True
+    stub.add_documents('signals', 3)
+    cache = manager.async_manager.cache
+    cache.ttls = [('/api/firebase/collection/*/stats', 0)]  # Luôn hỏi lại server
+    manager.async_manager.single_flight.window = 0  # Không dùng lại kết quả vừa nhận
+
+    assert stats(manager)['document_count'] == 3
+    assert stats(manager)['document_count'] == 3
+    assert stub.count('GET', STATS_PATH) == 2
+    assert (stub.not_modified, cache.revalidated, cache.misses) == (1, 1, 1)
+
+    stub.add_documents('signals', 5)
+    assert stats(manager)['document_count'] == 5
+    assert (stub.not_modified, cache.misses) == (1, 2)
+
+
+def test_writes_invalidate_collection_entries(stub, manager):
+    stub.add_documents('signals', 3)
+    assert stats(manager)['document_count'] == 3
+    manager.delete_document('signals', 'doc00000')
+    assert stats(manager)['document_count'] == 2
+    assert stub.count('GET', STATS_PATH) == 2
+
+
+def test_uncached_endpoints_are_not_stored(stub, manager):
+    stub.add_documents('signals', 3)
+    cache = manager.async_manager.cache
+    cache.ttls = []
+    stats(manager)
+    assert cache.get(STATS_PATH) is None and cache.total_bytes == 0
+
+
+def test_ttl_patterns_ignore_query_string():
+    cache = client.ResponseCache(ttls=[('/api/firebase/collection/*/documents', 30), ('/api/mt5-account-info', 0)])
+    assert cache.ttl_for('/api/firebase/collection/signals/documents?limit=10&offset=20') == 30
+    assert cache.ttl_for('/api/mt5-account-info') == 0
+    assert cache.ttl_for('/api/firebase/collection/signals/stats') is None
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    cache = client.ResponseCache(ttls=[], max_bytes=14)
+    headers = {'ETag': '"a"', 'Content-Type': 'application/json'}
+    cache.put('/a', b'[1, 2]', headers, 60)
+    cache.put('/b', b'[3, 4]', headers, 60)
+    cache.get('/a')  # /a vừa được dùng, /b bị loại trước
+    cache.put('/c', b'[5]', headers, 60)
+    assert cache.get('/b') is None
+    assert cache.get('/a').json() == [1, 2] and cache.get('/c').json() == [5]
+    assert cache.total_bytes == len(b'[1, 2]') + len(b'[5]')
+    assert cache.get('/a').validators() == {'If-None-Match': '"a"'}
+
+
+def test_no_store_and_oversized_bodies_are_skipped():
+    cache = client.ResponseCache(ttls=[], max_bytes=10)
+    cache.put('/private', b'{}', {'Cache-Control': 'private, no-store'}, 60)
+    cache.put('/big', b'[' + b'1, ' * 10 + b'1]', {}, 60)
+    assert cache.get('/private') is None and cache.get('/big') is None
+    assert cache.total_bytes == 0
+
+
+def test_touch_extends_revalidated_entry():
+    cache = client.ResponseCache(ttls=[])
+    cache.put('/a', b'{}', {'ETag': '"a"'}, 0)
+    assert not cache.get('/a').is_fresh()
+    cache.touch('/a', 60)
+    assert cache.get('/a').is_fresh()
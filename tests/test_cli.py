@@ -0,0 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import client
+
+CLIENT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'client.py')
+
+
+@pytest.fixture
+def cli(stub, client_home):
+    """Chạy client.py như từ dòng lệnh, trả về (mã thoát, stdout)"""
+    def run(*args, url=None, stdin=None):
+        env = {**os.environ, 'MT5_CLIENT_HOME': str(client_home)}
+        process = subprocess.run([sys.executable, CLIENT_PATH, '--url', url or stub.url, *args], input=stdin,
+                                 capture_output=True, text=True, env=env, timeout=60)
+        return process.returncode, process.stdout
+    return run
+
+
+def test_cli_success_prints_json(stub, cli):
+    stub.add_documents('signals', 3)
+    code, stdout = cli('stats', 'signals')
+    assert code == client.CLI_EXIT_OK
+    assert json.loads(stdout)['document_count'] == 3
+
+
+def test_cli_discord_failure_exits_nonzero(stub, cli):
+    assert cli('discord', 'hello')[0] == client.CLI_EXIT_OK
+    stub.discord_status = 500
+    assert cli('discord', 'hello')[0] == client.CLI_EXIT_FAILED
+
+
+def test_cli_usage_error(cli):
+    assert cli('no-such-command')[0] == client.CLI_EXIT_USAGE
+    assert cli('stats')[0] == client.CLI_EXIT_USAGE
+
+
+def test_cli_offline_data_and_dead_server(stub, cli):
+    stub.add_documents('signals', 3)
+    assert cli('stats', 'signals')[0] == client.CLI_EXIT_OK
+    stub.stop()
+    # Đã có dữ liệu lưu trên máy từ lần chạy trước: trả về kèm 'offline'
+    code, stdout = cli('stats', 'signals')
+    assert code == client.CLI_EXIT_OFFLINE
+    assert json.loads(stdout)['offline'] is True
+    assert cli('stats', 'news')[0] == client.CLI_EXIT_FAILED
+
+
+def test_cli_batch_returns_worst_exit_code(stub, cli):
+    stub.add_documents('signals', 3)
+    stub.discord_status = 500
+    code, stdout = cli('batch', '-', stdin="stats signals\n# bỏ qua\ndiscord hi\nstats\n")
+    records = {record['line']: record for record in map(json.loads, stdout.splitlines())}
+    assert code == client.CLI_EXIT_USAGE
+    assert {line: record['exit_code'] for line, record in records.items()} == {
+        1: client.CLI_EXIT_OK, 3: client.CLI_EXIT_FAILED, 4: client.CLI_EXIT_USAGE}
+
+
+def test_cli_exit_code_values():
+    assert client.cli_exit_code(None) == client.CLI_EXIT_FAILED
+    assert client.cli_exit_code((False, 'Webhook lỗi')) == client.CLI_EXIT_FAILED
+    assert client.cli_exit_code((True, 'Đã gửi')) == client.CLI_EXIT_OK
+    assert client.cli_exit_code({'success': True, 'queued': True}) == client.CLI_EXIT_OFFLINE
+    assert client.cli_exit_code({'a': {'success': True}, 'b': {'success': False}}) == client.CLI_EXIT_FAILED
+    assert client.cli_exit_code([]) == client.CLI_EXIT_OK
@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+import threading
+
+import client
+
+
+def read_ids(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line)['id'] for line in f]
+
+
+def test_export_resumes_after_stop(stub, manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(client, 'EXPORT_CHECKPOINT_DOCUMENTS', 20)
+    stub.add_documents('signals', 95)
+    path = str(tmp_path / 'signals.ndjson.gz')
+    stop = threading.Event()
+
+    def progress(stats):
+        if stats['documents'] >= 40:
+            stop.set()
+
+    first = manager.export_collection('signals', path, page_size=10, prefetch=2, progress=progress, stop_event=stop)
+    assert first['completed'] is False
+    assert os.path.exists(f"{path}.checkpoint")
+    exported = len(read_ids(path))
+    assert 0 < exported < 95
+
+    second = manager.export_collection('signals', path, page_size=10, prefetch=2)
+    assert second['completed'] is True
+    assert second['resumed_from'] == exported
+    ids = read_ids(path)
+    assert ids == sorted(stub.collections['signals'])
+    assert not os.path.exists(f"{path}.checkpoint")
+
+
+def test_export_keeps_checkpoint_when_server_drops(stub, manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(client, 'EXPORT_CHECKPOINT_DOCUMENTS', 10)
+    monkeypatch.setattr(client, 'RETRY_MAX_ATTEMPTS', 1)
+    stub.add_documents('signals', 60)
+    path = str(tmp_path / 'signals.ndjson.gz')
+
+    def progress(stats):
+        if stats['documents'] >= 30:
+            stub.down = True
+
+    first = manager.export_collection('signals', path, page_size=10, prefetch=0, progress=progress)
+    assert first['success'] is False
+    assert os.path.exists(f"{path}.checkpoint")
+
+    stub.down = False
+    second = manager.export_collection('signals', path, page_size=10, prefetch=0)
+    assert second['completed'] is True
+    assert read_ids(path) == sorted(stub.collections['signals'])
+
+
+def test_export_without_resume_starts_over(stub, manager, tmp_path):
+    stub.add_documents('signals', 25)
+    path = str(tmp_path / 'signals.ndjson.gz')
+    stop = threading.Event()
+    stop.set()
+    manager.export_collection('signals', path, page_size=10, stop_event=stop)
+
+    result = manager.export_collection('signals', path, page_size=10, resume=False)
+    assert result['resumed_from'] == 0
+    assert len(read_ids(path)) == 25
+
+
+def test_export_closes_writer_when_writing_fails(stub, manager, tmp_path, monkeypatch):
+    stub.add_documents('signals', 30)
+    path = str(tmp_path / 'signals.ndjson.gz')
+    writers = []
+    original_write = client.NdjsonExportWriter.write
+
+    def failing_write(self, documents):
+        writers.append(self)
+        if len(writers) == 2:
+            raise OSError('No space left on device')
+        return original_write(self, documents)
+
+    monkeypatch.setattr(client.NdjsonExportWriter, 'write', failing_write)
+    result = manager.export_collection('signals', path, page_size=10)
+    assert result['success'] is False
+    assert writers[0]._raw.closed
+
+    monkeypatch.setattr(client.NdjsonExportWriter, 'write', original_write)
+    assert manager.export_collection('signals', path, page_size=10)['completed'] is True
+    assert read_ids(path) == sorted(stub.collections['signals'])
@@ -0,0 +1,102 @@
+import math
+import random
+import threading
+import time
+
+import client
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_health_monitor_probes_and_records_status(stub, manager):
+    manager.health.start()
+    assert manager.health.first_probe.wait(5)
+    assert manager.health.status == 'online'
+    assert manager.health.error_rate() == 0
+
+    stub.down = True
+    probes = manager.health.probes
+    manager.health.probe_now()
+    assert wait_until(lambda: manager.health.probes > probes)
+    assert manager.health.status == 'offline'
+    manager.health.stop()
+
+
+def test_health_monitor_restarts_after_stop(stub, manager):
+    health = manager.health.start()
+    assert wait_until(lambda: health.probes >= 1)
+    health.stop()
+    assert wait_until(lambda: not health._thread.is_alive())
+    probes = health.probes
+
+    health.start()
+    assert wait_until(lambda: health.probes > probes)
+    health.probe_now()
+    assert wait_until(lambda: health.probes > probes + 1)
+    health.stop()
+
+
+def test_health_monitor_restart_while_probe_in_flight(stub, manager):
+    health = manager.health.start()
+    assert wait_until(lambda: health.probes >= 1)
+    stub.delay = 0.3
+    health.probe_now()
+    time.sleep(0.05)  # Thread cũ đang chờ response
+    health.stop()
+    health.start()
+    stub.delay = 0
+
+    # Thread cũ dừng sau probe dở, chỉ còn một thread probe
+    assert wait_until(lambda: sum(thread.name == 'health-monitor' and thread.is_alive()
+                                  for thread in threading.enumerate()) == 1)
+    probes = health.probes
+    health.probe_now()
+    assert wait_until(lambda: health.probes > probes)
+    health.stop()
+
+
+
+def test_latency_percentiles_within_bucket_error():
+    rng = random.Random(11)
+    histogram = client.LatencyHistogram()
+    values = [rng.lognormvariate(3, 1.5) for _ in range(20000)] + [rng.uniform(0, 1) for _ in range(2000)]
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    error = 1 / client.LATENCY_SUB_BUCKETS
+    for p in (1, 50, 90, 95, 99, 99.9, 100):
+        exact = values[max(1, math.ceil(len(values) * p / 100)) - 1]
+        estimate = histogram.percentile(p)
+        assert exact <= estimate <= max(exact * (1 + error), exact + error) + 1e-9, p
+    assert histogram.percentile(100) == values[-1]
+
+
+def test_latency_bucket_bounds_cover_values():
+    histogram = client.LatencyHistogram()
+    for value in [0, 0.01, 0.999, 1, 1.5, 2, 3.99, 4, 1000, 2 ** 20 + 1]:
+        index = histogram._index(value)
+        assert value < histogram._upper(index) <= max(value * (1 + 2 / histogram.sub_buckets), 1 / 16)
+        assert index == 0 or histogram._upper(index - 1) <= value
+
+
+def test_latency_summary_and_request_timing(stub, manager):
+    histogram = client.LatencyHistogram()
+    assert histogram.percentile(50) is None and histogram.summary()['mean'] is None
+    for value in (1, 2, 3, 4):
+        histogram.record(value)
+    summary = histogram.summary()
+    assert (summary['count'], summary['min'], summary['max'], summary['mean']) == (4, 1, 4, 2.5)
+    assert summary['p50'] == 2 * (1 + 1 / 16) and summary['p99'] == 4  # Không vượt quá max
+
+    stub.delay = 0.05
+    latency = manager.async_manager.latency
+    count = latency.count
+    manager.test_connection()
+    assert latency.count == count + 1 and latency.max >= 50
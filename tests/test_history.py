@@ -0,0 +1,88 @@
+import random
+import time
+
+import pytest
+
+import client
+
+DAY = 86400
+
+
+@pytest.fixture
+def store(tmp_path):
+    history = client.TimeSeriesStore(str(tmp_path / 'history.sqlite3'))
+    yield history
+    history.close()
+
+
+@pytest.fixture
+def start():
+    """Đầu một giờ gần đây: mọi bucket gộp đều trọn vẹn và còn trong thời gian giữ"""
+    return (time.time() // 3600 - 3) * 3600
+
+
+def test_rollups_match_raw_samples(store, start):
+    rng = random.Random(5)
+    samples = []
+    for i in range(720):  # Hai giờ, mỗi mẫu cách 10 giây
+        ts, equity = start + i * 10, round(rng.uniform(900, 1100), 2)
+        assert store.record({'equity': equity, 'balance': 1000}, positions=3, ts=ts)
+        samples.append((ts, equity))
+    end = start + 7200
+
+    assert store.query('equity', start, end, resolution=0) == samples
+    for resolution in client.HISTORY_RESOLUTIONS:
+        buckets = {}
+        for ts, equity in samples:
+            buckets.setdefault(int(ts // resolution) * resolution, []).append(equity)
+        expected = [(bucket, pytest.approx(sum(values) / len(values))) for bucket, values in sorted(buckets.items())]
+        assert store.query('equity', start, end - 1, resolution=resolution) == expected
+
+    summary = store.summary('equity', start, end)
+    values = [equity for _, equity in samples]
+    assert (summary['min'], summary['max'], summary['first'], summary['last']) == (
+        min(values), max(values), values[0], values[-1])
+    assert store.query('positions', start, start + 60, resolution=0)[0] == (start, 3.0)
+
+
+def test_unchanged_values_are_written_only_on_heartbeat(store, start):
+    account = {'equity': 1000.0}
+    assert store.record(account, ts=start)
+    assert not store.record({'equity': 1001.0}, ts=start + client.HISTORY_MIN_INTERVAL - 1)
+    assert not store.record(account, ts=start + 30)
+    assert store.record(account, ts=start + client.HISTORY_HEARTBEAT)
+    assert store.record({'equity': 1002.0}, ts=start + client.HISTORY_HEARTBEAT + client.HISTORY_MIN_INTERVAL)
+    assert not store.record({'equity': True, 'balance': None})
+    assert len(store.query('equity', start, start + 3600, resolution=0)) == 3
+
+
+def test_pick_resolution_uses_finest_level_that_fits():
+    store = client.TimeSeriesStore.__new__(client.TimeSeriesStore)  # Không cần database
+    now = 100 * DAY
+    assert store.pick_resolution(now - 1800, now, now=now) == 0
+    assert store.pick_resolution(now - 3600, now, now=now) == 60  # 720 mẫu gốc > HISTORY_MAX_POINTS
+    assert store.pick_resolution(now - DAY, now, now=now) == 300
+    assert store.pick_resolution(now - 3 * DAY, now, max_points=5000, now=now) == 60
+    # Mẫu gốc chỉ giữ 7 ngày, bucket 1 phút giữ 30 ngày
+    assert store.pick_resolution(now - 10 * DAY, now - 9 * DAY, max_points=10 ** 6, now=now) == 60
+    assert store.pick_resolution(now - 40 * DAY, now - 39 * DAY, max_points=10 ** 6, now=now) == 300
+
+
+def test_pruned_samples_fall_back_to_rollups(store):
+    now = time.time()
+    old = now - 8 * DAY
+    store.record({'equity': 900.0}, ts=old)
+    store.record({'equity': 950.0}, ts=old + 20)
+    store.prune(now)
+    assert store.query('equity', old - 60, old + 60, resolution=0) == []
+    assert store.value_at('equity', old + 30) == 950.0
+    assert store.query('equity', old - 60, old + 60, resolution=60)[-1][1] == pytest.approx(925.0)
+
+
+def test_compare_reports_percentage_change(store, start):
+    store.record({'equity': 1000.0}, ts=start)
+    store.record({'equity': 1100.0}, ts=start + 3600)
+    assert store.compare('equity', 3600, now=start + 3600) == (1100.0, 1000.0, pytest.approx(10.0))
+    assert store.compare('equity', 3600, now=start + 1800) == (1000.0, None, None)
+    with pytest.raises(ValueError):
+        store.query('equity; DROP TABLE samples', start)
@@ -0,0 +1,101 @@
+import builtins
+import gzip
+import json
+import os
+import threading
+import time
+
+import client
+
+
+def write_ndjson(path, records, compress=False):
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return str(path)
+
+
+def records(count):
+    return [{'id': f"doc{i:05d}", 'title': f"Doc {i}", 'n': i} for i in range(count)]
+
+
+def test_import_resumes_after_stop_without_resending(stub, manager, tmp_path):
+    path = write_ndjson(tmp_path / 'signals.ndjson.gz', records(120), compress=True)
+    stop = threading.Event()
+
+    def progress(stats):
+        if stats['offset'] >= 40:
+            stop.set()
+
+    first = manager.import_documents('signals', path, batch_size=10, concurrency=2, rate=0,
+                                     progress=progress, stop_event=stop)
+    assert first['completed'] is False
+    assert 40 <= first['offset'] < 120
+
+    second = manager.import_documents('signals', path, batch_size=10, concurrency=2, rate=0)
+    assert second['completed'] is True
+    assert second['resumed_from'] == first['offset']
+    assert second['imported'] == 120
+    assert sorted(stub.collections['signals']) == [record['id'] for record in records(120)]
+    assert stub.batch_operations == 120  # Phần đã nhập trước khi dừng không bị gửi lại
+
+
+def test_import_closes_gzip_source(stub, manager, tmp_path, monkeypatch):
+    path = write_ndjson(tmp_path / 'signals.ndjson.gz', records(5), compress=True)
+    opened = []
+
+    def tracking_open(*args, **kwargs):
+        f = builtins.open(*args, **kwargs)
+        opened.append(f)
+        return f
+
+    monkeypatch.setattr(client, 'open', tracking_open, raising=False)
+    result = manager.import_documents('signals', path, rate=0)
+    assert result['completed'] is True
+    assert opened and all(f.closed for f in opened)
+
+
+def test_import_rejects_invalid_records(stub, manager, tmp_path):
+    path = write_ndjson(tmp_path / 'signals.ndjson', [
+        {'id': 'a', 'n': 1},
+        {'n': 2},
+        {'id': 'b/c', 'n': 3},
+        {'id': 'd', 'n': 4},
+    ])
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{không phải json\n')
+
+    result = manager.import_documents('signals', path, rate=0)
+    assert result['completed'] is True
+    assert (result['imported'], result['rejected']) == (2, 3)
+    assert [error['record'] for error in result['errors']] == [2, 3, 5]
+    with open(result['rejects_path'], encoding='utf-8') as f:
+        assert [json.loads(line)['record'] for line in f] == [2, 3, 5]
+
+
+def test_import_counts_unknown_batch_ids_as_failed(stub, manager, tmp_path):
+    stub.batch_id_map = str.upper  # Server trả id đã chuẩn hóa, không khớp id đã gửi
+    path = write_ndjson(tmp_path / 'signals.ndjson', records(15))
+
+    result = manager.import_documents('signals', path, batch_size=10, rate=0)
+    assert result['completed'] is True
+    assert (result['imported'], result['failed']) == (0, 15)
+    assert os.path.exists(result['rejects_path'])
+
+
+def test_import_waits_for_slow_head_batch_without_spinning(stub, manager, tmp_path):
+    path = write_ndjson(tmp_path / 'signals.ndjson', records(30))
+
+    def delay_for(method, path, body):
+        # Batch đầu tiên chậm, các batch sau xong ngay
+        return 1.0 if method == 'POST' and body['operations'][0]['id'] == 'doc00000' else 0
+
+    stub.delay_for = delay_for
+    started, cpu_started = time.monotonic(), time.process_time()
+    result = manager.import_documents('signals', path, batch_size=5, concurrency=3, rate=0)
+    elapsed, cpu = time.monotonic() - started, time.process_time() - cpu_started
+
+    assert result['completed'] is True and result['imported'] == 30
+    assert elapsed >= 1.0
+    assert cpu < 0.5 * elapsed
@@ -0,0 +1,33 @@
+import time
+
+
+def wait_for_job(manager, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = manager.get_job_status(job_id)
+        if job['state'] not in ('queued', 'running') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def test_local_clear_job_deletes_in_batches(stub, manager):
+    stub.add_documents('signals', 45)
+    job = manager.start_clear_job('signals', batch_size=10)  # Server chưa có /jobs: job chạy phía client
+    assert job['mode'] == 'local'
+
+    job = wait_for_job(manager, job['id'])
+    assert (job['state'], job['deleted'], job['total']) == ('completed', 45, 45)
+    assert stub.collections['signals'] == {}
+
+
+def test_local_clear_job_ignores_stored_pages_while_offline(stub, manager):
+    stub.add_documents('signals', 25)
+    assert manager.get_collection_documents('signals', 10, 0)['count'] == 25  # Lưu trang đầu xuống máy
+    assert manager.get_collection_stats('signals')['document_count'] == 25
+    for i in range(10):  # Trang đã lưu trở nên cũ: các documents này đã bị xóa trên server
+        del stub.collections['signals'][f"doc{i:05d}"]
+    manager.async_manager.online = False
+
+    job = wait_for_job(manager, manager.start_clear_job('signals', batch_size=10)['id'])
+    assert (job['state'], job['deleted'], job['error']) == ('completed', 15, None)
+    assert stub.collections['signals'] == {}
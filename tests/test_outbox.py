@@ -0,0 +1,65 @@
+import client
+
+
+def test_outbox_merges_updates_and_drops_updates_before_delete(tmp_path):
+    outbox = client.MutationOutbox(str(tmp_path / 'outbox.jsonl'))
+    first = outbox.enqueue({'op': 'update', 'collection': 'signals', 'id': 'a', 'data': {'x': 1}})
+    merged = outbox.enqueue({'op': 'update', 'collection': 'signals', 'id': 'a', 'data': {'y': 2}})
+    outbox.enqueue({'op': 'update', 'collection': 'signals', 'id': 'b', 'data': {'x': 1}})
+    outbox.enqueue({'op': 'delete', 'collection': 'signals', 'id': 'b'})
+
+    assert merged == first
+    ops = list(outbox.pending.values())
+    assert [(op['op'], op['id']) for op in ops] == [('update', 'a'), ('delete', 'b')]
+    assert ops[0]['data'] == {'x': 1, 'y': 2}
+
+
+def test_outbox_rebuilds_from_journal_and_skips_torn_line(tmp_path):
+    path = str(tmp_path / 'outbox.jsonl')
+    outbox = client.MutationOutbox(path)
+    done = outbox.enqueue({'op': 'delete', 'collection': 'signals', 'id': 'a'})
+    outbox.enqueue({'op': 'update', 'collection': 'signals', 'id': 'b', 'data': {'x': 1}})
+    outbox.enqueue({'op': 'update', 'collection': 'signals', 'id': 'b', 'data': {'y': 2}})
+    outbox.next()
+    outbox.complete(done)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"t": "add", "key": "torn"')  # Ghi dở khi tắt máy
+
+    reloaded = client.MutationOutbox(path)
+    assert [(op['op'], op['id'], op.get('data')) for op in reloaded.pending.values()] == [
+        ('update', 'b', {'x': 1, 'y': 2})]
+
+
+def test_offline_mutations_are_queued_and_replayed_in_order(stub, manager, monkeypatch):
+    monkeypatch.setattr(client, 'RETRY_MAX_ATTEMPTS', 1)
+    stub.add_documents('signals', 3)
+    stub.down = True
+
+    assert manager.update_document('signals', 'doc00000', {'status': 'read'})['queued'] is True
+    assert manager.update_document('signals', 'doc00000', {'seen': 1})['queued'] is True
+    assert manager.delete_document('signals', 'doc00001')['queued'] is True
+    assert manager.outbox_status()['pending'] == 2
+
+    # Vẫn mất kết nối: thao tác giữ nguyên trong hàng đợi
+    assert manager.replay_outbox()['pending'] == 2
+
+    stub.down = False
+    status = manager.replay_outbox()
+    assert (status['pending'], status['replayed'], status['failed']) == (0, 2, 0)
+    assert stub.collections['signals']['doc00000'] == {'title': 'Doc 0', 'n': 0, 'status': 'read', 'seen': 1}
+    assert 'doc00001' not in stub.collections['signals']
+    assert stub.count('PUT') == 3  # 2 lần thất bại khi offline (chưa gộp) + 1 lần gửi lại đã gộp
+
+
+def test_replay_drops_operations_the_server_rejects(stub, manager, monkeypatch):
+    monkeypatch.setattr(client, 'RETRY_MAX_ATTEMPTS', 1)
+    stub.add_documents('signals', 1)
+    stub.down = True
+    manager.update_document('signals', 'missing', {'x': 1})
+    manager.update_document('signals', 'doc00000', {'x': 1})
+
+    stub.down = False
+    status = manager.replay_outbox()
+    assert (status['pending'], status['failed']) == (0, 1)
+    assert manager.async_manager.outbox.failed[0]['id'] == 'missing'
+    assert stub.collections['signals']['doc00000']['x'] == 1
@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+import client
+
+SYMBOLS = ['EURUSD', 'XAUUSD', 'BTCUSD']
+
+
+def position(ticket, symbol='EURUSD', type=0, volume=1.0, price_open=1.1, profit=0.0):
+    return {'ticket': ticket, 'symbol': symbol, 'type': type, 'volume': volume, 'price_open': price_open,
+            'profit': profit, 'comment': f"#{ticket}"}
+
+
+def expected_totals(positions):
+    """Tính lại các tổng từ đầu để so với các tổng cộng dồn của PositionBook"""
+    totals = {'total_profit': 0.0, 'long_volume': 0.0, 'short_volume': 0.0, 'winners': 0, 'losers': 0,
+              'counts': {}, 'net': {}, 'profit': {}, 'exposure': {}}
+    for pos in positions.values():
+        net = pos['volume'] if pos['type'] == 0 else -pos['volume']
+        totals['total_profit'] += pos['profit']
+        totals['long_volume' if pos['type'] == 0 else 'short_volume'] += pos['volume']
+        totals['winners'] += pos['profit'] > 0
+        totals['losers'] += pos['profit'] < 0
+        symbol = pos['symbol']
+        totals['counts'][symbol] = totals['counts'].get(symbol, 0) + 1
+        totals['net'][symbol] = totals['net'].get(symbol, 0.0) + net
+        totals['profit'][symbol] = totals['profit'].get(symbol, 0.0) + pos['profit']
+        totals['exposure'][symbol] = totals['exposure'].get(symbol, 0.0) + net * pos['price_open']
+    return totals
+
+
+def assert_matches(book, positions):
+    totals = expected_totals(positions)
+    assert len(book) == len(positions)
+    assert book.sorted_positions() == [positions[ticket] for ticket in sorted(positions, key=str)]
+    assert book.total_profit == pytest.approx(totals['total_profit'])
+    assert book.long_volume == pytest.approx(totals['long_volume'])
+    assert book.short_volume == pytest.approx(totals['short_volume'])
+    assert (book.winners, book.losers) == (totals['winners'], totals['losers'])
+    assert book.symbol_counts == totals['counts']
+    for symbol in totals['counts']:
+        assert book.symbol_net_volume[symbol] == pytest.approx(totals['net'][symbol])
+        assert book.symbol_profit[symbol] == pytest.approx(totals['profit'][symbol])
+        assert book.symbol_exposure[symbol] == pytest.approx(totals['exposure'][symbol])
+    assert set(book.symbol_net_volume) == set(book.symbol_exposure) == set(totals['counts'])
+
+
+def test_random_updates_keep_totals_consistent():
+    rng = random.Random(7)
+    book, positions = client.PositionBook(), {}
+    for _ in range(2000):
+        ticket = rng.randrange(200)
+        if ticket in positions and rng.random() < 0.3:
+            assert book.remove(ticket)
+            del positions[ticket]
+        elif ticket in positions:
+            change = {'ticket': ticket, 'profit': round(rng.uniform(-50, 50), 2)}
+            if rng.random() < 0.2:
+                change['volume'] = rng.choice([0.01, 0.1, 1.0])
+            book.upsert(change)
+            positions[ticket].update(change)
+        else:
+            positions[ticket] = position(ticket, rng.choice(SYMBOLS), rng.randrange(2), rng.choice([0.01, 0.1, 1.0]),
+                                         rng.uniform(1, 100), round(rng.uniform(-50, 50), 2))
+            book.upsert(dict(positions[ticket]))
+    assert_matches(book, positions)
+
+
+def test_remove_moves_last_row_into_gap():
+    book = client.PositionBook()
+    for ticket in (1, 2, 3):
+        book.upsert(position(ticket, profit=ticket))
+    assert book.remove(1) and not book.remove(1)
+    assert book.tickets == [3, 2]
+    assert book.position(3)['profit'] == 3 and 1 not in book
+    assert book.summary()['total_positions'] == 2
+
+
+def test_apply_delta_reports_changed_tickets():
+    book = client.PositionBook()
+    assert book.apply({'reset': True, 'upsert': [position(1), position(2)], 'closed': []}) == {1, 2}
+    assert book.apply({'upsert': [{'ticket': 2, 'profit': 5.0}], 'closed': [1, 99]}) == {1, 2}
+    assert book.apply({'reset': True, 'upsert': [position(3)]}) == {2, 3}
+    assert book.tickets == [3]
+
+
+def test_formatted_rows_are_cached_until_position_changes():
+    book = client.PositionBook()
+    book.upsert(position(1, profit=1.0))
+    book.upsert(position(2, profit=2.0))
+    first = book.formatted_rows()
+    assert book.formatted_rows()[0] is first[0]
+    book.upsert({'ticket': 2, 'profit': -3.0})
+    second = book.formatted_rows()
+    assert second[0] is first[0] and second[1] != first[1]
+
+
+def test_largest_winners_and_losers():
+    book = client.PositionBook()
+    for ticket, profit in enumerate([-5.0, 3.0, -1.0, 0.0, 8.0]):
+        book.upsert(position(ticket, profit=profit))
+    assert book.largest(2) == [(0, -5.0), (2, -1.0)]
+    assert book.largest(5, losers=False) == [(4, 8.0), (1, 3.0)]
+    assert book.net_volume() == pytest.approx(5.0)
@@ -0,0 +1,50 @@
+import client
+
+DOCUMENTS_PATH = '/api/firebase/collection/signals/documents'
+
+
+def test_local_query_pages_filter_with_one_scan(stub, manager):
+    stub.add_documents('signals', 1000)
+    iterator = manager.iter_collection_documents('signals', page_size=20, prefetch=3, where=[('n', '>=', 900)])
+    ids = [doc['id'] for doc in iterator]
+
+    assert ids == [f"doc{i:05d}" for i in range(900, 1000)]
+    assert stub.count('POST', '/api/firebase/collection/signals/query') == 1  # Server chưa có /query
+    # Một lượt đọc collection (1000 documents / trang 100 + trang rỗng cuối), không quét lại mỗi trang
+    assert stub.count('GET', DOCUMENTS_PATH) == 11
+
+
+def test_local_query_sorts_with_one_scan(stub, manager):
+    stub.add_documents('signals', 450)
+    iterator = manager.iter_collection_documents('signals', page_size=25, order_by='-n', select=['n'])
+    documents = list(iterator)
+
+    assert [doc['n'] for doc in documents] == list(range(449, -1, -1))
+    assert set(documents[0]) == {'id', 'n'}
+    assert stub.count('GET', DOCUMENTS_PATH) == 5
+    assert iterator.total == 450
+
+
+def test_single_local_query_limit_and_offset(stub, manager):
+    stub.add_documents('signals', 300)
+    result = manager.query_collection('signals', where=[('n', '<', 250)], order_by='-n', limit=5, offset=10)
+    assert [doc['n'] for doc in result['documents']] == [239, 238, 237, 236, 235]
+    assert result['pushdown'] is False
+
+
+def test_local_query_respects_offline_flag(stub, manager):
+    stub.add_documents('signals', 30)
+    where = [('n', '<', 10)]
+    assert len(list(manager.iter_collection_documents('signals', where=where))) == 10  # Lưu trang xuống máy
+
+    stub.collections['signals'] = {}
+    manager.async_manager.online = False
+    # Mặc định (offline-first): dùng trang đã lưu và đánh dấu dữ liệu cũ
+    iterator = manager.iter_collection_documents('signals', where=where)
+    assert len(list(iterator)) == 10
+    assert iterator.cached_at is not None
+
+    # offline=False (export, job xóa): luôn hỏi server
+    iterator = client.DocumentIterator(manager, 'signals', where=where, offline=False)
+    assert list(iterator) == []
+    assert iterator.cached_at is None
@@ -0,0 +1,106 @@
+import random
+import time
+
+import pytest
+
+import client
+
+STATS_PATH = '/api/firebase/collection/signals/stats'
+DOCUMENT_PATH = '/api/firebase/document/signals/doc00000'
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Bỏ thời gian chờ giữa các lần retry, ghi lại attempt của từng lần chờ"""
+    attempts = []
+
+    def no_delay(attempt):
+        attempts.append(attempt)
+        return 0
+
+    monkeypatch.setattr(client, 'backoff_delay', no_delay)
+    return attempts
+
+
+def request(manager, method, path, **kwargs):
+    return manager.run(manager.async_manager._request(method, path, coalesce=False, **kwargs))
+
+
+def test_get_retries_transient_errors(stub, manager, backoffs):
+    stub.add_documents('signals', 3)
+    stub.fail_next = 2
+    assert manager.get_collection_stats('signals')['document_count'] == 3
+    assert stub.count('GET', STATS_PATH) == 3
+    assert backoffs == [0, 1]
+
+
+def test_get_gives_up_after_max_attempts(stub, manager, backoffs):
+    stub.fail_next = 10
+    assert request(manager, 'GET', '/api/health').status_code == 503
+    assert stub.count('GET', '/api/health') == client.RETRY_MAX_ATTEMPTS
+
+
+def test_writes_that_reached_the_server_are_not_retried(stub, manager, backoffs):
+    stub.add_documents('signals', 1)
+    stub.fail_next = 1
+    assert request(manager, 'PUT', DOCUMENT_PATH, json={'n': 1}).status_code == 503
+    assert stub.count('PUT') == 1
+
+    stub.fail_next = 1
+    assert request(manager, 'PUT', DOCUMENT_PATH, idempotent=True, json={'n': 2}).status_code == 200
+    assert stub.count('PUT') == 3
+    assert stub.collections['signals']['doc00000']['n'] == 2
+
+
+def test_writes_that_never_connected_are_retried(stub, manager, backoffs):
+    stub.stop()
+    with pytest.raises(client.requests.exceptions.ConnectionError):
+        request(manager, 'PUT', DOCUMENT_PATH, json={'n': 1})
+    assert backoffs == list(range(client.RETRY_MAX_ATTEMPTS - 1))
+
+
+def test_retry_budget_caps_retries(stub, manager, backoffs):
+    manager.async_manager.retry_budget = client.RetryBudget(ratio=0, min_tokens=1)
+    stub.fail_next = 10
+    request(manager, 'GET', '/api/health')
+    request(manager, 'GET', '/api/health')
+    assert stub.count('GET', '/api/health') == 3  # Chỉ còn một lượt retry cho cả hai request
+
+
+def test_retry_budget_refills_with_traffic():
+    budget = client.RetryBudget(ratio=0.5, min_tokens=1)
+    assert budget.try_withdraw() and not budget.try_withdraw()
+    budget.deposit()
+    assert not budget.try_withdraw()
+    budget.deposit()
+    assert budget.try_withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == budget.max_tokens
+
+
+def test_read_timeout_comes_from_endpoint_class(stub, manager, monkeypatch):
+    monkeypatch.setattr(client, 'RETRY_MAX_ATTEMPTS', 1)
+    monkeypatch.setitem(client.ENDPOINT_TIMEOUTS, 'read', (1, 0.2))
+    stub.add_documents('signals', 1)
+    stub.delay = 1
+    started = time.monotonic()
+    assert manager.run(manager.async_manager.get_collection_stats('signals')) is None
+    assert time.monotonic() - started < 0.9
+
+
+def test_endpoint_classes():
+    assert client.endpoint_class('GET', '/api/health') == 'health'
+    assert client.endpoint_class('GET', client.MT5_STREAM_PATH) == 'stream'
+    assert client.endpoint_class('DELETE', '/api/firebase/collection/signals/clear') == 'bulk'
+    assert client.endpoint_class('GET', STATS_PATH) == 'read'
+    assert client.endpoint_class('PUT', DOCUMENT_PATH) == 'write'
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    random.seed(1)
+    for attempt in range(10):
+        delays = [client.backoff_delay(attempt) for _ in range(50)]
+        cap = min(client.RETRY_MAX_DELAY, client.RETRY_BASE_DELAY * 2 ** attempt)
+        assert all(0 <= delay <= cap for delay in delays)
+        assert len(set(delays)) > 1
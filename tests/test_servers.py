@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+import client
+from conftest import StubServer
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def registry(tmp_path, stub):
+    other = StubServer().start()
+    registry = client.ServerRegistry(str(tmp_path / 'servers.json'), default_url=stub.url)
+    registry.add('b', other.url)
+    yield registry
+    registry.close()
+    other.stop()
+
+
+def test_registry_hands_out_one_manager_per_server(registry, tmp_path):
+    assert registry.manager('b') is registry.manager('b')
+    assert registry.activate('b') is registry.manager('b')
+    assert client.ServerRegistry(str(tmp_path / 'servers.json')).active == 'b'
+
+
+def test_switching_back_restarts_health_monitor(registry):
+    first = registry.manager('default')
+    first.health.start()
+    assert wait_until(lambda: first.health.probes >= 1)
+
+    second = client.switch_server(registry, first, 'b')
+    assert wait_until(lambda: second.health.probes >= 1)
+    probes = first.health.probes
+
+    assert client.switch_server(registry, second, 'default') is first
+    assert wait_until(lambda: first.health.probes > probes)
+    first.health.probe_now()
+    assert wait_until(lambda: first.health.probes > probes + 1)
+
+
+def test_fan_out_reports_each_server(registry, stub):
+    stub.add_documents('signals', 2)
+    results = {name: (result, error) for name, result, _, error in
+               registry.fan_out(lambda manager: manager.get_collection_stats('signals'))}
+    assert results['default'][0]['document_count'] == 2
+    assert results['b'][0]['document_count'] == 0
@@ -0,0 +1,89 @@
+import asyncio
+
+import client
+
+DOCUMENTS_PATH = '/api/firebase/collection/signals/documents'
+
+
+def gather(manager, coros):
+    async def run():
+        return await asyncio.gather(*coros)
+    return manager.run(run())
+
+
+def test_concurrent_reads_share_one_request_and_get_own_copies(stub, manager):
+    stub.add_documents('signals', 3)
+    stub.delay = 0.1
+    cache = manager.async_manager.cache
+    results = gather(manager, [manager.async_manager.get_firebase_collections() for _ in range(8)])
+
+    assert stub.count('GET', '/api/firebase/collections') == 1
+    assert (cache.misses, cache.hits) == (1, 0)  # Một lần gọi server, một lần ghi cache
+    results[0]['collections'].append('changed')
+    assert all(result['collections'] == ['signals'] for result in results[1:])
+    stats = manager.single_flight.stats()
+    assert (stats['requests'], stats['shared']) == (1, 7)
+
+
+def test_burst_is_coalesced_until_a_write(stub, manager):
+    stub.add_documents('signals', 3)
+    def read():
+        return manager.run(manager.async_manager.get_collection_documents('signals', use_cache=False))
+
+    first, second = read(), read()
+    assert stub.count('GET', DOCUMENTS_PATH) == 1
+    assert first == second and first is not second
+
+    manager.update_document('signals', 'doc00000', {'title': 'Đã sửa'})
+    assert read()['documents'][0]['title'] == 'Đã sửa'
+    assert stub.count('GET', DOCUMENTS_PATH) == 2
+
+
+def test_failures_are_not_reused(stub, manager, monkeypatch):
+    monkeypatch.setattr(client, 'RETRY_MAX_ATTEMPTS', 1)
+    stub.add_documents('signals', 3)
+    stub.down = True
+    assert manager.run(manager.async_manager.get_collection_documents('signals', offline=False)) is None
+
+    stub.down = False
+    result = manager.run(manager.async_manager.get_collection_documents('signals', offline=False))
+    assert result['count'] == 3
+
+
+def test_cancelled_caller_does_not_cancel_shared_request(stub, manager):
+    stub.delay = 0.1
+
+    async def run():
+        first = asyncio.ensure_future(manager.async_manager._request('GET', '/api/health'))
+        second = asyncio.ensure_future(manager.async_manager._request('GET', '/api/health'))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        return first, await second
+
+    first, response = manager.run(run())
+    assert first.cancelled()
+    assert response.status_code == 200
+    assert stub.count('GET', '/api/health') == 1
+
+
+def test_request_is_cancelled_when_no_caller_waits():
+    flight = client.SingleFlight()
+
+    async def run():
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        waiters = [asyncio.ensure_future(flight.run('key', slow)) for _ in range(2)]
+        await started.wait()
+        task = flight._flights['key']
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        return task.cancelled()
+
+    assert asyncio.run(run()) is True
+    assert not flight._flights and not flight._recent
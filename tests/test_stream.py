@@ -0,0 +1,66 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import client
+
+SNAPSHOT = {'account': {'balance': 1000.0, 'equity': 1000.0}, 'positions': [{'ticket': 1, 'profit': 5.0}],
+            'timestamp': 1}
+
+
+def stream_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'mt5-stream' and thread.is_alive()]
+
+
+def test_stream_yields_snapshot_then_deltas(stub, manager):
+    stub.stream_events = [('snapshot', SNAPSHOT), ('delta', {'account': {'equity': 990.0}})]
+    stop = threading.Event()
+    events = manager.iter_mt5_account_events(stop)
+
+    snapshot, delta = next(events), next(events)
+    stop.set()
+    assert list(events) == []
+    assert (snapshot['type'], snapshot['reset'], snapshot['mode']) == ('snapshot', True, 'stream')
+    assert snapshot['upsert'] == SNAPSHOT['positions']
+    assert (delta['type'], delta['account'], delta['upsert']) == ('delta', {'equity': 990.0}, [])
+
+
+def test_stop_interrupts_idle_stream_without_holding_pool_thread(stub):
+    stub.add_documents('signals', 3)
+    stub.stream_events = [('snapshot', SNAPSHOT)]
+    manager = client.ConfigManager(stub.url, pool_size=2)
+    # Hai kết nối (stream giữ một) nhưng chỉ một thread trong pool chung
+    manager.async_manager._executor.shutdown()
+    manager.async_manager._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mt5-http')
+    try:
+        stop = threading.Event()
+        events = manager.iter_mt5_account_events(stop)
+        assert next(events)['type'] == 'snapshot'
+        assert len(stream_threads()) == 1
+
+        # Stream đang mở mà pool vẫn phục vụ request khác
+        future = manager.submit(manager.async_manager.get_collection_stats('signals'))
+        assert future.result(timeout=5)['document_count'] == 3
+
+        # Server im lặng: dừng phải ngắt ngay, không đợi dòng tiếp theo
+        started = time.monotonic()
+        stop.set()
+        assert list(events) == []
+        assert time.monotonic() - started < 2
+        deadline = time.monotonic() + 2
+        while stream_threads() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert stream_threads() == []
+    finally:
+        manager.close()
+
+
+def test_stream_falls_back_to_polling_when_unsupported(stub, manager):
+    stop = threading.Event()
+    events = manager.iter_mt5_account_events(stop, client.AdaptivePollScheduler())
+    event = next(events)
+    stop.set()
+    events.close()
+    # Stub chưa có /api/mt5-account-info: polling báo lỗi thay vì treo
+    assert (event['type'], event.get('mode')) == ('error', None)
+    assert stub.count('GET', client.MT5_STREAM_PATH) == 1
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import client
+
+
+class ConcurrencyProbe:
+    """delay_for cho StubServer: giữ mỗi request một lúc và ghi lại số request chạy đồng thời"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.active = self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, method, path, body):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return 0
+
+
+def collection_names(count):
+    return [f"c{i}" for i in range(count)]
+
+
+def test_gather_runs_requests_concurrently(stub, manager):
+    for name in collection_names(4):
+        stub.add_documents(name, 1)
+    stub.delay_for = probe = ConcurrencyProbe(0.3)
+
+    started = time.monotonic()
+    results = manager.gather(*[manager.async_manager.get_collection_stats(name) for name in collection_names(4)])
+    assert time.monotonic() - started < 1.0  # Tuần tự cần ít nhất 1.2 giây
+    assert [result['collection'] for result in results] == collection_names(4)
+    assert probe.peak == 4
+
+
+def test_pool_bounds_concurrent_connections(stub):
+    for name in collection_names(6):
+        stub.add_documents(name, 1)
+    stub.delay_for = probe = ConcurrencyProbe(0.1)
+    manager = client.ConfigManager(stub.url, pool_size=2)
+    try:
+        results = manager.gather(*[manager.async_manager.get_collection_stats(name)
+                                   for name in collection_names(6)])
+    finally:
+        manager.close()
+    assert all(result['success'] for result in results)
+    assert probe.peak == 2
+
+
+def test_sync_wrapper_is_usable_from_many_threads(stub, manager):
+    stub.add_documents('signals', 3)
+    results = []
+
+    def read():
+        results.append(manager.get_collection_stats('signals')['document_count'])
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert results == [3] * 8
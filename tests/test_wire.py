@@ -0,0 +1,62 @@
+import pytest
+
+import client
+
+BOOK = [{'ticket': i, 'symbol': 'EURUSD', 'profit': i / 10} for i in range(3)]
+
+
+def compact(book):
+    """Payload dạng $keys/$data: key của mỗi object là chỉ số trong $keys"""
+    keys = list(book[0])
+    return {'$keys': keys, '$data': {'positions': [{keys.index(k): v for k, v in pos.items()} for pos in book]}}
+
+
+def test_decode_json_ignores_content_type_parameters():
+    assert client.decode_body(b'{"a": [1, 2]}', 'application/json; charset=utf-8') == {'a': [1, 2]}
+    assert client.decode_body(b'[]', None) == []
+    assert client.decode_body('{"t": "Lệnh"}'.encode(), 'Application/JSON') == {'t': 'Lệnh'}
+
+
+def test_decode_json_accepts_nan_with_fast_parser():
+    data = client.decode_body(b'{"margin_level": NaN, "n": 1}', 'application/json')
+    assert data['margin_level'] != data['margin_level'] and data['n'] == 1
+
+
+@pytest.mark.parametrize('mime', ['application/msgpack', 'application/x-msgpack'])
+def test_decode_msgpack_with_compact_keys(mime):
+    msgpack = pytest.importorskip('msgpack')
+    assert client.decode_body(msgpack.packb(compact(BOOK)), mime) == {'positions': BOOK}
+    assert client.decode_body(msgpack.packb({'a': b'raw'}), mime) == {'a': b'raw'}
+
+
+def test_decode_cbor_with_compact_keys():
+    cbor2 = pytest.importorskip('cbor2')
+    assert client.decode_body(cbor2.dumps(compact(BOOK)), 'application/cbor') == {'positions': BOOK}
+
+
+def test_compact_keys_leave_string_keys_alone():
+    assert client.expand_keys({0: {'x': [{1: 2}]}, 'y': 3}, ['a', 'b']) == {'a': {'x': [{'b': 2}]}, 'y': 3}
+
+
+def test_negotiation_prefers_binary_formats_when_allowed(monkeypatch):
+    headers = client.negotiation_headers()
+    assert 'gzip' in headers['Accept-Encoding']
+    installed = [mime for mime, module in client.WIRE_BINARY_FORMATS if client.module_available(module)]
+    if installed:
+        assert headers['Accept'].startswith(installed[0])
+    assert 'application/json' in headers['Accept']
+
+    monkeypatch.setattr(client, 'WIRE_ALLOW_BINARY', False)
+    assert client.negotiation_headers()['Accept'] == 'application/json'
+
+
+def test_gzip_responses_are_decoded_and_measured(stub, manager):
+    stub.compress = True
+    stub.add_documents('signals', 200, note='x' * 50)
+    result = manager.run(manager.async_manager.get_collection_documents('signals', limit=200, use_cache=False))
+    assert len(result['documents']) == 200
+
+    stats, = [item for item in manager.async_manager.wire_stats.summary()
+              if item['endpoint'] == '/api/firebase/collection/*/documents']
+    assert stats['formats'] == ['gzip+json']
+    assert stats['wire_bytes'] * 5 < stats['body_bytes']